@@ -65,7 +65,7 @@ def get_exits(self):
     found = {}
     for change, (dir_name, rev_name) in self._movement_strings.items():
         x, y, z = map(sum, zip(self.coords, change))
-        room = Room.get(x=x, y=y, z=z)
+        room = Room.get_at(x, y, z)
         if (not room) and change[2] == 0:  # Don't auto-create "up" and "down"
             room = generate_room(x, y, z)
         if room:
@@ -118,7 +118,7 @@ def move_direction(self, x=0, y=0, z=0):
         # Can't move somewhere from nowhere.
         return
     to_x, to_y, to_z = map(sum, zip(self.room.coords, (x, y, z)))
-    room = Room.get(x=to_x, y=to_y, z=to_z)
+    room = Room.get_at(to_x, to_y, to_z)
     if not room:
         room = generate_room(to_x, to_y, to_z)
     to_dir, from_dir = Room.get_movement_strings((x, y, z))
@@ -136,7 +136,7 @@ def _action(self):
         elif len(coords) != 3:
             raise IndexError
         x, y, z = map(int, coords)
-        room = Room.get(x=x, y=y, z=z)
+        room = Room.get_at(x, y, z)
         if not room:
             room = generate_room(x, y, z)
         poof_out = "{s} disappear{ss} in a puff of smoke."
@@ -383,7 +383,7 @@ EVENTS.unhook("*", "setup_world")
 
 @EVENTS.hook("server_boot", "setup_world", after="parse_terrain_grid")
 def _hook_server_boot():
-    room = Room.get(x=0, y=0, z=0)
+    room = Room.get_at(0, 0, 0)
     if not room:
         generate_room(0, 0, 0)
         log.warning("Had to generate initial room at 0,0,0.")
@@ -42,6 +42,12 @@ class Account(Entity):
         else:
             return "Account<(unnamed)>"
 
+    @property
+    def is_pinned(self):
+        """Return whether this account needs to stay resident in memory."""
+        # Accounts stay resident while they are logged in.
+        return self.active
+
     def login(self, session):
         """Process an account login for a session.
 
@@ -155,6 +161,11 @@ class AccountName(Attribute):
         return name in cls.RESERVED
 
 
+# Accounts are looked up by their email and name, so index them.
+Account.register_cache("email")
+Account.register_cache("name")
+
+
 @REQUESTS.register
 class RequestNewAccountName(Request):
 
@@ -234,6 +245,8 @@ class AccountTrust(Attribute):
 class AccountOptions(DataBlob):
     """A collection of account and client options."""
 
+    __slots__ = ()
+
 
 @AccountOptions.register_attr("reader")
 class AccountOptionsReader(Attribute):
@@ -442,7 +455,7 @@ def _account_menu_select_char(session, char=None):
         return
     if not char.room:
         from .world import Room
-        start_room = Room.get(x=0, y=0, z=0)
+        start_room = Room.get_at(0, 0, 0)
         if start_room:
             char.room = start_room
     session.shell = SHELLS["CharacterShell"]
@@ -5,6 +5,7 @@
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
 from collections import abc
+from weakref import ref
 
 from .logs import get_logger
 from .utils import class_name, joins
@@ -21,6 +22,31 @@ class _DataBlobMeta(HasWeaksMeta):
         super().__init__(name, bases, namespace)
         cls._blobs = {}
         cls._attrs = {}
+        cls._layout = None
+
+    def _get_layout(cls):
+        """Return the compiled layout used to create instances of this blob.
+
+        Attributes that use the plain default value have it copied straight
+        into new blobs, so only attributes with their own `get_default` need
+        to be called for each instance.  The layout is compiled the first
+        time it is needed and again after anything else is registered.
+
+        :returns tuple: The static defaults, and the (name, attribute) pairs
+                        that need their defaults fetched for each instance
+
+        """
+        if cls._layout is None:
+            static = {}
+            dynamic = []
+            for key, attr in cls._attrs.items():
+                if (attr.get_default.__func__
+                        is Attribute.get_default.__func__):
+                    static[key] = attr._default
+                else:
+                    dynamic.append((key, attr))
+            cls._layout = (static, tuple(dynamic))
+        return cls._layout
 
     def register_blob(cls, name):
 
@@ -41,7 +67,8 @@ class _DataBlobMeta(HasWeaksMeta):
                     or not issubclass(blob_class, DataBlob)):
                 raise TypeError("must be subclass of DataBlob to register")
             cls._blobs[name] = blob_class
-            setattr(cls, name, property(lambda s: s._blobs[name]))
+            cls._layout = None
+            setattr(cls, name, property(lambda s: s._blob_values[name]))
             return blob_class
 
         return _inner
@@ -65,6 +92,7 @@ class _DataBlobMeta(HasWeaksMeta):
                     or not issubclass(attr_class, Attribute)):
                 raise TypeError("must be subclass of Attribute to register")
             cls._attrs[name] = attr_class
+            cls._layout = None
             getter = lambda s: s._get_attr_val(name)
             setter = (lambda s, v: s._set_attr_val(name, v)
                       if not attr_class._read_only else None)
@@ -76,7 +104,16 @@ class _DataBlobMeta(HasWeaksMeta):
 
 class DataBlob(HasWeaks, metaclass=_DataBlobMeta):
 
-    """A collection of attributes and sub-blobs on an entity."""
+    """A collection of attributes and sub-blobs on an entity.
+
+    The attributes and sub-blobs registered on a blob class are shared by
+    all of its instances, which only hold their values.  Subclasses should
+    define __slots__ too, or their instances will each get a __dict__.
+
+    """
+
+    __slots__ = ("_attr_values", "_blob_values", "_entity_ref",
+                 "_inst_weak_refs", "__weakref__")
 
     # These are overridden in the metaclass, I just put them here
     # to avoid a lot of unresolved reference errors in IDE introspection.
@@ -86,20 +123,20 @@ class DataBlob(HasWeaks, metaclass=_DataBlobMeta):
     def __init__(self, entity):
         super().__init__()
         self._entity = entity
-        self._attr_values = {}
-        for key, attr in self._attrs.items():
+        static, dynamic = type(self)._get_layout()
+        self._attr_values = static.copy()
+        for key, attr in dynamic:
             self._attr_values[key] = attr.get_default(entity)
-        self._blobs = self._blobs.copy()
-        for key, blob in self._blobs.items():
-            self._blobs[key] = blob(entity)
+        self._blob_values = {key: blob(entity)
+                             for key, blob in self._blobs.items()}
 
     @property
     def _entity(self):
-        return self._get_weak("entity")
+        return self._entity_ref() if self._entity_ref else None
 
     @_entity.setter
     def _entity(self, new_entity):
-        self._set_weak("entity", new_entity)
+        self._entity_ref = ref(new_entity) if new_entity is not None else None
 
     def _get_attr_val(self, name):
         return self._attr_values.get(name)
@@ -114,31 +151,21 @@ class DataBlob(HasWeaks, metaclass=_DataBlobMeta):
             if not raw:
                 value = attr.finalize(entity, value)
         self._attr_values[name] = value
-        entity.dirty()
+        if not attr._transient:
+            entity.dirty()
         attr.changed(entity, self, old_value, value)
         # Update entity caches.
         cache = entity._caches.get(name)
-        if cache:
+        if cache is not None:
             if old_value in cache:
                 cache[old_value].discard(entity)
             if value not in cache:
                 cache[value] = {entity}
             else:
                 cache[value].add(entity)
-
-    def _update(self, blob):
-        """Merge this blob with another, replacing blobs and attrs.
-
-        Sub-blobs and attrs on the given blob with take precedent over those
-        existing on this blob.
-
-        :param DataBlob blob: The blob to merge this blob with
-        :returns None:
-
-        """
-        self._blobs.update(blob._blobs)
-        self._attrs.update(blob._attrs)
-        self._attr_values.update(blob._attr_values)
+        # Update entity attribute indexes.
+        if self is entity._base_blob:
+            entity._update_attr_index(name, old_value, value)
 
     def serialize(self):
         """Create a dict from this blob, sanitized and suitable for storage.
@@ -149,9 +176,11 @@ class DataBlob(HasWeaks, metaclass=_DataBlobMeta):
 
         """
         data = {}
-        for key, blob in self._blobs.items():
+        for key, blob in self._blob_values.items():
             data[key] = blob.serialize()
         for key, attr in self._attrs.items():
+            if attr._transient:
+                continue
             if key in data:
                 raise KeyError(joins("duplicate blob key:", key))
             value = self._attr_values.get(key)
@@ -174,13 +203,16 @@ class DataBlob(HasWeaks, metaclass=_DataBlobMeta):
         """
         for key, value in data.items():
             if key in self._attrs:
+                if self._attrs[key]._transient:
+                    # This may be left over from before it was transient.
+                    continue
                 if value == "unset":
                     value = Unset
                 else:
                     value = self._attrs[key].deserialize(self._entity, value)
                 self._set_attr_val(key, value, validate=False, raw=True)
-            elif key in self._blobs:
-                self._blobs[key].deserialize(value)
+            elif key in self._blob_values:
+                self._blob_values[key].deserialize(value)
             else:
                 log.warning(joins("Unused data while deserializing ",
                                   class_name(self), ": '", key, "':'",
@@ -216,6 +248,9 @@ class Attribute:
 
     _default = Unset  # Do NOT use mutable types for this.
     _read_only = False
+    # Transient attributes are not saved, and changing them will not make
+    # their entity dirty; they need to be rebuilt some other way on load.
+    _transient = False
 
     @classmethod
     def get_default(cls, entity):
@@ -309,9 +344,17 @@ class MutableAttribute(Attribute):
 
     class Proxy:
 
+        # This should match the transience of the proxy's attribute.
+        _transient = False
+
         def __init__(self, entity):
             raise NotImplementedError
 
+        def _changed(self):
+            """Mark this proxy's entity as dirty, unless it is transient."""
+            if not self._transient:
+                self._entity.dirty()
+
     @classmethod
     def get_default(cls, entity):
         """Return a bound proxy instance for this mutable attribute.
@@ -327,7 +370,7 @@ class ListAttribute(MutableAttribute):
 
     """An entity attribute that proxies a list."""
 
-    class Proxy(abc.MutableSequence):
+    class Proxy(MutableAttribute.Proxy, abc.MutableSequence):
 
         def __init__(self, entity, items=()):
             self._items = list(items)
@@ -338,25 +381,25 @@ class ListAttribute(MutableAttribute):
 
         def __setitem__(self, index, value):
             self._items[index] = value
-            self._entity.dirty()
+            self._changed()
 
         def __delitem__(self, index):
             del self._items[index]
-            self._entity.dirty()
+            self._changed()
 
         def __len__(self):
             return len(self._items)
 
         def insert(self, index, value):
             self._items.insert(index, value)
-            self._entity.dirty()
+            self._changed()
 
 
 class DictAttribute(MutableAttribute):
 
     """An entity attribute that proxies a dictionary."""
 
-    class Proxy(abc.MutableMapping):
+    class Proxy(MutableAttribute.Proxy, abc.MutableMapping):
 
         def __init__(self, entity, items=None):
             self._items = dict(items or {})
@@ -367,11 +410,11 @@ class DictAttribute(MutableAttribute):
 
         def __setitem__(self, key, value):
             self._items[key] = value
-            self._entity.dirty()
+            self._changed()
 
         def __delitem__(self, key):
             del self._items[key]
-            self._entity.dirty()
+            self._changed()
 
         def __len__(self):
             return len(self._items)
@@ -384,7 +427,7 @@ class SetAttribute(MutableAttribute):
 
     """An entity attribute that proxies a set."""
 
-    class Proxy(abc.MutableSet):
+    class Proxy(MutableAttribute.Proxy, abc.MutableSet):
 
         def __init__(self, entity, items=()):
             self._items = set(items)
@@ -401,8 +444,8 @@ class SetAttribute(MutableAttribute):
 
         def add(self, value):
             self._items.add(value)
-            self._entity.dirty()
+            self._changed()
 
         def discard(self, value):
             self._items.discard(value)
-            self._entity.dirty()
+            self._changed()
@@ -6,8 +6,8 @@
 
 from . import const
 from .attributes import Attribute, SetAttribute
-from .entities import ENTITIES, Entity
-from .items import ItemListAttribute
+from .entities import ENTITIES, Entity, LazyReferences
+from .items import Item, ItemListAttribute
 from .logs import get_logger
 from .shells import Shell, SHELLS
 from .utils import joins
@@ -19,9 +19,15 @@ log = get_logger("characters")
 
 class CharacterSetAttribute(SetAttribute):
 
-    """An attribute for a set of characters."""
+    """An attribute for a set of characters.
 
-    class Proxy(SetAttribute.Proxy):
+    The characters aren't loaded until the set is first used.
+
+    """
+
+    class Proxy(LazyReferences, SetAttribute.Proxy):
+
+        _reference_type = "Character"
 
         def __repr__(self):
             return repr(self._items)
@@ -33,16 +39,27 @@ class CharacterSetAttribute(SetAttribute):
 
     @classmethod
     def serialize(cls, entity, value):
-        return [character.uid for character in value]
+        return value.get_uids()
 
     @classmethod
     def deserialize(cls, entity, value):
-        return cls.Proxy(entity, [Character.get(uid) for uid in value])
+        return cls.Proxy.from_uids(entity, value)
 
 
 @Room.register_attr("chars")
 class RoomChars(CharacterSetAttribute):
-    """The characters in this room."""
+
+    """The characters in this room.
+
+    This isn't saved with the room, it is filled in by the characters
+    themselves as they are loaded into the room.
+
+    """
+
+    _transient = True
+
+    class Proxy(CharacterSetAttribute.Proxy):
+        _transient = True
 
 
 @ENTITIES.register
@@ -50,6 +67,8 @@ class Character(Entity):
 
     """A MUD character.  So full of potential."""
 
+    __slots__ = ()
+
     _uid_code = "C"
 
     type = "character"
@@ -57,6 +76,15 @@ class Character(Entity):
     def __repr__(self):
         return joins("Character<", self.uid, ">", sep="")
 
+    @classmethod
+    def _get_related_keys(cls, data):
+        # A character's room is loaded along with it, and its inventory is
+        # usually needed soon after, so fetch them with the character.
+        if data.get("room"):
+            yield Room, data["room"]
+        for uid in data.get("inventory", ()):
+            yield Item, uid
+
     @property
     def session(self):
         """Return the current session for this character."""
@@ -245,7 +273,7 @@ class Character(Entity):
             # Can't move somewhere from nowhere.
             return
         to_x, to_y, to_z = map(sum, zip(self.room.coords, (x, y, z)))
-        room = Room.get(x=to_x, y=to_y, z=to_z)
+        room = Room.get_at(to_x, to_y, to_z)
         if not room:
             self.session.send("You can't go that way.")
             return
@@ -280,9 +308,9 @@ class CharacterRoom(Attribute):
 
     @classmethod
     def deserialize(cls, entity, value):
-        room = Room.get(uid=value)
+        room = Room.get(value)
         if not room:
-            room = Room.get(x=0, y=0, z=0, default=KeyError)
+            room = Room.get_at(0, 0, 0, default=KeyError)
         return room
 
 
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Codecs for encoding stored data."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+import json
+import pickle
+import struct
+import zlib
+
+from .utils import joins
+
+
+class Codec:
+
+    """A codec that encodes data blobs to bytes and back."""
+
+    name = None  # The name used to look up this codec.
+    extension = None  # The file extension for data in this codec.
+
+    def encode(self, data):  # pragma: no cover
+        """Encode a data blob.
+
+        :param dict data: The data to encode
+        :returns bytes: The encoded data
+
+        """
+        raise NotImplementedError
+
+    def decode(self, raw):  # pragma: no cover
+        """Decode a data blob.
+
+        :param bytes raw: The encoded data
+        :returns dict: The decoded data
+
+        """
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+
+    """A codec that encodes data as JSON text."""
+
+    name = "json"
+    extension = ".json"
+
+    def __init__(self, indent=None, separators=None):
+        self._indent = indent
+        self._separators = separators
+
+    def encode(self, data):
+        return json.dumps(data, indent=self._indent,
+                          separators=self._separators).encode()
+
+    def decode(self, raw):
+        return json.loads(raw.decode())
+
+
+class PickleCodec(Codec):
+
+    """A codec that pickles data, using the highest protocol by default."""
+
+    name = "pickle"
+    extension = ".pkl"
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        self._protocol = protocol
+
+    def encode(self, data):
+        return pickle.dumps(data, protocol=self._protocol)
+
+    def decode(self, raw):
+        return pickle.loads(raw)
+
+
+# The type tags of the binary codec.  Tags from _SMALL_INT up are used for
+# the integers 0 through 127, which are common enough to get a single byte.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _STR_REF, _LIST, _DICT = range(9)
+_SMALL_INT = 0x80
+_VERSION = 1
+
+_double = struct.Struct("<d")
+
+
+class BinaryCodec(Codec):
+
+    """A codec for a compact binary encoding of JSON-like data.
+
+    Data is encoded as a version byte followed by a tagged value.  Integers
+    are stored as variable length, zigzag encoded numbers and each string
+    after its first appearance in a blob is stored as a reference to it,
+    which keeps blobs full of repeated UIDs and attribute names small.
+
+    Only the types that JSON can hold can be encoded, and like JSON,
+    tuples are decoded as lists.
+
+    """
+
+    name = "binary"
+    extension = ".bin"
+
+    @staticmethod
+    def _write_uint(out, number):
+        while number > 0x7f:
+            out.append((number & 0x7f) | 0x80)
+            number >>= 7
+        out.append(number)
+
+    def _write_str(self, out, value, strings):
+        ref = strings.get(value)
+        if ref is not None:
+            out.append(_STR_REF)
+            self._write_uint(out, ref)
+        else:
+            strings[value] = len(strings)
+            encoded = value.encode()
+            out.append(_STR)
+            self._write_uint(out, len(encoded))
+            out.extend(encoded)
+
+    def _write(self, out, value, strings):
+        # Check for bools before ints, as they are a subclass of int.
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            if 0 <= value < 0x80:
+                out.append(_SMALL_INT | value)
+            else:
+                out.append(_INT)
+                self._write_uint(out, value << 1 if value >= 0
+                                 else ((-value) << 1) - 1)
+        elif isinstance(value, str):
+            self._write_str(out, value, strings)
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out.extend(_double.pack(value))
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            self._write_uint(out, len(value))
+            for item in value:
+                self._write(out, item, strings)
+        elif isinstance(value, dict):
+            out.append(_DICT)
+            self._write_uint(out, len(value))
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    raise TypeError(joins("binary codec keys must be"
+                                          " strings, not", repr(key)))
+                self._write_str(out, key, strings)
+                self._write(out, item, strings)
+        else:
+            raise TypeError(joins("binary codec can't encode",
+                                  type(value).__name__))
+
+    def encode(self, data):
+        out = bytearray((_VERSION,))
+        self._write(out, data, {})
+        return bytes(out)
+
+    def decode(self, raw):
+        if not raw or raw[0] != _VERSION:
+            raise ValueError("unknown binary codec version")
+        strings = []
+        position = 1
+
+        def _read_uint():
+            nonlocal position
+            number = 0
+            shift = 0
+            while True:
+                byte = raw[position]
+                position += 1
+                number |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    return number
+                shift += 7
+
+        def _read():
+            nonlocal position
+            tag = raw[position]
+            position += 1
+            if tag >= _SMALL_INT:
+                return tag - _SMALL_INT
+            if tag == _STR:
+                length = _read_uint()
+                value = raw[position:position + length].decode()
+                position += length
+                strings.append(value)
+                return value
+            if tag == _STR_REF:
+                return strings[_read_uint()]
+            if tag == _DICT:
+                value = {}
+                for _ in range(_read_uint()):
+                    key = _read()
+                    value[key] = _read()
+                return value
+            if tag == _LIST:
+                return [_read() for _ in range(_read_uint())]
+            if tag == _INT:
+                number = _read_uint()
+                return -((number + 1) >> 1) if number & 1 else number >> 1
+            if tag == _FLOAT:
+                position += 8
+                return _double.unpack_from(raw, position - 8)[0]
+            if tag == _NONE:
+                return None
+            if tag == _TRUE:
+                return True
+            if tag == _FALSE:
+                return False
+            raise ValueError(joins("bad binary codec tag:", tag))
+
+        return _read()
+
+
+class ZlibCodec(Codec):
+
+    """A codec that compresses the output of another codec with zlib."""
+
+    def __init__(self, codec, level=6):
+        self._codec = codec
+        self._level = level
+        self.name = codec.name + "+zlib"
+        self.extension = codec.extension + ".z"
+
+    def encode(self, data):
+        return zlib.compress(self._codec.encode(data), self._level)
+
+    def decode(self, raw):
+        return self._codec.decode(zlib.decompress(raw))
+
+
+_codecs = {codec.name: codec for codec in (JSONCodec, PickleCodec,
+                                           BinaryCodec)}
+_wrappers = {"zlib": ZlibCodec}
+
+
+def get_codec(spec):
+    """Create a codec from its name.
+
+    A name can be followed by the names of wrappers to apply to it, joined
+    by "+", such as "binary+zlib".
+
+    :param str spec: The name of the codec
+    :returns Codec: The codec
+    :raises KeyError: If there is no such codec or wrapper
+
+    """
+    name, *wrappers = spec.split("+")
+    if name not in _codecs:
+        raise KeyError(joins("unknown codec:", name))
+    codec = _codecs[name]()
+    for wrapper in wrappers:
+        if wrapper not in _wrappers:
+            raise KeyError(joins("unknown codec wrapper:", wrapper))
+        codec = _wrappers[wrapper](codec)
+    return codec
@@ -22,7 +22,7 @@ class GotoCommand(Command):
             elif len(coords) != 3:
                 raise IndexError
             x, y, z = map(int, coords)
-            room = Room.get(x=x, y=y, z=z)
+            room = Room.get_at(x, y, z)
             if not room:
                 self.session.send("That doesn't seem to be a place.")
                 return
@@ -4,15 +4,19 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
+from collections import deque, OrderedDict
 from copy import deepcopy
-from weakref import WeakValueDictionary
+from time import time as now
+from weakref import ref, WeakValueDictionary
 
 from pylru import lrucache
 
+from .. import settings
 from .attributes import Attribute, DataBlob, Unset
+from .codecs import get_codec
 from .json import JSONStore
 from .logs import get_logger
-from .storage import STORES
+from .storage import check_lookup, split_lookup, STORES
 from .timing import TIMERS
 from .utils import class_name, int_to_base_n, joins
 from .utils.exceptions import AlreadyExists
@@ -33,6 +37,11 @@ _uid_timecode_charset = ("0123456789aAbBcCdDeEfFgGhHijJkKLmM"
 # should generate eight-digit time codes with 100 microsecond precision until
 # October 25th, 2375, and then nine-digit codes well into the 26th millennium.
 
+# The keys in serialized entity data that aren't from the entity's blob.
+_entity_keys = frozenset(("type", "uid", "flags", "tags"))
+# Values of these types never need to be copied when serializing.
+_immutable_types = (str, int, float, bool, type(None))
+
 
 class EntityManager:
 
@@ -71,24 +80,158 @@ class EntityManager:
 
     def save(self):
         """Save the dirty instances of all registered entities."""
-        count = 0
-        for entity in self._entities.values():
-            for instance in entity._instances.values():
-                if instance.is_savable and instance.is_dirty:
-                    instance.save()
-                    count += 1
+        count = self.save_pending()
         if count:
             log.debug("Saved %s dirty entities.", count)
 
+    def save_pending(self, max_count=None, max_time=None, max_age=None,
+                     min_age=None):
+        """Save some of the dirty entities, oldest first.
+
+        This is meant to be called every pulse, to spread the work of
+        saving out over time rather than saving everything at once.  Any
+        entity that has been dirty for longer than `max_age` will be saved
+        regardless of the other limits, and none that have been dirty for
+        less than `min_age` will be saved at all, so that an entity that
+        changes constantly isn't serialized every time this is called.
+
+        Saving only puts an entity's data into its store's transaction; it
+        isn't written until that store is committed.
+
+        :param int max_count: Optional, the most entities to save
+        :param float max_time: Optional, the most seconds to spend saving
+        :param float max_age: Optional, the most seconds an entity can be
+                              dirty before it must be saved
+        :param float min_age: Optional, the fewest seconds an entity must
+                              be dirty before it can be saved
+        :returns int: The number of entities saved
+
+        """
+        start_time = now()
+        count = 0
+        queue = Entity._dirty_queue
+        # Entities of types that aren't registered with this manager are
+        # left in the queue for whatever manager they are registered with.
+        skipped = []
+        while queue:
+            entity_ref, dirty_since = queue[0]
+            entity = entity_ref()
+            if (entity is None or not entity.is_dirty
+                    or entity._dirty_since != dirty_since
+                    or not entity.is_savable):
+                # It's gone, was saved already, or was dirtied again since.
+                queue.popleft()
+                continue
+            if self._entities.get(class_name(entity)) is not type(entity):
+                skipped.append(queue.popleft())
+                continue
+            age = TIMERS.time - dirty_since
+            if min_age is not None and age < min_age:
+                # The queue is in order of age, so none of the rest are old
+                # enough either.
+                break
+            if max_age is None or age < max_age:
+                # The queue is in order of age, so if this one isn't
+                # overdue, none of the rest are either.
+                if max_count is not None and count >= max_count:
+                    break
+                if max_time is not None and now() - start_time >= max_time:
+                    break
+            queue.popleft()
+            entity.save()
+            count += 1
+        queue.extendleft(reversed(skipped))
+        return count
+
+    def evict(self, max_count=None):
+        """Evict the coldest entities of each type that is over its budget.
+
+        The budget for each registered entity type is taken from the
+        ENTITY_BUDGETS setting by its name, falling back to ENTITY_BUDGET.
+        This is meant to be called on a timer, every second or so.
+
+        :param int max_count: Optional, the most entities to evict
+        :returns int: The number of entities evicted
+
+        """
+        count = 0
+        for name, entity_class in self._entities.items():
+            if max_count is not None and count >= max_count:
+                break
+            budget = settings.ENTITY_BUDGETS.get(name, settings.ENTITY_BUDGET)
+            count += entity_class.evict(
+                budget, None if max_count is None else max_count - count)
+        return count
+
 
 class _EntityMeta(HasFlagsMeta, HasWeaksMeta):
 
     def __init__(cls, name, bases, namespace):
         super().__init__(name, bases, namespace)
-        cls._base_blob = type(name + "BaseBlob", (DataBlob,), {})
+        cls._class_blob = type(name + "BaseBlob", (DataBlob,),
+                               {"__slots__": ()})
+        cls._blob_layout = None
         cls._instances = WeakValueDictionary()
         cls._caches = {}
-        cls.register_cache("uid")
+        # Every entity's data is indexed by type, so that finding one type
+        # of entity doesn't require searching the data of all the others.
+        store = getattr(cls, "_store", None)
+        if store is not None and not store.has_index("type"):
+            store.add_index("type")
+        # Indexes registered on a parent class need to be kept on its
+        # subclasses too, as each class only searches its own instances.
+        cls._attr_indexes = {}
+        for base in bases:
+            for key in getattr(base, "_attr_indexes", ()):
+                cls._attr_indexes[key] = {}
+        # The UID cache keeps the resident instances of this entity alive,
+        # coldest first.  It has no size limit of its own, entities are
+        # evicted from it in batches when it goes over budget (see `evict`).
+        cls._caches["uid"] = OrderedDict()
+
+    def _get_blob_layout(cls):
+        """Return the blob class that holds this entity's full layout.
+
+        The attributes and sub-blobs registered on this entity and all of
+        its ancestors are merged into one blob class the first time it is
+        needed, with those of subclasses taking precedence, so creating an
+        entity only needs to create one blob.
+
+        :returns DataBlob: The compiled blob class
+
+        """
+        if cls._blob_layout is None:
+            blobs = {}
+            attrs = {}
+            checked = set()
+
+            def _merge(entity_class):
+                # Merge the parents first so that children replace them.
+                for base in entity_class.__bases__:
+                    _merge(base)
+                if (isinstance(entity_class, _EntityMeta)
+                        and entity_class not in checked):
+                    checked.add(entity_class)
+                    blobs.update(entity_class._class_blob._blobs)
+                    attrs.update(entity_class._class_blob._attrs)
+
+            _merge(cls)
+            layout = type(cls.__name__ + "Blob", (cls._class_blob,),
+                          {"__slots__": ()})
+            layout._blobs = blobs
+            layout._attrs = attrs
+            cls._blob_layout = layout
+        return cls._blob_layout
+
+    def _clear_blob_layout(cls):
+        """Clear the compiled blob layout of this entity and its subclasses.
+
+        :returns None:
+
+        """
+        cls._blob_layout = None
+        for subclass in cls.__subclasses__():
+            subclass._clear_blob_layout()
 
     def register_blob(cls, name):
         """Decorate a data blob to register it on this entity.
@@ -107,8 +250,9 @@ class _EntityMeta(HasFlagsMeta, HasWeaksMeta):
             if (not isinstance(blob_class, type)
                     or not issubclass(blob_class, DataBlob)):
                 raise TypeError("must be subclass of DataBlob to register")
-            cls._base_blob._blobs[name] = blob_class
-            prop = property(lambda s: s._base_blob._blobs[name])
+            cls._class_blob._blobs[name] = blob_class
+            cls._clear_blob_layout()
+            prop = property(lambda s: s._base_blob._blob_values[name])
             setattr(cls, name, prop)
             return blob_class
 
@@ -131,7 +275,8 @@ class _EntityMeta(HasFlagsMeta, HasWeaksMeta):
             if (not isinstance(attr_class, type)
                     or not issubclass(attr_class, Attribute)):
                 raise TypeError("must be subclass of Attribute to register")
-            cls._base_blob._attrs[name] = attr_class
+            cls._class_blob._attrs[name] = attr_class
+            cls._clear_blob_layout()
             getter = lambda s: s._base_blob._get_attr_val(name)
             setter = (lambda s, v: s._base_blob._set_attr_val(name, v)
                       if not attr_class._read_only else None)
@@ -140,31 +285,82 @@ class _EntityMeta(HasFlagsMeta, HasWeaksMeta):
 
         return _inner
 
-    @staticmethod
-    def _cache_eject_callback(key, entity):
-        """A callback for when entities are ejected from a cache.
+    def evict(cls, budget, max_count=None):
+        """Evict the coldest resident instances of this entity.
 
-        When an entity is dumped from all of it's caches, there's a chance
-        it could fall out of scope before every being saved, so we save it
-        on ejection to be sure.
+        Instances are evicted from the UID cache, least recently used first,
+        until no more than `budget` are left; pinned instances are skipped.
+        Dirty instances are saved as they are evicted, so once nothing else
+        refers to them they can be dropped from memory without losing any
+        changes.  This is meant to be called on a timer rather than as
+        entities are loaded, so the cost is kept off of the hot path.
 
-        :param key: The ejected entity's cache key
-        :param Entity entity: The ejected entity
-        :return None:
+        :param int budget: The number of instances that can stay resident
+        :param int max_count: Optional, the most instances to evict
+        :returns int: The number of instances evicted
 
         """
-        entity.save()
+        cache = cls._caches["uid"]
+        excess = len(cache) - budget
+        if max_count is not None:
+            excess = min(excess, max_count)
+        if excess <= 0:
+            return 0
+        evicted = []
+        # Each instance is only checked once, in case most of them are
+        # pinned; pinned instances are treated as recently used.
+        for _ in range(len(cache)):
+            if len(evicted) >= excess:
+                break
+            uid, entity = cache.popitem(last=False)
+            if entity.is_pinned:
+                cache[uid] = entity
+            else:
+                evicted.append(entity)
+        for entity in evicted:
+            if entity.is_dirty and entity.is_savable:
+                entity.save()
+            # The attribute caches would keep them alive otherwise.
+            for key, attr_cache in cls._caches.items():
+                if key == "uid":
+                    continue
+                value = entity._base_blob._get_attr_val(key)
+                if value in attr_cache:
+                    entries = attr_cache.peek(value)
+                    entries.discard(entity)
+                    if not entries:
+                        del attr_cache[value]
+        return len(evicted)
+
+    def _add_attr_index(cls, key):
+        """Add an attribute index to this entity and its subclasses.
+
+        :param str key: The attribute name to index
+        :returns None:
+
+        """
+        if key not in cls._attr_indexes:
+            cls._attr_indexes[key] = {}
+            for entity in cls._instances.values():
+                entity._update_attr_index(
+                    key, None, entity._base_blob._get_attr_val(key))
+        for subclass in cls.__subclasses__():
+            subclass._add_attr_index(key)
 
     def register_cache(cls, key, size=512):
         """Create a new cache for this entity, keyed by attribute.
 
-        Currently these caches are not searched, they merely serve as another
-        reference to keep their entries in _instances alive.
+        Along with the cache, this creates an index of the live instances
+        of this entity (and its subclasses) by the attribute's value, which
+        `find` and `get` will search before falling back to their store.
+        The cache itself serves as another reference to keep its entries
+        in _instances alive, until they are evicted.
 
         There is support for caching UIDs and Attribute values when
         they change, if you want to register anything else (such as bare
         properties not tied to an Attribute) then you'll need to make sure to
-        update the cache yourself when their values change.
+        update the cache yourself when their values change.  Indexed values
+        must be hashable.
 
         :param str key: The attribute name to use as a key
         :param int size: The size of the cache to create
@@ -174,7 +370,7 @@ class _EntityMeta(HasFlagsMeta, HasWeaksMeta):
         """
         if key in cls._caches:
             raise AlreadyExists(key, cls._caches[key])
-        cache = lrucache(size, cls._cache_eject_callback)
+        cache = lrucache(size)
         cls._caches[key] = cache
         # Fill the cache with any existing entity data.
         for entity in cls._instances.values():
@@ -184,42 +380,59 @@ class _EntityMeta(HasFlagsMeta, HasWeaksMeta):
                     cache[attr_value] = {entity}
                 else:
                     cache[attr_value].add(entity)
+        # UIDs are already indexed by _instances.
+        if key != "uid":
+            cls._add_attr_index(key)
 
 
 class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
 
-    """The base of all persistent objects in the game."""
+    """The base of all persistent objects in the game.
+
+    Entities keep their data in slots rather than a __dict__, to keep the
+    cost of each live entity down.  Subclasses that will have many live
+    instances should define __slots__ too, with any new instance variables
+    they need.
 
-    _store = STORES.register("entities", JSONStore("entities"))
+    """
+
+    __slots__ = ("_base_blob", "_dirty", "_dirty_since", "_flags",
+                 "_inst_weak_refs", "_savable", "_tags", "_uid", "active",
+                 "__weakref__")
+
+    _store = STORES.register(
+        "entities", JSONStore("entities",
+                              cache_size=settings.STORE_CACHE_SIZE,
+                              filter_size=settings.STORE_FILTER_SIZE,
+                              sharded=True,
+                              codec=get_codec(settings.STORE_CODEC)))
     _uid_code = "E"
 
     type = "entity"
 
     # These are overridden in the metaclass, I just put them here
     # to avoid a lot of unresolved reference errors in IDE introspection.
-    _base_blob = None
+    _class_blob = None
     _instances = {}
     _caches = {}
+    _attr_indexes = {}
+
+    # A queue of weak references to dirty entities and when they were first
+    # dirtied, shared by all entity types, so that saving only needs to
+    # visit the entities that have actually changed.
+    _dirty_queue = deque()
 
     __uid_timecode = 0  # Used internally for UID creation.
 
     def __init__(self, data=None, active=False, savable=True):
         super().__init__()
 
-        def _build_base_blob(cls, blob=self._base_blob(self), checked=set()):
-            # Recursively update our base blob with the blobs of our parents.
-            for base in cls.__bases__:
-                _build_base_blob(base)
-                # We don't need to do anything with the blob returned by this
-                # because we're abusing the mutability of default arguments.
-            if issubclass(cls, Entity):
-                if cls not in checked:  # pragma: no cover
-                    blob._update(cls._base_blob(self))
-                    checked.add(cls)
-            return blob
-
-        self._base_blob = _build_base_blob(self.__class__)
+        self._base_blob = self.__class__._get_blob_layout()(self)
+        for attr in self._attr_indexes:
+            self._update_attr_index(attr, None,
+                                    self._base_blob._get_attr_val(attr))
         self._dirty = False
+        self._dirty_since = None
         self._savable = savable
 
         # Never, ever manually change an object's UID! There are no checks
@@ -227,7 +440,7 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
         # anything else like that.  Bad things will happen!
         self._uid = None
         if data and "uid" in data:
-            self._set_uid(data.pop("uid"))
+            self._set_uid(data["uid"])
         else:
             self._set_uid(self.make_uid())
 
@@ -274,7 +487,30 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
                 del cache[self._uid]
         self._uid = uid
         self._instances[uid] = self
-        cache[uid] = {self}
+        cache[uid] = self
+
+    def _update_attr_index(self, attr, old_value, new_value):
+        """Move this entity within an attribute index after a change.
+
+        :param str attr: The name of the attribute that changed
+        :param old_value: The attribute's previous value
+        :param new_value: The attribute's new value
+        :returns None:
+
+        """
+        index = self._attr_indexes.get(attr)
+        if index is None:
+            return
+        # Entities are keyed by id rather than by hash, as their hash will
+        # change along with their UID.
+        entries = index.get(old_value)
+        if entries is not None:
+            entries.pop(id(self), None)
+            if not entries:
+                del index[old_value]
+        if new_value not in index:
+            index[new_value] = WeakValueDictionary()
+        index[new_value][id(self)] = self
 
     @property
     def is_dirty(self):
@@ -286,6 +522,34 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
         """Return whether this entity can be saved."""
         return self._store and self._savable
 
+    @property
+    def is_pinned(self):
+        """Return whether this entity needs to stay resident in memory.
+
+        Pinned entities are never evicted; subclasses should override this
+        for entities that are in use, such as players that are online.
+
+        """
+        return False
+
+    def _touch(self):
+        """Mark this entity as recently used, so it stays resident.
+
+        An entity that was evicted but is still live is made resident again.
+
+        :returns None:
+
+        """
+        uid = self._uid
+        if self._instances.get(uid) is not self:
+            # It has been deleted or replaced, so it can't come back.
+            return
+        cache = self._caches["uid"]
+        if uid in cache:
+            cache.move_to_end(uid)
+        else:
+            cache[uid] = self
+
     def _flags_changed(self):
         self.dirty()
 
@@ -294,6 +558,12 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
 
     def dirty(self):
         """Mark this entity as dirty so that it will be saved."""
+        if not self._dirty:
+            self._dirty_since = TIMERS.time
+            self._dirty_queue.append((ref(self), self._dirty_since))
+            # An evicted entity that changes needs to stay resident until
+            # it is saved again.
+            self._touch()
         self._dirty = True
 
     def serialize(self):
@@ -305,27 +575,37 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
         data = self._base_blob.serialize()
         data["type"] = class_name(self)
         data["uid"] = self._uid
-        data["flags"] = self.flags.as_tuple
-        data["tags"] = deepcopy(self.tags.as_dict)
+        # Don't create a flag set or tag collection just to save them.
+        data["flags"] = self._flags.as_tuple if self._flags else ()
+        tags = self._tags.as_dict if self._tags else {}
+        for key, value in tags.items():
+            # Most tags are plain values that can be shared safely, only
+            # containers need to be copied.
+            if not isinstance(value, _immutable_types):
+                tags[key] = deepcopy(value)
+        data["tags"] = tags
         return data
 
     def deserialize(self, data):
         """Update this entity's data using values from a dict.
 
+        The given `data` is not changed, but the entity may keep references
+        to values nested in it, so it should not be shared with anything
+        else that will change it.
+
         :param dict data: The data to deserialize
         :returns None:
 
         """
-        if "type" in data:
-            del data["type"]
         if "uid" in data:
-            self._set_uid(data.pop("uid"))
-        if "flags" in data:
-            self.flags.add(*data.pop("flags"))
-        if "tags" in data:
+            self._set_uid(data["uid"])
+        if data.get("flags"):
+            self.flags.add(*data["flags"])
+        if "tags" in data and (self._tags or data["tags"]):
             self.tags.clear()
-            self.tags.update(data.pop("tags"))
-        self._base_blob.deserialize(data)
+            self.tags.update(data["tags"])
+        self._base_blob.deserialize({key: value for key, value in data.items()
+                                     if key not in _entity_keys})
 
     @classmethod
     def reconstruct(cls, data):
@@ -345,7 +625,7 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
                           given key is not a registered Entity class
 
         """
-        entity_name = data.pop("type", None)
+        entity_name = data.get("type")
         if not entity_name or entity_name not in ENTITIES:
             raise KeyError("failed to reconstruct entity: bad class key")
         entity = ENTITIES[entity_name](data)
@@ -372,14 +652,136 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
         uid = "-".join((cls._uid_code, timecode_string))
         return uid
 
+    @classmethod
+    def _get_stores(cls, subclasses=True):
+        """Return the distinct stores used by this entity.
+
+        :param bool subclasses: Whether to include the stores of subclasses
+        :returns OrderedDict: The names of the entity types saved in each
+                              store, keyed by store, with this entity's own
+                              store first
+
+        """
+        stores = OrderedDict()
+        if cls._store is not None:
+            stores[cls._store] = {cls.__name__}
+        if subclasses:
+            for subclass in cls.__subclasses__():
+                for store, names in subclass._get_stores().items():
+                    if store not in stores:
+                        stores[store] = set()
+                    stores[store].update(names)
+        return stores
+
+    @classmethod
+    def _get_related_keys(cls, data):
+        """Return the keys of other entities needed to load some data.
+
+        Override this to have the entities this entity refers to fetched
+        in the same batch as the data of others of its type.
+
+        :param FrozenDict data: The data of an entity of this type
+        :returns iterable: Pairs of entity classes and keys
+
+        """
+        return ()
+
+    @classmethod
+    def _load(cls, store, key, type_names=None):
+        """Load an entity from a store, unless it is already in memory.
+
+        :param DataStore store: The store to load from
+        :param str key: The key of the entity to load
+        :param set type_names: Optional, the entity types that can be loaded
+        :returns Entity: The loaded entity, or None if it is not one of the
+                         given types
+
+        """
+        found = cls._load_many(store, (key,), type_names)
+        return found[0] if found else None
+
+    @classmethod
+    def _load_many(cls, store, keys, type_names=None):
+        """Load a number of entities from a store in one batch.
+
+        Entities that are already in memory are used as they are.  The
+        data of the entities they refer to is prefetched together before
+        any of them are reconstructed.
+
+        :param DataStore store: The store to load from
+        :param iterable keys: The keys of the entities to load
+        :param set type_names: Optional, the entity types that can be loaded
+        :returns list: The loaded entities, in the order of their keys
+
+        """
+        # Most of the time we only need to check the type, so we don't want
+        # to copy the data until we know we are reconstructing it.
+        found = OrderedDict()
+        needed = []
+        related = OrderedDict()
+        for key, data in store.get_many(keys, readonly=True).items():
+            entity_name = data.get("type")
+            if type_names is not None and entity_name not in type_names:
+                continue
+            if entity_name in ENTITIES:
+                # Reconstructing an entity that is already live would leave
+                # two copies of it in play.
+                entity = ENTITIES[entity_name]._instances.get(key)
+                if entity is not None:
+                    entity._touch()
+                    found[key] = entity
+                    continue
+                for entity_class, related_key in (ENTITIES[entity_name]
+                                                  ._get_related_keys(data)):
+                    related.setdefault(entity_class, []).append(related_key)
+            found[key] = None
+            needed.append((key, data))
+        _prefetch_keys(related)
+        for key, data in needed:
+            found[key] = cls.reconstruct(data.thaw())
+        return list(found.values())
+
+    @classmethod
+    def _get_cache_candidates(cls, attr_value_pairs):
+        """Narrow down the live instances that could match some values.
+
+        :param dict attr_value_pairs: Pairs of attributes and values to
+                                      match against
+        :returns iterable: The candidate entities
+
+        """
+        if "uid" in attr_value_pairs:
+            entity = cls._instances.get(attr_value_pairs["uid"])
+            return () if entity is None else (entity,)
+        candidates = None
+        for attr, value in attr_value_pairs.items():
+            index = cls._attr_indexes.get(attr)
+            if index is None:
+                continue
+            try:
+                entries = index.get(value)
+            except TypeError:
+                # Unhashable values can't be in the index.
+                continue
+            if not entries:
+                return ()
+            if candidates is None or len(entries) < len(candidates):
+                candidates = entries
+        if candidates is None:
+            return cls._instances.values()
+        return list(candidates.values())
+
     @classmethod
     def _find_in_cache(cls, ignore_keys=(), **attr_value_pairs):
         found = set()
-        for key, entity in cls._instances.items():
-            if key in ignore_keys:
+        lookups = [split_lookup(attr) + (value,)
+                   for attr, value in attr_value_pairs.items()]
+        for entity in cls._get_cache_candidates(attr_value_pairs):
+            key = entity.uid
+            if key in ignore_keys or cls._instances.get(key) is not entity:
                 continue
-            for attr, value in attr_value_pairs.items():
-                if getattr(entity, attr) != value:
+            for attr, comparison, value in lookups:
+                if not check_lookup(getattr(entity, attr), comparison, value):
                     break
             else:
                 found.add(entity)
@@ -395,7 +797,9 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
         :param bool subclasses: Whether to check subclasses as well
         :param iterable ignore_keys: A sequence of keys to ignore
         :param iterable attr_value_pairs: Pairs of attributes and values to
-                                          match against
+                                          match against; attributes can be
+                                          suffixed with a comparison, as in
+                                          level__gte=5
         :returns list: A list of found entities, if any
         :raises SyntaxError: If both `cache` and `store` are False
 
@@ -419,16 +823,17 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
                                                ignore_keys=ignore_keys,
                                                **attr_value_pairs))
         if store:
-            found_uids = cls._store.find(ignore_keys=ignore_keys,
-                                         **attr_value_pairs)
-            found.update([cls.reconstruct(cls._store.get(uid))
-                          for uid in found_uids])
-            ignore_keys.update(cls._store.keys())
-            if subclasses:
-                for subclass in cls.__subclasses__():
-                    found.update(subclass.find(cache=False,
-                                               ignore_keys=ignore_keys,
-                                               **attr_value_pairs))
+            # Subclasses will often share a store, so each distinct store
+            # only needs to be searched once.
+            # Searching by type means only the data of the types we're
+            # looking for needs to be checked.
+            for _store, type_names in cls._get_stores(subclasses).items():
+                for type_name in type_names:
+                    key_value_pairs = dict(attr_value_pairs, type=type_name)
+                    found_uids = _store.find(ignore_keys=ignore_keys,
+                                             **key_value_pairs)
+                    found.update(cls._load_many(_store, found_uids))
+                    ignore_keys.update(found_uids)
         return list(found)
 
     @classmethod
@@ -483,21 +888,74 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
         else:
             if cache:
                 if key in cls._instances:
-                    return cls._instances[key]
-            if subclasses:
-                for subclass in cls.__subclasses__():
-                    found = subclass.get(key, cache=cache, store=store)
-                    if found:
-                        return found
+                    entity = cls._instances[key]
+                    entity._touch()
+                    return entity
+                if subclasses:
+                    for subclass in cls.__subclasses__():
+                        found = subclass.get(key, store=False)
+                        if found:
+                            return found
             if store:
-                if cls._store.has(key):
-                    return cls.reconstruct(cls._store.get(key))
+                for _store, type_names in cls._get_stores(subclasses).items():
+                    if _store.has(key):
+                        found = cls._load(_store, key, type_names)
+                        if found:
+                            return found
         # Nothing was found.
         if isinstance(default, type) and issubclass(default, Exception):
             raise default
         else:
             return default
 
+    @classmethod
+    def get_many(cls, keys, cache=True, store=True, subclasses=True):
+        """Get a number of entities by their keys at once.
+
+        Any entities that aren't live are fetched from each store that
+        could hold them in one batch, and reconstructed together.
+
+        :param iterable keys: The keys to get
+        :param bool cache: Whether to check the caches
+        :param bool store: Whether to check the stores
+        :param bool subclasses: Whether to check subclasses as well
+        :returns list: The entities that were found, in the order of their
+                       keys
+
+        """
+        found = OrderedDict((key, None) for key in keys)
+        if cache:
+            for key in found:
+                found[key] = cls.get(key, store=False, subclasses=subclasses)
+        if store:
+            missing = [key for key, entity in found.items() if entity is None]
+            for _store, type_names in cls._get_stores(subclasses).items():
+                if not missing:
+                    break
+                for entity in cls._load_many(_store, missing, type_names):
+                    found[entity.uid] = entity
+                missing = [key for key in missing if found[key] is None]
+        return [entity for entity in found.values() if entity is not None]
+
+    @classmethod
+    def prefetch(cls, keys, subclasses=True):
+        """Hint that a number of entities will be needed soon.
+
+        The data of any of them that aren't live is read into the read
+        caches of the stores that could hold them, one batch per store, so
+        that getting them later won't need a read for each.
+
+        :param iterable keys: The keys of the entities
+        :param bool subclasses: Whether to include the stores of subclasses
+        :returns None:
+
+        """
+        keys = [key for key in keys
+                if cls.get(key, store=False, subclasses=subclasses) is None]
+        if keys:
+            for store in cls._get_stores(subclasses):
+                store.prefetch(keys)
+
     @classmethod
     def all(cls):
         """Return all active instances of this entity.
@@ -563,6 +1021,124 @@ class Entity(HasFlags, HasTags, HasWeaks, metaclass=_EntityMeta):
 ENTITIES = EntityManager()
 
 
+class LazyReferences:
+
+    """A mix-in for attribute proxies that hold a collection of entities.
+
+    A proxy can be created from the UIDs of its entities, which it keeps
+    until it is first used and then loads all at once, so loading the
+    entity it is on doesn't also load everything it refers to.  UIDs that
+    haven't been loaded can be serialized again without loading them.
+
+    Proxies using this need to set `_reference_type` to the name of the
+    registered entity type that they hold.
+
+    """
+
+    _reference_type = None
+    _pending_uids = None
+
+    @classmethod
+    def from_uids(cls, entity, uids):
+        """Create a proxy that will load its entities when first used.
+
+        :param Entity entity: The entity the proxy is on
+        :param iterable uids: The UIDs of the entities in the proxy
+        :returns LazyReferences: The new proxy
+
+        """
+        proxy = cls(entity)
+        uids = list(uids)
+        if uids:
+            proxy._pending_uids = uids
+        return proxy
+
+    @property
+    def _items(self):
+        if self._pending_uids is not None:
+            self.resolve()
+        return self._loaded_items
+
+    @_items.setter
+    def _items(self, items):
+        self._loaded_items = items
+
+    @property
+    def is_resolved(self):
+        """Return whether this proxy's entities have been loaded."""
+        return self._pending_uids is None
+
+    def get_uids(self):
+        """Return the UIDs of this proxy's entities, without loading them.
+
+        :returns list: The UIDs of the entities
+
+        """
+        if self._pending_uids is not None:
+            return list(self._pending_uids)
+        return [entity.uid for entity in self._loaded_items]
+
+    def resolve(self):
+        """Load the entities of this proxy, if they aren't loaded yet.
+
+        :returns None:
+
+        """
+        resolve_references((self,))
+
+
+def _prefetch_keys(related):
+    """Prefetch the data for the keys of a number of entity types.
+
+    Entity types that share a store have their keys fetched together.
+
+    :param dict related: Lists of keys, keyed by entity class
+    :returns None:
+
+    """
+    stores = OrderedDict()
+    for entity_class, keys in related.items():
+        keys = [key for key in keys
+                if entity_class.get(key, store=False) is None]
+        if keys:
+            for store in entity_class._get_stores():
+                stores.setdefault(store, []).extend(keys)
+    for store, keys in stores.items():
+        store.prefetch(keys)
+
+
+def resolve_references(proxies):
+    """Load the entities of a number of lazy reference proxies together.
+
+    Each UID is only loaded once, even if more than one proxy holds it.
+    UIDs that can't be loaded are dropped from their proxies.
+
+    :param iterable proxies: The LazyReferences proxies to resolve
+    :returns None:
+
+    """
+    pending = OrderedDict()
+    for proxy in proxies:
+        if proxy._pending_uids is not None:
+            pending.setdefault(proxy._reference_type, []).append(proxy)
+    for type_name, group in pending.items():
+        entity_class = ENTITIES[type_name]
+        uids = {uid for proxy in group for uid in proxy._pending_uids}
+        loaded = {entity.uid: entity
+                  for entity in entity_class.get_many(uids)}
+        for proxy in group:
+            entities = []
+            for uid in proxy._pending_uids:
+                entity = loaded.get(uid)
+                if entity is None:
+                    log.warning("Could not load %s '%s' for %s.",
+                                type_name, uid, proxy._entity)
+                else:
+                    entities.append(entity)
+            proxy._pending_uids = None
+            proxy._loaded_items = type(proxy._loaded_items)(entities)
+
+
 @Entity.register_attr("version")
 class EntityVersion(Attribute):
 
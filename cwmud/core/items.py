@@ -7,7 +7,7 @@
 from collections import Counter
 
 from .attributes import Attribute, ListAttribute, Unset
-from .entities import ENTITIES, Entity
+from .entities import ENTITIES, Entity, LazyReferences
 from .logs import get_logger
 from .utils import joins
 
@@ -17,9 +17,15 @@ log = get_logger("items")
 
 class ItemListAttribute(ListAttribute):
 
-    """An attribute for a list of items."""
+    """An attribute for a list of items.
 
-    class Proxy(ListAttribute.Proxy):
+    The items aren't loaded until the list is first used.
+
+    """
+
+    class Proxy(LazyReferences, ListAttribute.Proxy):
+
+        _reference_type = "Item"
 
         def __repr__(self):
             return repr(self._items)
@@ -48,11 +54,11 @@ class ItemListAttribute(ListAttribute):
 
     @classmethod
     def serialize(cls, entity, value):
-        return [item.uid for item in value]
+        return value.get_uids()
 
     @classmethod
     def deserialize(cls, entity, value):
-        return cls.Proxy(entity, [Item.get(uid) for uid in value])
+        return cls.Proxy.from_uids(entity, value)
 
 
 @ENTITIES.register
@@ -60,6 +66,8 @@ class Item(Entity):
 
     """An item."""
 
+    __slots__ = ()
+
     _uid_code = "I"
 
     type = "item"
@@ -135,11 +143,17 @@ class ItemContainer(Attribute):
         return container
 
 
+# Items are looked up by their container, so index them.
+Item.register_cache("container")
+
+
 @ENTITIES.register
 class Container(Item):
 
     """A container item."""
 
+    __slots__ = ()
+
     type = "container"
 
     def get_weight(self):
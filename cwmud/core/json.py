@@ -4,30 +4,97 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
+from hashlib import sha1
 import json
-from os import listdir, makedirs, remove
-from os.path import abspath, exists, join, splitext
+from os import listdir, makedirs, remove, replace
+from os.path import abspath, dirname, exists, isdir, join, splitext
+from threading import RLock
 
 from .. import settings
-from ..core.storage import DataStore
+from ..core.codecs import JSONCodec
+from ..core.logs import get_logger
+from ..core.storage import DataStore, load_meta_file, save_meta_file
 from ..core.utils import joins
 
 
+log = get_logger("json")
+
+
 class JSONStore(DataStore):
 
-    """A store that keeps its data in the JSON format."""
+    """A store that keeps its data in the JSON format.
+
+    Each blob is kept in its own file, encoded by the store's codec, which
+    is JSON text unless another codec is given.
+
+    A sharded store splits its files between subdirectories named by the
+    hash of their keys, and keeps a manifest of its keys so that they can
+    be listed and checked without reading those directories.  The manifest
+    is a log of added and removed keys, with a marker of the store's
+    generation after each commit; if the last marker doesn't match the
+    store's generation, a commit was interrupted and the manifest is
+    rebuilt from the files.
+
+    """
 
     _opens = False
+    _snapshots = True
+
+    # How many characters of a key's hash are used to name its shard.
+    _shard_width = 2
+
+    # The manifest is rewritten when it has this many times more lines
+    # than there are keys.
+    _manifest_slack = 2
+
+    def __init__(self, subpath, indent=None, separators=None, cache_size=0,
+                 filter_size=0, sharded=False, codec=None):
+        """Create a new JSON store.
 
-    def __init__(self, subpath, indent=None, separators=None):
-        """Create a new JSON store."""
-        super().__init__()
+        :param str subpath: The path to the store, under the data directory
+        :param int indent: Optional, the indentation to write JSON with
+        :param tuple separators: Optional, the separators to write JSON with
+        :param int cache_size: How many decoded blobs to keep in memory
+        :param int filter_size: How many keys and index values to size the
+                                filter of missing data for
+        :param bool sharded: Whether to split the files into subdirectories
+                             and keep a manifest of their keys
+        :param Codec codec: Optional, the codec to encode the files with
+
+        """
+        super().__init__(cache_size=cache_size, filter_size=filter_size)
         self._path = join(settings.DATA_DIR, "json", subpath)
-        self._indent = indent
-        self._separators = separators
+        if codec is None:
+            codec = JSONCodec(indent=indent, separators=separators)
+        self._codec = codec
+        self._ext = codec.extension
+        self._sharded = sharded
         # Make sure the path to the JSON store exists.
         if not exists(self._path):
             makedirs(self._path)
+        if sharded:
+            # The manifest is shared with the background writer thread, so
+            # any use of it needs to hold the lock.
+            self._lock = RLock()
+            self._manifest = set()
+            self._manifest_lines = 0
+            # The generation of the last commit marked in the manifest.
+            self._manifest_generation = 0
+            self._shards = set()
+            self._load_manifest()
+
+    @property
+    def _manifest_path(self):
+        return join(self._path, "keys.manifest")
+
+    def _split_name(self, name):
+        # Extensions like ".bin.z" have more than one part.
+        if name.endswith(self._ext):
+            return name[:-len(self._ext)], self._ext
+        return splitext(name)
+
+    def _get_shard(self, key):
+        return sha1(key.encode()).hexdigest()[:self._shard_width]
 
     def _get_key_path(self, key):
         """Validate and return an absolute path for a JSON file.
@@ -40,11 +107,84 @@ class JSONStore(DataStore):
         """
         if not isinstance(key, str):
             raise TypeError("JSON keys must be strings")
-        path = abspath(join(self._path, key + ".json"))
+        if self._sharded:
+            path = abspath(join(self._path, self._get_shard(key),
+                                key + self._ext))
+        else:
+            path = abspath(join(self._path, key + self._ext))
         if not path.startswith(abspath(self._path)):
             raise OSError(joins("invalid path to JSON file:", path))
         return path
 
+    def _load_manifest(self):
+        """Load the manifest of keys, rebuilding it if it is out of date."""
+        if exists(self._manifest_path):
+            keys = set()
+            lines = 0
+            generation = 0
+            with open(self._manifest_path, "r") as manifest_file:
+                for line in manifest_file:
+                    if not line.endswith("\n"):
+                        # The rest of this line was never written.
+                        break
+                    lines += 1
+                    if line[0] == "+":
+                        keys.add(json.loads(line[1:]))
+                    elif line[0] == "-":
+                        keys.discard(json.loads(line[1:]))
+                    elif line[0] == "=":
+                        generation = int(line[1:])
+            if generation == self.generation:
+                self._manifest = keys
+                self._manifest_lines = lines
+                self._manifest_generation = generation
+                if lines > len(keys) * self._manifest_slack:
+                    self._rewrite_manifest()
+                return
+            log.warning("Manifest of %s is out of date, rebuilding it.",
+                        self)
+        self._rebuild_manifest()
+
+    def _rebuild_manifest(self):
+        """Rebuild the manifest of keys from the files in this store.
+
+        Any files left in the base directory from before the store was
+        sharded are moved into their shards.
+
+        """
+        keys = set()
+        for name in listdir(self._path):
+            path = join(self._path, name)
+            key, ext = self._split_name(name)
+            if ext == self._ext:
+                new_path = self._get_key_path(key)
+                makedirs(dirname(new_path), exist_ok=True)
+                replace(path, new_path)
+                keys.add(key)
+            elif len(name) == self._shard_width and isdir(path):
+                for shard_name in listdir(path):
+                    key, ext = self._split_name(shard_name)
+                    if ext == self._ext:
+                        keys.add(key)
+        self._manifest = keys
+        self._manifest_generation = self.generation
+        self._rewrite_manifest()
+
+    def _rewrite_manifest(self):
+        """Write out a new manifest with only the current keys."""
+        temp_path = self._manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            for key in self._manifest:
+                manifest_file.write("+" + json.dumps(key) + "\n")
+            manifest_file.write("=" + str(self._manifest_generation) + "\n")
+        replace(temp_path, self._manifest_path)
+        self._manifest_lines = len(self._manifest) + 1
+
+    def _append_manifest(self, lines):
+        with open(self._manifest_path, "a") as manifest_file:
+            manifest_file.write("".join(lines))
+        self._manifest_lines += len(lines)
+
     def _is_open(self):  # pragma: no cover
         return True
 
@@ -54,32 +194,112 @@ class JSONStore(DataStore):
     def _close(self):  # pragma: no cover
         pass
 
+    def _get_meta(self, name):
+        return load_meta_file(join(self._path, name + ".meta"))
+
+    def _put_meta(self, name, value):
+        save_meta_file(join(self._path, name + ".meta"), value)
+
     def _keys(self):
         """Return an iterator through the JSON files in this store."""
+        if self._sharded:
+            with self._lock:
+                return iter(list(self._manifest))
+        return self._list_keys()
+
+    def _list_keys(self):
         for name in listdir(abspath(self._path)):
-            key, ext = splitext(name)
-            if ext == ".json":
+            key, ext = self._split_name(name)
+            if ext == self._ext:
                 yield key
 
     def _has(self, key):
         """Return whether a JSON file exists or not."""
-        path = self._get_key_path(key)
-        return exists(path)
+        if self._sharded:
+            if not isinstance(key, str):
+                raise TypeError("JSON keys must be strings")
+            with self._lock:
+                return key in self._manifest
+        return exists(self._get_key_path(key))
 
     def _get(self, key):
         """Fetch the data from a JSON file."""
         path = self._get_key_path(key)
-        with open(path, "r") as json_file:
-            return json.load(json_file)
+        with open(path, "rb") as json_file:
+            return self._codec.decode(json_file.read())
 
     def _put(self, key, data):
         """Store data in a JSON file."""
+        if self._sharded:
+            self._write([(key, data)])
+        else:
+            self._put_file(key, data)
+
+    def _put_file(self, key, data):
         path = self._get_key_path(key)
-        with open(path, "w") as json_file:
-            json.dump(data, json_file, indent=self._indent,
-                      separators=self._separators)
+        if self._sharded:
+            shard = dirname(path)
+            if shard not in self._shards:
+                makedirs(shard, exist_ok=True)
+                self._shards.add(shard)
+        with open(path, "wb") as json_file:
+            json_file.write(self._codec.encode(data))
 
     def _delete(self, key):
         """Delete a JSON file."""
-        path = self._get_key_path(key)
-        remove(path)
+        if self._sharded:
+            self._write([(key, None)])
+        else:
+            remove(self._get_key_path(key))
+
+    def _write(self, items):
+        """Write a batch of JSON files, updating the manifest once.
+
+        The files are written without holding the lock, so that checking
+        the manifest doesn't have to wait for a whole batch to be written;
+        until it is updated, the data is still read back from the commit.
+
+        """
+        if not self._sharded:
+            super()._write(items)
+            return
+        added = []
+        removed = []
+        for key, data in items:
+            if data is None:
+                try:
+                    remove(self._get_key_path(key))
+                except FileNotFoundError:
+                    continue
+                removed.append(key)
+            else:
+                self._put_file(key, data)
+                added.append(key)
+        with self._lock:
+            lines = []
+            for key in removed:
+                if key in self._manifest:
+                    self._manifest.discard(key)
+                    lines.append("-" + json.dumps(key) + "\n")
+            for key in added:
+                if key not in self._manifest:
+                    self._manifest.add(key)
+                    lines.append("+" + json.dumps(key) + "\n")
+            if lines:
+                self._append_manifest(lines)
+
+    def _write_commit(self, items, generation):
+        super()._write_commit(items, generation)
+        if self._sharded:
+            # Mark the manifest as complete up to this commit.
+            with self._lock:
+                self._append_manifest(["=" + str(generation) + "\n"])
+                self._manifest_generation = generation
+
+    def compact(self):
+        """Rewrite the manifest of a sharded store if it has grown large."""
+        if self._sharded:
+            with self._lock:
+                if (self._manifest_lines
+                        > len(self._manifest) * self._manifest_slack):
+                    self._rewrite_manifest()
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""Log-structured data storage."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+import json
+from os import listdir, makedirs, remove, replace
+from os.path import exists, getsize, join, splitext
+from threading import RLock
+
+from .. import settings
+from .logs import get_logger
+from .storage import (DataStore, _get_writer, load_meta_file,
+                      save_meta_file)
+from .utils import joins
+
+
+log = get_logger("logstore")
+
+
+class LogStore(DataStore):
+
+    """A store that appends its data to a log of segment files.
+
+    Every commit is appended to the end of the active segment as a single
+    sequential write, and an in-memory map of keys to their offsets is used
+    to read them back.  Once a segment grows past `max_segment_size`, it is
+    sealed and a new segment is started; sealed segments are merged and
+    stripped of dead records by `compact`.
+
+    Each record is one line of JSON in the form [key, data], where data is
+    null for a deleted key.  A segment written by compaction starts with a
+    header line listing the segments it replaces.
+
+    """
+
+    _opens = False
+    _snapshots = True
+
+    def __init__(self, subpath, max_segment_size=4 * 1024 * 1024,
+                 compact_segments=4, cache_size=0, filter_size=0):
+        """Create a new log store.
+
+        :param str subpath: The path to the store, under the data directory
+        :param int max_segment_size: The size, in bytes, at which the active
+                                     segment will be sealed
+        :param int compact_segments: How many sealed segments there can be
+                                     before they will always be compacted
+        :param int cache_size: How many decoded blobs to keep in memory
+        :param int filter_size: How many keys and index values to size the
+                                filter of missing data for
+
+        """
+        super().__init__(cache_size=cache_size, filter_size=filter_size)
+        self._path = join(settings.DATA_DIR, "log", subpath)
+        self._max_segment_size = max_segment_size
+        self._compact_segments = compact_segments
+        # The location of each key's current record, as a tuple of
+        # (segment, offset, length).
+        self._offsets = {}
+        # The total and live (not yet overwritten or deleted) record bytes
+        # in each segment.
+        self._sizes = {}
+        self._live = {}
+        self._segment = 1
+        # The key map is shared with the background writer thread, so any
+        # use of it needs to hold the lock.
+        self._lock = RLock()
+        # Make sure the path to the log store exists.
+        if not exists(self._path):
+            makedirs(self._path)
+        self._load()
+
+    def _get_segment_path(self, segment):
+        return join(self._path, "{:08d}.seg".format(segment))
+
+    def _load(self):
+        """Rebuild the key map by reading through every segment."""
+        segments = []
+        for name in listdir(self._path):
+            segment, ext = splitext(name)
+            if ext == ".seg" and segment.isdigit():
+                segments.append(int(segment))
+        segments.sort()
+        replaced = set()
+        for segment in reversed(segments):
+            if segment in replaced:
+                continue
+            replaced.update(self._read_header(segment))
+        for segment in segments:
+            if segment in replaced:
+                # The output of a compaction was saved, but the server
+                # stopped before it could remove the old segments.
+                remove(self._get_segment_path(segment))
+                continue
+            self._load_segment(segment)
+        if segments:
+            self._segment = max(set(segments) - replaced)
+
+    def _read_header(self, segment):
+        with open(self._get_segment_path(segment), "rb") as segment_file:
+            line = segment_file.readline()
+        try:
+            if not line.endswith(b"\n"):
+                raise ValueError("incomplete record")
+            header = json.loads(line.decode())
+        except ValueError:
+            # A torn first record is not a header; it will be truncated
+            # when the segment is loaded.
+            return ()
+        if isinstance(header, dict):
+            return header.get("replaces", ())
+        return ()
+
+    def _load_segment(self, segment):
+        path = self._get_segment_path(segment)
+        self._sizes[segment] = 0
+        self._live[segment] = 0
+        with open(path, "rb") as segment_file:
+            offset = 0
+            for line in segment_file:
+                length = len(line)
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line.decode())
+                except ValueError:
+                    # The server must have stopped partway through writing
+                    # this record, so drop it and anything after it.
+                    log.warning("Truncating bad record in %s at %s.",
+                                path, offset)
+                    break
+                if isinstance(record, list):
+                    key, data = record
+                    self._set_location(key, None if data is None
+                                       else (segment, offset, length))
+                offset += length
+                self._sizes[segment] = offset
+        if getsize(path) > offset:
+            with open(path, "r+b") as segment_file:
+                segment_file.truncate(offset)
+
+    def _set_location(self, key, location):
+        old_location = self._offsets.get(key)
+        if old_location:
+            self._live[old_location[0]] -= old_location[2]
+        if location is None:
+            if key in self._offsets:
+                del self._offsets[key]
+        else:
+            self._offsets[key] = location
+            self._live[location[0]] += location[2]
+
+    def _is_open(self):  # pragma: no cover
+        return True
+
+    def _open(self):  # pragma: no cover
+        pass
+
+    def _close(self):  # pragma: no cover
+        pass
+
+    def _get_meta(self, name):
+        return load_meta_file(join(self._path, name + ".meta"))
+
+    def _put_meta(self, name, value):
+        save_meta_file(join(self._path, name + ".meta"), value)
+
+    def _keys(self):
+        """Return an iterator through the keys in this store."""
+        with self._lock:
+            return iter(list(self._offsets))
+
+    def _has(self, key):
+        """Return whether a key has a live record or not."""
+        if not isinstance(key, str):
+            raise TypeError("log store keys must be strings")
+        with self._lock:
+            return key in self._offsets
+
+    def _get(self, key):
+        """Fetch the data from a key's latest record."""
+        if not isinstance(key, str):
+            raise TypeError("log store keys must be strings")
+        with self._lock:
+            segment, offset, length = self._offsets[key]
+            with open(self._get_segment_path(segment), "rb") as segment_file:
+                segment_file.seek(offset)
+                record = segment_file.read(length)
+        return json.loads(record.decode())[1]
+
+    def _get_many(self, keys):
+        """Fetch the data from the latest records of a number of keys.
+
+        The records are read in the order they are stored, opening each
+        segment only once.
+
+        """
+        for key in keys:
+            if not isinstance(key, str):
+                raise TypeError("log store keys must be strings")
+        records = []
+        with self._lock:
+            locations = sorted((self._offsets[key], key) for key in keys
+                               if key in self._offsets)
+            segment_file = None
+            open_segment = None
+            try:
+                for (segment, offset, length), key in locations:
+                    if segment != open_segment:
+                        if segment_file:
+                            segment_file.close()
+                        segment_file = open(self._get_segment_path(segment),
+                                            "rb")
+                        open_segment = segment
+                    segment_file.seek(offset)
+                    records.append((key, segment_file.read(length)))
+            finally:
+                if segment_file:
+                    segment_file.close()
+        return ((key, json.loads(record.decode())[1])
+                for key, record in records)
+
+    def _put(self, key, data):
+        """Append a record of data for a key."""
+        self._write([(key, data)])
+
+    def _delete(self, key):
+        """Append a record of a key's deletion."""
+        self._write([(key, None)])
+
+    def _write(self, items):
+        """Append a batch of records to the active segment in one write."""
+        with self._lock:
+            self._write_records(items)
+
+    def _write_records(self, items):
+        records = []
+        for key, data in items:
+            if not isinstance(key, str):
+                raise TypeError("log store keys must be strings")
+            if data is None and key not in self._offsets:
+                continue
+            records.append((key, data, json.dumps(
+                [key, data], separators=(",", ":")).encode() + b"\n"))
+        if not records:
+            return
+        batch_size = sum(len(record) for _, _, record in records)
+        size = self._sizes.get(self._segment, 0)
+        if size and size + batch_size > self._max_segment_size:
+            # Seal the active segment and start a new one.
+            self._segment += 1
+            size = 0
+        self._sizes.setdefault(self._segment, 0)
+        self._live.setdefault(self._segment, 0)
+        path = self._get_segment_path(self._segment)
+        with open(path, "ab") as segment_file:
+            segment_file.write(b"".join(record for _, _, record in records))
+        for key, data, record in records:
+            self._set_location(key, None if data is None
+                               else (self._segment, size, len(record)))
+            size += len(record)
+        self._sizes[self._segment] = size
+
+    def compact(self, force=False):
+        """Merge the sealed segments of this store, dropping dead records.
+
+        Unless `force` is True, this will only compact when there are too
+        many sealed segments or at least half of their data is dead.
+
+        The records are copied by the background writer thread, so this
+        returns without waiting for them; the key map is only locked while
+        the compacted segment is swapped in.
+
+        :param bool force: Whether to compact regardless of dead space
+        :returns Future: A future for the compaction
+
+        """
+        return _get_writer().submit(self._compact, force)
+
+    def _compact(self, force):
+        with self._lock:
+            sealed = sorted(segment for segment in self._sizes
+                            if segment < self._segment)
+            if not sealed:
+                return
+            total = sum(self._sizes[segment] for segment in sealed)
+            live = sum(self._live[segment] for segment in sealed)
+            if (not force and len(sealed) < self._compact_segments
+                    and live * 2 > total):
+                return
+            sealed_set = set(sealed)
+            moved = sorted((location, key) for key, location
+                           in self._offsets.items()
+                           if location[0] in sealed_set)
+        # Sealed segments are never written to again, so they can be read
+        # without the lock while new records go to the active segment.
+        target = sealed[-1]
+        temp_path = self._get_segment_path(target) + ".tmp"
+        new_locations = []
+        with open(temp_path, "wb") as out_file:
+            header = json.dumps({"replaces": sealed[:-1]}).encode() + b"\n"
+            out_file.write(header)
+            offset = len(header)
+            readers = {}
+            try:
+                for location, key in moved:
+                    segment, old_offset, length = location
+                    if segment not in readers:
+                        readers[segment] = open(
+                            self._get_segment_path(segment), "rb")
+                    reader = readers[segment]
+                    reader.seek(old_offset)
+                    out_file.write(reader.read(length))
+                    new_locations.append((key, location,
+                                          (target, offset, length)))
+                    offset += length
+            finally:
+                for reader in readers.values():
+                    reader.close()
+        with self._lock:
+            # Once the compacted segment replaces the newest sealed one,
+            # the others are obsolete; if we stop before removing them,
+            # they will be skipped and removed the next time the store is
+            # loaded.
+            replace(temp_path, self._get_segment_path(target))
+            for segment in sealed:
+                self._sizes.pop(segment, None)
+                self._live.pop(segment, None)
+            self._sizes[target] = offset
+            self._live[target] = 0
+            for key, old_location, location in new_locations:
+                # Keys that were overwritten or deleted while the records
+                # were being copied have already moved on, so their copies
+                # are dead.
+                if self._offsets.get(key) == old_location:
+                    self._offsets[key] = location
+                    self._live[target] += location[2]
+        for segment in sealed[:-1]:
+            remove(self._get_segment_path(segment))
+        log.debug(joins("Compacted", len(sealed), "segments of", self,
+                        "from", total, "to", offset, "bytes."))
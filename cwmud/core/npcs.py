@@ -9,6 +9,7 @@ import re
 from .attributes import Attribute
 from .characters import Character
 from .entities import ENTITIES
+from .events import EVENTS
 from .logs import get_logger
 from .utils import joins
 
@@ -21,6 +22,8 @@ class NPC(Character):
 
     """A non-player character."""
 
+    __slots__ = ()
+
     _uid_code = "N"
 
     type = "npc"
@@ -97,3 +100,12 @@ class NPCLongDesc(Attribute):
     """An NPC's long description."""
 
     default = "There's nothing particularly interesting about them."
+
+
+@EVENTS.hook("server_boot", "load_npcs", after="setup_world")
+def _hook_server_boot():
+    # Room occupancy isn't saved, so NPCs need to be loaded at boot to put
+    # them back in their rooms.
+    npcs = NPC.find(cache=False)
+    if npcs:
+        log.info("Loaded %s NPCs into their rooms.", len(npcs))
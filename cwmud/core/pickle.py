@@ -5,23 +5,30 @@
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
 from os import listdir, makedirs, remove
-from os.path import abspath, exists, join, splitext
-import pickle
+from os.path import abspath, exists, join
 
 from .. import settings
-from .storage import DataStore
+from .codecs import PickleCodec
+from .storage import DataStore, load_meta_file, save_meta_file
 from .utils import joins
 
 
 class PickleStore(DataStore):
 
-    """A store that pickles its data."""
+    """A store that pickles its data.
+
+    Each blob is kept in its own file, encoded by the store's codec, which
+    pickles it with the highest protocol unless another codec is given.
+
+    """
 
     _opens = False
+    _snapshots = True
 
-    def __init__(self, subpath):
+    def __init__(self, subpath, cache_size=0, filter_size=0, codec=None):
         """Create a new pickle store."""
-        super().__init__()
+        super().__init__(cache_size=cache_size, filter_size=filter_size)
+        self._codec = codec or PickleCodec()
         self._path = join(settings.DATA_DIR, "pickle", subpath)
         # Make sure the path to the pickle store exists.
         if not exists(self._path):
@@ -38,7 +45,7 @@ class PickleStore(DataStore):
         """
         if not isinstance(key, str):
             raise TypeError("pickle keys must be strings")
-        path = abspath(join(self._path, key + ".pkl"))
+        path = abspath(join(self._path, key + self._codec.extension))
         if not path.startswith(abspath(self._path)):
             raise OSError(joins("invalid path to pickle file:", path))
         return path
@@ -52,12 +59,18 @@ class PickleStore(DataStore):
     def _close(self):  # pragma: no cover
         pass
 
+    def _get_meta(self, name):
+        return load_meta_file(join(self._path, name + ".meta"))
+
+    def _put_meta(self, name, value):
+        save_meta_file(join(self._path, name + ".meta"), value)
+
     def _keys(self):
         """Return an iterator through the pickle files in this store."""
+        ext = self._codec.extension
         for name in listdir(abspath(self._path)):
-            key, ext = splitext(name)
-            if ext == ".pkl":
-                yield key
+            if name.endswith(ext):
+                yield name[:-len(ext)]
 
     def _has(self, key):
         """Return whether a pickle file exists or not."""
@@ -68,13 +81,13 @@ class PickleStore(DataStore):
         """Fetch the data from a pickle file."""
         path = self._get_key_path(key)
         with open(path, "rb") as pickle_file:
-            return pickle.load(pickle_file)
+            return self._codec.decode(pickle_file.read())
 
     def _put(self, key, data):
         """Store data in a pickle file."""
         path = self._get_key_path(key)
         with open(path, "wb") as pickle_file:
-            pickle.dump(data, pickle_file)
+            pickle_file.write(self._codec.encode(data))
 
     def _delete(self, key):
         """Delete a pickle file."""
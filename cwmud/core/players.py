@@ -24,6 +24,8 @@ class Player(Character):
 
     """A player character."""
 
+    __slots__ = ()
+
     _uid_code = "P"
 
     type = "player"
@@ -34,6 +36,12 @@ class Player(Character):
         else:
             return "Player<(unnamed)>"
 
+    @property
+    def is_pinned(self):
+        """Return whether this player needs to stay resident in memory."""
+        # Players stay resident while they are online.
+        return self.active
+
     def get_name(self):
         """Get this character's name."""
         return self.name
@@ -142,6 +150,11 @@ class PlayerName(Attribute):
         return name in cls.RESERVED
 
 
+# Players are looked up by their account and name, so index them.
+Player.register_cache("account")
+Player.register_cache("name")
+
+
 @REQUESTS.register
 class RequestNewPlayerName(Request):
 
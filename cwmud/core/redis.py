@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""Redis data storage."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+import json
+
+import redis
+
+from .codecs import JSONCodec
+from .logs import get_logger
+from .storage import DataStore, NO_VALUE
+from .utils import joins
+
+
+log = get_logger("redis")
+
+
+class RedisStore(DataStore):
+
+    """A store that keeps its data in Redis.
+
+    Every blob is kept in one Redis hash, keyed by its store key, and each
+    index is kept as a set of store keys for each indexed value.  Commits
+    are written in a single MULTI transaction, so that any number of blobs
+    and their index changes take one round trip.
+
+    Since the data can be shared with other processes, this store doesn't
+    keep a read cache or a filter of missing data, and the indexes are read
+    from Redis rather than kept in memory.  Only exact values are looked up
+    through the indexes; range and prefix lookups check every blob.
+
+    """
+
+    _opens = False
+
+    def __init__(self, subpath, connection=None, codec=None):
+        """Create a new Redis store.
+
+        :param str subpath: The name of the store, used to prefix its keys
+        :param redis.StrictRedis connection: Optional, the connection to
+                                             use; it must not decode its
+                                             responses
+        :param Codec codec: Optional, the codec to encode blobs with
+
+        """
+        super().__init__()
+        self._redis = connection or redis.StrictRedis()
+        self._codec = codec or JSONCodec(separators=(",", ":"))
+        self._prefix = "cwmud:store:" + subpath
+        self._blobs_key = self._prefix + ":blobs"
+        self._meta_key = self._prefix + ":meta"
+
+    @staticmethod
+    def _check_key(key):
+        if not isinstance(key, str):
+            raise TypeError("Redis keys must be strings")
+
+    def _get_index_set(self, index_key, value):
+        """Return the name of the Redis set for a value of an index."""
+        if isinstance(index_key, tuple):
+            index_key = ",".join(index_key)
+        return joins(self._prefix, "index", index_key,
+                     json.dumps(value, sort_keys=True), sep=":")
+
+    def _is_open(self):  # pragma: no cover
+        return True
+
+    def _open(self):  # pragma: no cover
+        pass
+
+    def _close(self):  # pragma: no cover
+        pass
+
+    def _get_meta(self, name):
+        # The metadata is kept as JSON rather than pickled, since anything
+        # with access to the Redis server could have written it.
+        value = self._redis.hget(self._meta_key, name)
+        if value is None:
+            return None
+        try:
+            return json.loads(value.decode())
+        except ValueError:
+            log.warning("Ignoring unreadable metadata '%s' for %s.",
+                        name, self)
+            return None
+
+    def _put_meta(self, name, value):
+        self._redis.hset(self._meta_key, name, json.dumps(value))
+
+    def _keys(self):
+        """Return an iterator through the keys in this store."""
+        return (key.decode() for key in self._redis.hkeys(self._blobs_key))
+
+    def _has(self, key):
+        """Return whether a key exists in Redis or not."""
+        self._check_key(key)
+        return self._redis.hexists(self._blobs_key, key)
+
+    def _get(self, key):
+        """Fetch the data for a key from Redis."""
+        self._check_key(key)
+        raw = self._redis.hget(self._blobs_key, key)
+        if raw is None:
+            raise KeyError(key)
+        return self._codec.decode(raw)
+
+    def _get_many(self, keys):
+        """Fetch the data for a number of keys from Redis at once."""
+        for key in keys:
+            self._check_key(key)
+        if not keys:
+            return ()
+        return ((key, self._codec.decode(raw))
+                for key, raw in zip(keys, self._redis.hmget(self._blobs_key,
+                                                            keys))
+                if raw is not None)
+
+    def _put(self, key, data):
+        """Store data for a key in Redis."""
+        self._write([(key, data)])
+
+    def _delete(self, key):
+        """Delete the data for a key from Redis."""
+        self._write([(key, None)])
+
+    def _write(self, items):
+        """Write a batch of data to Redis in one transaction.
+
+        The old data for the keys is read first, so that their old index
+        values can be removed; if another process changes the data before
+        the transaction is run, it is tried again.
+
+        """
+        items = list(items)
+        keys = [key for key, data in items]
+        for key in keys:
+            self._check_key(key)
+        if not keys:
+            return
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._blobs_key)
+                    old_blobs = pipe.hmget(self._blobs_key, keys)
+                    changes = self._get_index_changes(pipe, items, old_blobs)
+                    pipe.multi()
+                    for key, data in items:
+                        if data is None:
+                            pipe.hdel(self._blobs_key, key)
+                        else:
+                            pipe.hset(self._blobs_key, key,
+                                      self._codec.encode(data))
+                    for index_set, key in changes["remove"]:
+                        pipe.srem(index_set, key)
+                    for index_set, key in changes["add"]:
+                        pipe.sadd(index_set, key)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def _get_index_changes(self, pipe, items, old_blobs):
+        """Work out the changes a batch of data makes to the index sets.
+
+        :param redis.client.Pipeline pipe: The watching pipeline
+        :param list items: Pairs of keys and data to write
+        :param list old_blobs: The raw data now stored for those keys
+        :returns dict: Lists of (set name, key) pairs to "add" and "remove"
+        :raises KeyError: If the data would break a unique index
+
+        """
+        changes = {"add": [], "remove": []}
+        unique_checks = []
+        for (key, data), raw in zip(items, old_blobs):
+            old_data = self._codec.decode(raw) if raw is not None else None
+            for index_key in self._indexes:
+                value = self._get_index_value(index_key, data)
+                old_value = self._get_index_value(index_key, old_data)
+                if old_value == value:
+                    continue
+                if old_value is not NO_VALUE:
+                    changes["remove"].append(
+                        (self._get_index_set(index_key, old_value), key))
+                if value is not NO_VALUE:
+                    index_set = self._get_index_set(index_key, value)
+                    changes["add"].append((index_set, key))
+                    if index_key in self._unique_keys:
+                        unique_checks.append((index_key, value, key,
+                                              index_set))
+        # Make sure no two blobs in the batch share a unique value either.
+        seen = {}
+        for index_key, value, key, index_set in unique_checks:
+            if seen.setdefault(index_set, key) != key:
+                raise KeyError("unique key '{}' already has value '{}'"
+                               .format(index_key, value))
+        if unique_checks:
+            removed = set(changes["remove"])
+            for index_key, value, key, index_set in unique_checks:
+                for other in pipe.smembers(index_set):
+                    other = other.decode()
+                    if other != key and (index_set, other) not in removed:
+                        raise KeyError("unique key '{}' already has value"
+                                       " '{}'".format(index_key, value))
+        return changes
+
+    def build_indexes(self):
+        """Build the indexes for this store.
+
+        The indexes are kept in Redis as the data is written, so this only
+        builds the indexes that have been added since it was last run.
+
+        """
+        # Composite index keys are stored as lists, since JSON has no tuples.
+        built = {tuple(key) if isinstance(key, list) else key
+                 for key in self._get_meta("indexes") or ()}
+        missing = [key for key in self._indexes if key not in built]
+        if missing:
+            with self._redis.pipeline() as pipe:
+                for key in self._keys():
+                    data = self._get(key)
+                    for index_key in missing:
+                        value = self._get_index_value(index_key, data)
+                        if value is not NO_VALUE:
+                            pipe.sadd(self._get_index_set(index_key, value),
+                                      key)
+                pipe.execute()
+            self._put_meta("indexes", [
+                list(key) if isinstance(key, tuple) else key
+                for key in built.union(missing)])
+
+    def update_indexes(self, key, data, prune=True):
+        """Update the indexes for this store with data for one key.
+
+        Redis indexes are updated when the data is written, so this does
+        nothing.  Unique indexes are checked when the data is written.
+
+        """
+
+    def _get_index_lookups(self, key_value_pairs):
+        lookups, remaining = super()._get_index_lookups(key_value_pairs)
+        # Only exact values can be looked up in the Redis sets.
+        exact = []
+        for index_key, comparison, value in lookups:
+            if comparison is None:
+                exact.append((index_key, comparison, value))
+            else:
+                remaining[joins(index_key, comparison, sep="__")] = value
+        return exact, remaining
+
+    def _find_in_store(self, ignore_keys=(), candidates=None,
+                       **key_value_pairs):
+        if candidates is None:
+            blobs = self._redis.hgetall(self._blobs_key).items()
+        else:
+            keys = [key for key in candidates if key not in ignore_keys]
+            if not keys:
+                return set()
+            blobs = zip(keys, self._redis.hmget(self._blobs_key, keys))
+        items = []
+        for key, raw in blobs:
+            if raw is None:
+                continue
+            if isinstance(key, bytes):
+                key = key.decode()
+            items.append((key, self._codec.decode(raw)))
+        return self._find_in_items(items, ignore_keys, key_value_pairs)
+
+    def _find_in_index(self, ignore_keys=(), **key_value_pairs):
+        lookups, leftovers = self._get_index_lookups(key_value_pairs)
+        if not lookups:
+            return set()
+        index_sets = [self._get_index_set(index_key, value)
+                      for index_key, comparison, value in lookups]
+        found = {key.decode() for key in self._redis.sinter(index_sets)}
+        found = {key for key in found if key not in ignore_keys}
+        if leftovers and found:
+            return self._find_in_store(candidates=found, **leftovers)
+        return found
+
+    def clear(self):
+        """Delete all of this store's data from Redis.
+
+        :returns None:
+
+        """
+        keys = list(self._redis.scan_iter(self._prefix + ":*"))
+        if keys:
+            self._redis.delete(*keys)
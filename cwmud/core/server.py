@@ -192,6 +192,7 @@ class Server:
                 with EVENTS.fire("server_shutdown", no_post=True):
                     ENTITIES.save()
                     STORES.commit()
+                    STORES.save_indexes()
                     log.info("Server shutdown complete.")
                     BROKER.publish("server-shutdown-complete", self._pid)
 
@@ -224,6 +225,7 @@ class Server:
         log.info("Starting game state save.")
         ENTITIES.save()
         STORES.commit()
+        STORES.save_indexes()
         state = {}
         with EVENTS.fire("server_save_state", state):
             self._store.put("state", state)
@@ -320,10 +322,33 @@ if settings.FORCE_GC_COLLECT:
     TIMERS.create("1m", "gc_collect", repeat=-1, callback=collect)
 
 
+# Dirty entities are saved a few at a time every pulse, once they have been
+# dirty for a while, so that the next commit has less left to save.
+@TIMERS.create("1p", "save_pending", repeat=-1)
+def _save_pending():
+    ENTITIES.save_pending(settings.SAVE_PULSE_COUNT,
+                          settings.SAVE_PULSE_TIME,
+                          settings.SAVE_MAX_AGE,
+                          settings.SAVE_MIN_AGE)
+
+
+# Cold entities are evicted in batches once a second.
+@TIMERS.create("1s", "evict_cold", repeat=-1)
+def _evict_cold():
+    ENTITIES.evict(settings.EVICT_BATCH_COUNT)
+
+
 @TIMERS.create("3m", "save_and_commit", repeat=-1)
 def _save_and_commit():
     ENTITIES.save()
-    STORES.commit()
+    STORES.commit(background=True)
+
+
+# Stores that have a lot to copy, like log stores, do it on the background
+# writer thread, so this doesn't hold up the game loop.
+@TIMERS.create("10m", "compact_stores", repeat=-1)
+def _compact_stores():
+    STORES.compact()
 
 
 def _get_announce_sessions():
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""SQLite data storage."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+import json
+from os import makedirs
+from os.path import exists, join
+import re
+import sqlite3
+from threading import RLock
+
+from .. import settings
+from .logs import get_logger
+from .storage import check_lookup, DataStore, split_lookup
+from .utils import joins
+
+
+log = get_logger("sqlite")
+
+
+class SQLiteStore(DataStore):
+
+    """A store that keeps its data in a single SQLite database.
+
+    Each blob is stored as JSON text in one table, and any indexes added
+    to the store are created as SQL expression indexes on that table, so
+    lookups by indexed values are handled by SQLite rather than by a scan
+    of every blob.
+
+    """
+
+    _opens = False
+
+    # Index keys are used in SQL statements, so they need to be plain names.
+    _valid_index_key = re.compile(r"^\w+$")
+
+    # The most keys to look up in one statement; SQLite limits how many
+    # variables a statement can have.
+    _max_keys_per_select = 500
+
+    # Only these types can be compared by SQLite; any other values need
+    # to be matched against the decoded blobs.
+    _sql_types = (str, int, float)
+
+    # The SQL operators for each comparison that can be made in a lookup.
+    _sql_operators = {None: "=", "gt": ">", "gte": ">=", "lt": "<",
+                      "lte": "<="}
+
+    def __init__(self, subpath, cache_size=0, filter_size=0):
+        """Create a new SQLite store."""
+        super().__init__(cache_size=cache_size, filter_size=filter_size)
+        self._path = join(settings.DATA_DIR, "sqlite", subpath + ".db")
+        # Make sure the path to the SQLite store exists.
+        base_path = join(settings.DATA_DIR, "sqlite")
+        if not exists(base_path):
+            makedirs(base_path)
+        # The connection is shared with the background writer thread, so
+        # all use of it needs to hold the lock.
+        self._connection = sqlite3.connect(self._path,
+                                           check_same_thread=False)
+        self._lock = RLock()
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS blobs"
+                                     " (key TEXT PRIMARY KEY,"
+                                     " data TEXT NOT NULL)")
+
+    @staticmethod
+    def _check_key(key):
+        if not isinstance(key, str):
+            raise TypeError("SQLite keys must be strings")
+
+    @classmethod
+    def _is_sql_value(cls, value):
+        return isinstance(value, cls._sql_types) and not isinstance(value, bool)
+
+    @staticmethod
+    def _get_value_sql(key):
+        return "json_extract(data, '$.\"{}\"')".format(key)
+
+    def _is_open(self):  # pragma: no cover
+        return True
+
+    def _open(self):  # pragma: no cover
+        pass
+
+    def _close(self):  # pragma: no cover
+        pass
+
+    def _keys(self):
+        """Return an iterator through the keys in this store."""
+        with self._lock:
+            rows = self._connection.execute("SELECT key FROM blobs").fetchall()
+        return (row[0] for row in rows)
+
+    def _has(self, key):
+        """Return whether a key exists in the database or not."""
+        self._check_key(key)
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT 1 FROM blobs WHERE key = ?", (key,))
+            return cursor.fetchone() is not None
+
+    def _get(self, key):
+        """Fetch the data for a key from the database."""
+        self._check_key(key)
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT data FROM blobs WHERE key = ?", (key,))
+            row = cursor.fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def _get_many(self, keys):
+        """Fetch the data for a number of keys from the database at once."""
+        for key in keys:
+            self._check_key(key)
+        rows = []
+        with self._lock:
+            for start in range(0, len(keys), self._max_keys_per_select):
+                chunk = keys[start:start + self._max_keys_per_select]
+                rows.extend(self._connection.execute(
+                    "SELECT key, data FROM blobs WHERE key IN ({})".format(
+                        ", ".join("?" * len(chunk))), chunk).fetchall())
+        return ((key, json.loads(data)) for key, data in rows)
+
+    def _put(self, key, data):
+        """Store data for a key in the database."""
+        self._write([(key, data)])
+
+    def _delete(self, key):
+        """Delete the data for a key from the database."""
+        self._write([(key, None)])
+
+    def _write(self, items):
+        """Write a batch of data to the database in one SQL transaction."""
+        puts = []
+        deletes = []
+        for key, data in items:
+            self._check_key(key)
+            if data is None:
+                deletes.append((key,))
+            else:
+                puts.append((key, json.dumps(data, separators=(",", ":"))))
+        try:
+            with self._lock, self._connection:
+                if deletes:
+                    self._connection.executemany(
+                        "DELETE FROM blobs WHERE key = ?", deletes)
+                if puts:
+                    # This can't be INSERT OR REPLACE, as that would also
+                    # replace rows that conflict on a unique index.
+                    self._connection.executemany(
+                        "INSERT INTO blobs (key, data) VALUES (?, ?)"
+                        " ON CONFLICT (key) DO UPDATE"
+                        " SET data = excluded.data", puts)
+        except sqlite3.IntegrityError as exc:
+            raise KeyError(joins("unique index violation:", exc))
+
+    def add_index(self, key, unique=False, sorted=False):
+        """Add an index to this store.
+
+        The index is created in the database immediately, and SQLite will
+        maintain it from then on, so there is no need to build it.  SQLite
+        indexes can always be searched by range, so `sorted` only affects
+        which lookups are considered indexed.
+
+        :param str|tuple key: The data key (or keys) to index
+        :param bool unique: Whether the given key is unique to each blob
+        :param bool sorted: Whether the index will be searched by range
+        :returns None:
+        :raises ValueError: If `key` is not a valid index name
+
+        """
+        keys = key if isinstance(key, tuple) else (key,)
+        for _key in keys:
+            if not self._valid_index_key.match(_key):
+                raise ValueError(joins("invalid SQLite index key:", _key))
+        if key in self._indexes:
+            log.warning("Tried to add existing index '%s' to %s.", key, self)
+            return
+        super().add_index(key, unique=unique, sorted=sorted)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE {}INDEX IF NOT EXISTS \"index_{}\" ON blobs ({})"
+                .format("UNIQUE " if unique else "", "_".join(keys),
+                        ", ".join(map(self._get_value_sql, keys))))
+
+    def _get_filter_items(self):
+        """Return an iterator through the items to build the filter from.
+
+        SQLite keeps the indexes itself, so their values are read from the
+        database rather than from the store's own indexes.
+
+        """
+        for key in self._keys():
+            yield None, key
+        for index_key in self._indexes:
+            keys = index_key if isinstance(index_key, tuple) else (index_key,)
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT DISTINCT {} FROM blobs".format(
+                        ", ".join(map(self._get_value_sql, keys)))).fetchall()
+            for row in rows:
+                yield index_key, row if isinstance(index_key, tuple) else row[0]
+
+    def build_indexes(self):
+        """Build the indexes for this store.
+
+        SQLite maintains its own indexes, so this does nothing.
+
+        """
+
+    def update_indexes(self, key, data, prune=True):
+        """Update the indexes for this store with data for one key.
+
+        SQLite maintains its own indexes, so this does nothing.  Unique
+        indexes are enforced by the database when the data is written.
+
+        """
+
+    def _select(self, ignore_keys=(), **key_value_pairs):
+        # Push down as many of the key/value pairs as we can into the query,
+        # anything else will need to be checked against the decoded data.
+        clauses = []
+        params = []
+        leftovers = []
+        for name, value in key_value_pairs.items():
+            key, comparison = split_lookup(name)
+            if not self._valid_index_key.match(key):
+                leftovers.append((key, comparison, value))
+            elif comparison is None and value is None:
+                clauses.append("json_type(data, '$.\"{}\"') = 'null'"
+                               .format(key))
+            elif comparison == "between":
+                if (isinstance(value, (list, tuple)) and len(value) == 2
+                        and all(map(self._is_sql_value, value))):
+                    clauses.append(self._get_value_sql(key)
+                                   + " BETWEEN ? AND ?")
+                    params.extend(value)
+                else:
+                    leftovers.append((key, comparison, value))
+            elif not self._is_sql_value(value):
+                leftovers.append((key, comparison, value))
+            elif comparison == "startswith":
+                if isinstance(value, str):
+                    clauses.append("(json_type(data, '$.\"{}\"') = 'text'"
+                                   " AND substr({}, 1, ?) = ?)"
+                                   .format(key, self._get_value_sql(key)))
+                    params.extend((len(value), value))
+                else:
+                    leftovers.append((key, comparison, value))
+            else:
+                clauses.append(self._get_value_sql(key) + " "
+                               + self._sql_operators[comparison] + " ?")
+                params.append(value)
+        if leftovers:
+            query = "SELECT key, data FROM blobs"
+        else:
+            query = "SELECT key FROM blobs"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        found = set()
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        for row in rows:
+            key = row[0]
+            if key in ignore_keys:
+                continue
+            if leftovers:
+                data = json.loads(row[1])
+                for _key, comparison, _value in leftovers:
+                    if (_key not in data or not check_lookup(
+                            data[_key], comparison, _value)):
+                        break
+                else:
+                    found.add(key)
+            else:
+                found.add(key)
+        return found
+
+    def _find_in_store(self, ignore_keys=(), **key_value_pairs):
+        return self._select(ignore_keys=ignore_keys, **key_value_pairs)
+
+    def _find_in_index(self, ignore_keys=(), **key_value_pairs):
+        if not key_value_pairs:
+            return set()
+        return self._select(ignore_keys=ignore_keys, **key_value_pairs)
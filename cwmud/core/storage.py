@@ -4,32 +4,292 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
-from collections import OrderedDict
+from bisect import bisect_left, bisect_right, insort
+from collections import abc, ChainMap, Counter, deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from copy import deepcopy
+from hashlib import sha1
 from itertools import chain
+from os import replace
+from os.path import exists
+import pickle
+
+from pylru import lrucache
 
 from .logs import get_logger
-from .utils import joins
+from .utils import is_hashable, joins
 from .utils.bases import Manager
+from .utils.bloom import BloomFilter
 
 
 log = get_logger("storage")
 
 
+# A marker for blobs that have no value for an index.
+NO_VALUE = object()
+
+# All background writes are done by a single thread, so that they are
+# written in the same order that they were committed.
+_writer = None
+
+
+def _get_writer():
+    """Return the executor for background writes, creating it if needed."""
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1)
+    return _writer
+
+
+def _get_finished_future():
+    """Return a future that has already finished."""
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+def load_meta_file(path):
+    """Load a store's metadata from a file.
+
+    :param str path: The path to the metadata file
+    :returns: The loaded metadata, or None if the file does not exist
+
+    """
+    if not exists(path):
+        return None
+    with open(path, "rb") as meta_file:
+        return pickle.load(meta_file)
+
+
+def save_meta_file(path, value):
+    """Save a store's metadata to a file.
+
+    The data is written to a temporary file first and then moved into
+    place, so that an interrupted save never leaves a partial file behind.
+
+    :param str path: The path to the metadata file
+    :param value: The metadata to save
+    :returns None:
+
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as meta_file:
+        pickle.dump(value, meta_file, protocol=pickle.HIGHEST_PROTOCOL)
+    replace(temp_path, path)
+
+
+# The comparisons that can be made by suffixing a key in a lookup with
+# "__" and their name, as in find(level__gte=5).
+_lookup_checks = {
+    "gt": lambda value, arg: value > arg,
+    "gte": lambda value, arg: value >= arg,
+    "lt": lambda value, arg: value < arg,
+    "lte": lambda value, arg: value <= arg,
+    "between": lambda value, arg: arg[0] <= value <= arg[1],
+    "startswith": lambda value, arg: (isinstance(value, str)
+                                      and value.startswith(arg)),
+}
+
+
+def split_lookup(name):
+    """Split the name of a lookup into its data key and comparison.
+
+    :param str name: The name of the lookup, such as "level__gte"
+    :returns tuple: The data key and the name of the comparison, or None
+                    if the lookup is for an exact value
+
+    """
+    key, sep, comparison = name.rpartition("__")
+    if sep and key and comparison in _lookup_checks:
+        return key, comparison
+    return name, None
+
+
+def check_lookup(value, comparison, arg):
+    """Check whether a value matches a lookup.
+
+    Values that can't be compared to the lookup's argument never match.
+
+    :param value: The value to check
+    :param str comparison: The name of the comparison, or None to check
+                           for an exact value
+    :param arg: The value to compare against
+    :returns bool: Whether the value matches or not
+
+    """
+    if comparison is None:
+        return value == arg
+    try:
+        return _lookup_checks[comparison](value, arg)
+    except TypeError:
+        return False
+
+
+def _parse_lookups(key_value_pairs):
+    """Parse pairs of lookups and values into a list of lookups.
+
+    :param dict key_value_pairs: The pairs to parse
+    :returns list: A list of (data key, comparison, value) tuples
+
+    """
+    return [split_lookup(name) + (value,)
+            for name, value in key_value_pairs.items()]
+
+
+def _match_lookups(data, lookups):
+    """Check whether a data blob matches a list of parsed lookups.
+
+    :param dict data: The data blob to check
+    :param list lookups: The lookups, as returned by _parse_lookups
+    :returns bool: Whether the data matches every lookup or not
+
+    """
+    for key, comparison, value in lookups:
+        if key not in data or not check_lookup(data[key], comparison, value):
+            return False
+    return True
+
+
+def freeze(data, owned=False):
+    """Wrap data in a read-only view, if it is a dict or a list.
+
+    :param data: The data to wrap
+    :param bool owned: Whether nothing else holds a reference to the data,
+                       so that it can be handed over when thawed
+    :returns: A view of the data, or the data itself if it is neither
+
+    """
+    if isinstance(data, dict):
+        return FrozenDict(data, owned)
+    if isinstance(data, list):
+        return FrozenList(data, owned)
+    return data
+
+
+class _FrozenView:
+
+    """The base of read-only views of stored data.
+
+    Views don't copy the data they wrap, and any dicts or lists nested
+    in that data are wrapped in their own views as they are accessed.
+
+    """
+
+    __slots__ = ("_data", "_owned")
+
+    def __init__(self, data, owned=False):
+        self._data = data
+        self._owned = owned
+
+    def __eq__(self, other):
+        if isinstance(other, _FrozenView):
+            other = other._data
+        return self._data == other
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self._data)
+
+    def thaw(self):
+        """Return a mutable copy of the data in this view.
+
+        If the view owns its data, the data itself is handed over rather
+        than copied, and the view must not be used after that.
+
+        :returns: The mutable data
+
+        """
+        if self._owned:
+            self._owned = False
+            return self._data
+        return deepcopy(self._data)
+
+
+class FrozenDict(_FrozenView, abc.Mapping):
+
+    """A read-only view of a dict."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return freeze(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class FrozenList(_FrozenView, abc.Sequence):
+
+    """A read-only view of a list."""
+
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrozenList(self._data[index])
+        return freeze(self._data[index])
+
+
 class DataStore:
 
     """A store for data."""
 
     # Whether this data store needs to be opened and closed.
     _opens = False
+    # Whether this data store can save snapshots of its indexes.
+    _snapshots = False
+
+    def __init__(self, cache_size=0, filter_size=0):
+        """Create a new data store.
+
+        :param int cache_size: How many decoded blobs to keep in memory
+                               for reading, or zero to not cache them
+        :param int filter_size: How many keys and index values to size a
+                                filter of missing data for, or zero to
+                                not use one
 
-    def __init__(self):
-        """Create a new data store."""
+        """
         self._transaction = OrderedDict()
         # Indexes is a nested dictionary, keyed first by data key, and
         # then by value, each containing a set of store keys with that value.
         self._indexes = {}
+        # The indexed values of each store key, keyed by index, so that they
+        # can be pruned without reading the old data back from the store.
+        self._index_values = {}
+        # The same indexes, but over the data in the transaction, and the
+        # values each key in the transaction was indexed with.
+        self._transaction_indexes = {}
+        self._transaction_values = {}
         self._unique_keys = set()
+        # Sorted indexes keep a sorted list of their values, so that they
+        # can be searched by range, and a set of any values that couldn't
+        # be sorted with the rest.
+        self._sorted_keys = {}
+        # The generation is a count of commits, used to check whether saved
+        # index snapshots are still current; it is loaded when first needed.
+        self._generation = None
+        # Commits that are still being written in the background, as tuples
+        # of their future, data, and the transaction indexes over that data
+        # (or None if they are out of date), oldest first.
+        self._in_flight = deque()
+        # Digests of the data last written for each key, so that writing
+        # the same data again can be skipped.
+        self._digests = {}
+        self._elided_count = 0
+        # A cache of decoded blobs read from the store.
+        self._cache = lrucache(cache_size) if cache_size else None
+        self._cache_hits = 0
+        self._cache_misses = 0
+        # A filter of every key and index value in the store, so that we
+        # can skip looking for data that definitely isn't there; it isn't
+        # used until it has been built.
+        self._filter_size = filter_size
+        self._filter = None
 
     def _is_open(self):  # pragma: no cover
         raise NotImplementedError
@@ -58,6 +318,49 @@ class DataStore:
         # each others' keys, etc.
         raise NotImplementedError
 
+    def _get_meta(self, name):  # pragma: no cover
+        # Stores that support index snapshots need somewhere to keep them,
+        # along with other bits of metadata, separate from their data.
+        raise NotImplementedError
+
+    def _put_meta(self, name, value):  # pragma: no cover
+        raise NotImplementedError
+
+    def _write(self, items):
+        """Write a batch of data to the store.
+
+        Override this if a store can write many keys more efficiently
+        than through individual calls to `_put` and `_delete`.
+
+        :param iterable items: Pairs of keys and data to write; data that
+                               is None means the key should be deleted
+        :returns None:
+
+        """
+        for key, data in items:
+            if data is None:
+                if self._has(key):
+                    self._delete(key)
+            else:
+                self._put(key, data)
+
+    def _get_many(self, keys):
+        """Fetch the data for a number of keys from the store.
+
+        Override this if a store can read many keys more efficiently than
+        through individual calls to `_get`.
+
+        :param list keys: The keys to fetch
+        :returns iterable: Pairs of keys and data, for the keys that exist
+
+        """
+        for key in keys:
+            try:
+                data = self._get(key)
+            except (KeyError, OSError):
+                continue
+            yield key, data
+
     @property
     def opens(self):
         """Return whether this store opens and closes or not."""
@@ -96,72 +399,521 @@ class DataStore:
 
         """
 
-    def add_index(self, key, unique=False):
+    def add_index(self, key, unique=False, sorted=False):
         """Add an index to this store.
 
         Adding an index does not automatically rebuild the indexes;
         if you are adding an index after the server has booted, you will
-        need to call store.build_indexes() yourself.
+        need to call store.build_indexes() yourself.  The filter of missing
+        data is dropped, as it has none of the new index's values; call
+        store.build_filter() after the indexes are built to replace it.
+
+        If `key` is a tuple of data keys, a composite index will be made,
+        keyed by a tuple of their values; it will be used to find blobs
+        by all of those keys at once.
 
-        :param str key: The data key to index
+        A sorted index can also be used to find blobs by a range of values
+        or by the prefix of a string, as in find(level__gte=5) or
+        find(name__startswith="Bo").
+
+        :param str|tuple key: The data key (or keys) to index
         :param bool unique: Whether the given key is unique to each blob
+        :param bool sorted: Whether to keep the index's values sorted
         :returns None:
+        :raises ValueError: If a composite index is to be sorted
 
         """
+        if sorted and isinstance(key, tuple):
+            raise ValueError("composite indexes can't be sorted")
         if key in self._indexes:
             log.warning("Tried to add existing index '%s' to %s.", key, self)
             return
         self._indexes[key] = {}
+        # Finds by the new index would be ruled out by the old filter.
+        self._filter = None
         if unique:
             self._unique_keys.add(key)
+        if sorted:
+            self._sorted_keys[key] = ([], set())
+        for _key, data in self._transaction.items():
+            self._index_transaction(_key, data)
+        # The indexes of data still being written don't have the new one,
+        # so that data will be checked directly instead.
+        self._in_flight = deque((future, data, None)
+                                for future, data, indexes in self._in_flight)
+
+    def has_index(self, key):
+        """Return whether this store has an index on a given key or not.
+
+        :param str|tuple key: The data key (or keys) to check for
+        :returns bool: Whether the index exists or not
+
+        """
+        return key in self._indexes
+
+    def _get_filter_items(self):
+        """Return an iterator through the items to build the filter from.
+
+        Keys are added to the filter as (None, key) and index values as
+        (index_key, value).
+
+        """
+        for key in self._keys():
+            yield None, key
+        for index_key, index in self._indexes.items():
+            for value in index:
+                yield index_key, value
+
+    def _add_to_filter(self, key, data):
+        """Add a key and its index values to the filter.
+
+        :param hashable key: The key being stored
+        :param dict data: The data being stored under the key
+        :returns None:
+
+        """
+        if data is None:
+            return
+        self._filter.add((None, key))
+        for index_key in self._indexes:
+            value = self._get_index_value(index_key, data)
+            if value is not NO_VALUE and is_hashable(value):
+                self._filter.add((index_key, value))
+
+    def _is_filtered(self, key=NO_VALUE, key_value_pairs=None):
+        """Return whether the filter rules out some data being stored.
+
+        :param hashable key: Optional, a key to check for
+        :param dict key_value_pairs: Optional, pairs of keys and values to
+                                     check the indexed values of
+        :returns bool: True if the data is definitely not in the store,
+                       or False if it might be
+
+        """
+        if self._filter is None:
+            return False
+        if key is not NO_VALUE:
+            return is_hashable(key) and (None, key) not in self._filter
+        for index_key in self._indexes:
+            value = self._get_index_value(index_key, key_value_pairs)
+            if (value is not NO_VALUE and is_hashable(value)
+                    and (index_key, value) not in self._filter):
+                return True
+        return False
+
+    def build_filter(self):
+        """Build the filter of missing data for this store.
+
+        This should be done after the indexes are built or loaded.  The
+        filter is sized to the store's `filter_size`, or to twice as many
+        items as are now stored if that is more.
+
+        :returns None:
+
+        """
+        if not self._filter_size:
+            return
+        items = [item for item in self._get_filter_items()
+                 if is_hashable(item)]
+        self._filter = BloomFilter(max(self._filter_size, len(items) * 2))
+        self._filter.update(items)
 
     def build_indexes(self):
         """Build the indexes for this store using all stored data."""
-        for key in self._keys():
-            data = self._get(key)
-            self.update_indexes(key, data, prune=False)
+        # The values of sorted indexes are sorted once they are all
+        # indexed, rather than being sorted into place one at a time.
+        sorted_keys = self._sorted_keys
+        self._sorted_keys = {}
+        try:
+            for key in self._keys():
+                data = self._read(key)
+                self.update_indexes(key, data, prune=False)
+        finally:
+            self._sorted_keys = sorted_keys
+            for index_key in sorted_keys:
+                self._sort_index_values(index_key)
+
+    @property
+    def generation(self):
+        """Return the generation of this store's data.
+
+        The generation increases with each commit, so any snapshot of the
+        indexes that was saved with an older generation is out of date.
+
+        """
+        if self._generation is None:
+            self._generation = 0
+            if self._snapshots:
+                self._generation = self._get_meta("generation") or 0
+        return self._generation
+
+    def _get_index_layout(self):
+        return {key: key in self._unique_keys for key in self._indexes}
+
+    def save_indexes(self):
+        """Save a snapshot of this store's indexes.
+
+        Stores that do not support snapshots will ignore this.
+
+        :returns None:
+
+        """
+        if not self._snapshots:
+            return
+        self._put_meta("indexes", {
+            "generation": self.generation,
+            "layout": self._get_index_layout(),
+            "indexes": self._indexes,
+        })
+
+    def load_indexes(self):
+        """Load this store's indexes from a saved snapshot.
+
+        The snapshot will only be loaded if it was saved at the current
+        generation with the same indexes as are now registered.
+
+        :returns bool: Whether the indexes were loaded or not
+
+        """
+        if not self._snapshots:
+            return False
+        try:
+            snapshot = self._get_meta("indexes")
+        except Exception:
+            log.warning("Could not read index snapshot for %s.", self,
+                        exc_info=True)
+            return False
+        if (not snapshot
+                or snapshot["generation"] != self.generation
+                or snapshot["layout"] != self._get_index_layout()):
+            return False
+        self._indexes = snapshot["indexes"]
+        self._index_values = {}
+        for index_key, index in self._indexes.items():
+            for value, keys in index.items():
+                for key in keys:
+                    self._index_values.setdefault(key, {})[index_key] = value
+        for key in self._sorted_keys:
+            self._sort_index_values(key)
+        return True
+
+    def _sort_index_values(self, index_key):
+        """Sort all of the values of a sorted index at once.
+
+        :param str index_key: The key of the sorted index
+        :returns None:
+
+        """
+        values = self._indexes[index_key]
+        try:
+            self._sorted_keys[index_key] = (sorted(values), set())
+            return
+        except TypeError:
+            pass
+        # Not all of the values can be compared with each other, so only
+        # those of the most common type are sorted.
+        common_type = Counter(map(type, values)).most_common(1)[0][0]
+        unsorted = {value for value in values
+                    if type(value) is not common_type}
+        try:
+            self._sorted_keys[index_key] = (
+                sorted(value for value in values
+                       if type(value) is common_type), unsorted)
+        except TypeError:
+            # Even those can't all be compared, so they need to be sorted
+            # into place one at a time.
+            self._sorted_keys[index_key] = ([], unsorted)
+            for value in values:
+                if type(value) is common_type:
+                    self._add_sorted_value(index_key, value)
+
+    def _add_sorted_value(self, index_key, value):
+        values, unsorted = self._sorted_keys[index_key]
+        try:
+            insort(values, value)
+        except TypeError:
+            # This value can't be compared with the others.
+            unsorted.add(value)
+
+    def _remove_sorted_value(self, index_key, value):
+        values, unsorted = self._sorted_keys[index_key]
+        if value in unsorted:
+            unsorted.discard(value)
+            return
+        try:
+            position = bisect_left(values, value)
+        except TypeError:
+            return
+        if position < len(values) and values[position] == value:
+            del values[position]
+
+    def _get_sorted_values(self, index_key, comparison, arg):
+        """Return the values of a sorted index that match a lookup.
+
+        :param str index_key: The key of the sorted index
+        :param str comparison: The name of the comparison to make
+        :param arg: The value to compare against
+        :returns list: The matching values
+
+        """
+        values, unsorted = self._sorted_keys[index_key]
+        start, stop = 0, len(values)
+        try:
+            if comparison == "gt":
+                start = bisect_right(values, arg)
+            elif comparison == "gte":
+                start = bisect_left(values, arg)
+            elif comparison == "lt":
+                stop = bisect_left(values, arg)
+            elif comparison == "lte":
+                stop = bisect_right(values, arg)
+            elif comparison == "between":
+                start = bisect_left(values, arg[0])
+                stop = bisect_right(values, arg[1])
+            elif comparison == "startswith":
+                start = bisect_left(values, arg)
+                stop = start
+                while (stop < len(values)
+                       and check_lookup(values[stop], comparison, arg)):
+                    stop += 1
+        except TypeError:
+            # The sorted values can't be compared to this argument.
+            start = stop = 0
+        found = values[start:stop]
+        found.extend(value for value in unsorted
+                     if check_lookup(value, comparison, arg))
+        return found
+
+    @staticmethod
+    def _get_index_value(index_key, data):
+        """Return the value of a blob for an index.
+
+        :param str|tuple index_key: The index to get the value for
+        :param dict data: The data blob to get the value from
+        :returns: The value for the index, or NO_VALUE if it has none
+
+        """
+        if not data:
+            return NO_VALUE
+        if isinstance(index_key, tuple):
+            for key in index_key:
+                if key not in data:
+                    return NO_VALUE
+            return tuple(data[key] for key in index_key)
+        return data.get(index_key, NO_VALUE)
+
+    def _get_index_lookups(self, key_value_pairs):
+        """Return the index lookups that cover a set of key/value pairs.
+
+        :param dict key_value_pairs: The pairs of keys and values to cover
+        :returns tuple: A list of (index key, comparison, value) lookups,
+                        and a dict of any pairs that aren't covered by an
+                        index
+
+        """
+        remaining = dict(key_value_pairs)
+        lookups = []
+        for index_key in self._indexes:
+            if (isinstance(index_key, tuple)
+                    and all(key in remaining for key in index_key)):
+                value = tuple(remaining.pop(key) for key in index_key)
+                lookups.append((index_key, None, value))
+        for name in list(remaining):
+            key, comparison = split_lookup(name)
+            if comparison is None:
+                if key in self._indexes:
+                    lookups.append((key, None, remaining.pop(name)))
+            elif key in self._sorted_keys:
+                lookups.append((key, comparison, remaining.pop(name)))
+        return lookups, remaining
 
     def update_indexes(self, key, data, prune=True):
         """Update the indexes for this store with data for one key.
 
         :param str key: The storage key for the data
         :param dict data: The data to update the indexes with
-        :param bool prune: Whether to load any existing data from the store
-                           so that old values can be removed.
+        :param bool prune: Whether to remove the key's old values from
+                           the indexes
         :returns None
 
         """
-        old_data = {}
-        if prune and self._has(key):
-            old_data = self._get(key)
+        old_values = self._index_values.get(key, {}) if prune else {}
+        new_values = {}
         for index_key, index in self._indexes.items():
-            if data and index_key in data:
-                value = data[index_key]
+            value = self._get_index_value(index_key, data)
+            if value is not NO_VALUE:
+                new_values[index_key] = value
                 if value not in index:
                     index[value] = set()
+                    if index_key in self._sorted_keys:
+                        self._add_sorted_value(index_key, value)
                 elif index[value] and index_key in self._unique_keys:
                     raise KeyError("unique key '{}' already has value '{}'"
                                    .format(index_key, index[value]))
                 index[value].add(key)
-            else:
-                value = None
             if prune:
-                old_value = old_data.get(index_key)
+                old_value = old_values.get(index_key, NO_VALUE)
+                if old_value is NO_VALUE:
+                    continue
                 if old_value != value and old_value in index:
                     index[old_value].discard(key)
+                    if not index[old_value]:
+                        del index[old_value]
+                        if index_key in self._sorted_keys:
+                            self._remove_sorted_value(index_key, old_value)
+        if new_values:
+            self._index_values[key] = new_values
+        else:
+            self._index_values.pop(key, None)
+
+    def _index_transaction(self, key, data):
+        """Update the transaction's indexes with data for one key.
+
+        Data is indexed as it was when it was put in the transaction, so
+        it shouldn't be changed after that.
+
+        :param hashable key: The key for the data
+        :param dict data: The data, or None if the key is being deleted
+        :returns None:
+
+        """
+        for index_key, value in self._transaction_values.pop(key, ()):
+            keys = self._transaction_indexes[index_key][value]
+            keys.discard(key)
+            if not keys:
+                del self._transaction_indexes[index_key][value]
+        values = []
+        for index_key in self._indexes:
+            value = self._get_index_value(index_key, data)
+            if value is NO_VALUE or not is_hashable(value):
+                continue
+            index = self._transaction_indexes.setdefault(index_key, {})
+            index.setdefault(value, set()).add(key)
+            values.append((index_key, value))
+        if values:
+            self._transaction_values[key] = values
+
+    def _clear_transaction(self, keep_data=False):
+        """Clear the transaction and its indexes.
+
+        :param bool keep_data: Whether to leave the old transaction's data
+                               alone, replacing it rather than clearing it
+        :returns None:
+
+        """
+        if keep_data:
+            self._transaction = OrderedDict()
+        else:
+            self._transaction.clear()
+        self._transaction_indexes = {}
+        self._transaction_values = {}
 
     # CHEESEBURGER DELIGHT
     # RED SKY AT NIGHT
     # CHEESEBURGER MOURNING
     # SAILORS TAKE WARNING
 
+    def _get_in_flight(self, key):
+        """Return the data for a key that is still being written.
+
+        :param hashable key: The key to get the data for
+        :returns: The data being written (None if it is being deleted), or
+                  NO_VALUE if the key is not being written
+
+        """
+        for future, data, indexes in reversed(self._in_flight):
+            if key in data:
+                return data[key]
+        return NO_VALUE
+
+    def _get_all_in_flight(self):
+        """Return the latest data for every key still being written.
+
+        :returns OrderedDict: The data being written, keyed by store key
+
+        """
+        self._prune_in_flight()
+        in_flight = OrderedDict()
+        for future, data, indexes in self._in_flight:
+            in_flight.update(data)
+        return in_flight
+
+    def _prune_in_flight(self):
+        """Forget any background commits that have finished writing.
+
+        The data of any commit that failed to write is put back into the
+        transaction, so that it is written again on the next commit, unless
+        there is newer data for its key in the transaction or still being
+        written.
+
+        """
+        while self._in_flight and self._in_flight[0][0].done():
+            future, data, indexes = self._in_flight.popleft()
+            if future.exception() is None:
+                continue
+            for key, value in data.items():
+                # We don't know what made it into the store, so none of it
+                # can be skipped next time.
+                self._digests.pop(key, None)
+                if key in self._transaction or any(
+                        key in newer for _, newer, _ in self._in_flight):
+                    continue
+                self._transaction[key] = value
+                self._index_transaction(key, value)
+
+    @property
+    def cache_hits(self):
+        """Return how many reads this store has served from its cache."""
+        return self._cache_hits
+
+    @property
+    def cache_misses(self):
+        """Return how many reads this store has had to decode."""
+        return self._cache_misses
+
+    def _read(self, key):
+        """Read the data for a key from the store, through the cache.
+
+        The data returned may be shared with the cache, so don't change it.
+
+        :param hashable key: The key to read the data for
+        :returns dict: The data for the key
+        :raises KeyError: If the key is not in the store
+
+        """
+        if self._cache is None:
+            return self._get(key)
+        if key in self._cache:
+            self._cache_hits += 1
+            return self._cache[key]
+        self._cache_misses += 1
+        data = self._get(key)
+        self._cache[key] = data
+        return data
+
+    def _uncache(self, keys):
+        """Remove keys from the read cache.
+
+        :param iterable keys: The keys to remove
+        :returns None:
+
+        """
+        if self._cache is not None:
+            for key in keys:
+                if key in self._cache:
+                    del self._cache[key]
+
     def keys(self):
         """Return an iterator through this store's keys."""
-        # We also need to include keys that are only in the transaction and
-        # not yet saved to the store.
+        # We also need to include keys that are only in the transaction or
+        # still being written, and not yet saved to the store.
         trans_keys = self._transaction.keys()
-        return chain(trans_keys, (key for key in self._keys()
-                                  if key not in trans_keys))
+        in_flight = self._get_all_in_flight()
+        return chain(trans_keys,
+                     (key for key, data in in_flight.items()
+                      if data is not None and key not in trans_keys),
+                     (key for key in self._keys()
+                      if key not in trans_keys and key not in in_flight))
 
     def has(self, key):
         """Return whether this store has a given key or not.
@@ -172,53 +924,151 @@ class DataStore:
         """
         if key in self._transaction:
             return self._transaction[key] is not None
+        data = self._get_in_flight(key)
+        if data is not NO_VALUE:
+            return data is not None
+        if self._cache is not None and key in self._cache:
+            return True
+        if self._is_filtered(key):
+            return False
         try:
             return self._has(key)
         except (KeyError, TypeError):
             return False
 
-    def _find_in_store(self, ignore_keys=(), **key_value_pairs):
+    def _find_in_store(self, ignore_keys=(), candidates=None,
+                       **key_value_pairs):
         found = set()
-        for key in self._keys():
+        lookups = _parse_lookups(key_value_pairs)
+        for key in self._keys() if candidates is None else candidates:
             if key in ignore_keys:
                 continue
-            data = self._get(key)
-            for _key, _value in key_value_pairs.items():
-                if _key not in data or data[_key] != _value:
-                    break
-            else:
+            if _match_lookups(self._read(key), lookups):
                 found.add(key)
         return found
 
-    def _find_in_index(self, **key_value_pairs):
+    def _get_index_keys(self, index_key, comparison, value):
+        """Return the keys in an index that match a lookup.
+
+        :param str|tuple index_key: The key of the index to check
+        :param str comparison: The name of the comparison to make, or None
+                               to match an exact value
+        :param value: The value to match against
+        :returns set: The matching keys
+
+        """
+        index = self._indexes[index_key]
+        if comparison is None:
+            try:
+                return index.get(value, set())
+            except TypeError:
+                # Unhashable values can't be in the index.
+                return set()
         found = set()
-        pairs = list(key_value_pairs.items())
-        if not pairs:
-            return found
-        # Add all the items that match the first key/value pair.
-        key, value = pairs.pop()
-        if key in self._indexes and value in self._indexes[key]:
-            found.update(self._indexes[key][value])
-        # Then remove all the items that don't match all the other pairs.
-        if pairs:
-            for key, value in pairs:
-                if not found:
-                    # There's nothing left to check against.
-                    break
-                if key in self._indexes and value in self._indexes[key]:
-                    found.intersection_update(self._indexes[key][value])
+        for _value in self._get_sorted_values(index_key, comparison, value):
+            found.update(index[_value])
+        return found
+
+    def _get_lookup_size(self, index_key, comparison, value):
+        """Return how many keys an index lookup could match, at most.
+
+        Range lookups are sized by the keys of the values in their range.
+
+        :param str|tuple index_key: The key of the index to check
+        :param str comparison: The name of the comparison to make, or None
+                               to match an exact value
+        :param value: The value to match against
+        :returns int: The most keys the lookup could match
+
+        """
+        index = self._indexes[index_key]
+        if comparison is not None:
+            return sum(len(index[_value]) for _value in
+                       self._get_sorted_values(index_key, comparison, value))
+        try:
+            return len(index.get(value, ()))
+        except TypeError:
+            # Unhashable values can't be in the index.
+            return 0
+
+    def _find_in_index(self, ignore_keys=(), **key_value_pairs):
+        lookups, leftovers = self._get_index_lookups(key_value_pairs)
+        if not lookups:
+            return set()
+        # Start from the lookup that matches the fewest keys, then narrow
+        # those down by the values they have indexed for the others, rather
+        # than building a set of keys for every lookup; some (such as the
+        # type of an entity, or a wide range) could match most of the store.
+        lookups.sort(key=lambda lookup: self._get_lookup_size(*lookup))
+        found = set(self._get_index_keys(*lookups[0]))
+        for index_key, comparison, value in lookups[1:]:
+            if not found:
+                # There's nothing left to check against.
+                break
+            found = {key for key in found if check_lookup(
+                self._index_values[key].get(index_key, NO_VALUE),
+                comparison, value)}
+        found = {key for key in found if key not in ignore_keys}
+        if leftovers:
+            # Anything left matched the indexed pairs, so only those need
+            # to be checked against the pairs that aren't indexed.
+            return self._find_in_store(candidates=found, **leftovers)
         # Anything left matched all key/value pairs.
         return found
 
+    @staticmethod
+    def _get_batch_keys(indexes, index_key, comparison, value):
+        index = indexes.get(index_key, {})
+        if comparison is None:
+            try:
+                return index.get(value, set())
+            except TypeError:
+                return set()
+        found = set()
+        for _value, keys in index.items():
+            if check_lookup(_value, comparison, value):
+                found.update(keys)
+        return found
+
+    def _find_in_batch(self, data, indexes, ignore_keys, key_value_pairs):
+        """Find keys in a batch of data that isn't in the store yet.
+
+        :param dict data: The batch's data, keyed by store key
+        :param dict indexes: The transaction indexes over the batch's data,
+                             or None to check all of its data
+        :param iterable ignore_keys: A sequence of keys to ignore
+        :param dict key_value_pairs: Pairs of keys and values to match
+        :returns set: The matching keys
+
+        """
+        lookups = self._get_index_lookups(key_value_pairs)[0]
+        if not lookups or indexes is None:
+            return self._find_in_items(data.items(), ignore_keys,
+                                       key_value_pairs)
+        # The indexes can narrow down the pending data to check.
+        found = set(self._get_batch_keys(indexes, *lookups.pop()))
+        for lookup in lookups:
+            if not found:
+                break
+            found.intersection_update(self._get_batch_keys(indexes, *lookup))
+        # Unchanged data is indexed but not written, so it may be missing.
+        return self._find_in_items(
+            ((key, data[key]) for key in found if key in data),
+            ignore_keys, key_value_pairs)
+
     def _find_in_transaction(self, ignore_keys=(), **key_value_pairs):
+        return self._find_in_batch(self._transaction,
+                                   self._transaction_indexes,
+                                   ignore_keys, key_value_pairs)
+
+    @staticmethod
+    def _find_in_items(items, ignore_keys, key_value_pairs):
         found = set()
-        for key, data in self._transaction.items():
-            if key in ignore_keys:
+        lookups = _parse_lookups(key_value_pairs)
+        for key, data in items:
+            if key in ignore_keys or data is None:
                 continue
-            for _key, _value in key_value_pairs.items():
-                if data is None or _key not in data or data[_key] != _value:
-                    break
-            else:
+            if _match_lookups(data, lookups):
                 found.add(key)
         return found
 
@@ -232,34 +1082,61 @@ class DataStore:
         :returns list: A list of keys to matching blobs, if any
 
         """
-        # Checking the indexes only makes sense if *all* the key/value
-        # pairs are actually indexed.
-        if all(map(self._indexes.get, key_value_pairs)):
-            found = self._find_in_index(**key_value_pairs)
+        self._prune_in_flight()
+        store_ignore_keys = ignore_keys
+        if self._in_flight:
+            # Data that is still being written can't be read back from the
+            # store yet, so it's checked separately; the batches are looked
+            # through rather than copied into one set of keys to ignore.
+            store_ignore_keys = ChainMap(
+                dict.fromkeys(ignore_keys),
+                *(data for future, data, indexes in self._in_flight))
+        # If any of the key/value pairs are indexed, the indexes can narrow
+        # down which data needs to be checked against the rest of them.
+        if self._is_filtered(key_value_pairs=key_value_pairs):
+            found = set()
+        elif key_value_pairs and self._get_index_lookups(key_value_pairs)[0]:
+            found = self._find_in_index(ignore_keys=store_ignore_keys,
+                                        **key_value_pairs)
         else:
-            found = self._find_in_store(ignore_keys=ignore_keys,
+            found = self._find_in_store(ignore_keys=store_ignore_keys,
                                         **key_value_pairs)
+        newer = []
+        for future, data, indexes in reversed(self._in_flight):
+            # Keys in a newer batch have newer data than this one.
+            found.update(key for key in self._find_in_batch(
+                data, indexes, ignore_keys, key_value_pairs)
+                if not any(key in _data for _data in newer))
+            newer.append(data)
         if transaction:
             # Remove any keys already found that are in the transaction.
-            found.difference_update(self._transaction)
+            found = {key for key in found if key not in self._transaction}
             # And then add them back only if they match our values.
             found.update(self._find_in_transaction(ignore_keys=ignore_keys,
                                                    **key_value_pairs))
         return list(found)
 
-    def get(self, key=None, default=None, transaction=True, **key_value_pairs):
+    def get(self, key=None, default=None, transaction=True, readonly=False,
+            **key_value_pairs):
         """Get data from the store by one or more of its attribute values.
 
+        Unless `readonly` is True, the data returned is a copy that the
+        caller is free to change.  A read-only view shares the data held by
+        the store, skipping the copy; use its `thaw` method to get data that
+        can be changed.
+
         :param key: The key to get; if given `key_value_pairs` will be ignored
         :param default: A default value to return if no entity is found; if
                         default is an exception, it will be raised instead
         :param bool transaction: Whether to check the transaction
+        :param bool readonly: Whether to return a read-only view of the data
         :param iterable key_value_pairs: Pairs of keys and values to
                                          match against
-        :returns dict: A matching data blob, or default
+        :returns dict|FrozenDict: A matching data blob, or default
         :raises KeyError: If more than one key matches the given values
 
         """
+        copy = freeze if readonly else deepcopy
         if key is None:
             matches = self.find(transaction=transaction, **key_value_pairs)
             if len(matches) > 1:
@@ -271,15 +1148,88 @@ class DataStore:
             if transaction and key in self._transaction:
                 data = self._transaction[key]
                 if data is not None:
-                    return deepcopy(data)
+                    return copy(data)
             else:
-                return self._get(key)
+                data = self._get_in_flight(key)
+                if data is NO_VALUE:
+                    if self._is_filtered(key):
+                        data = None
+                    elif self._cache is None:
+                        data = self._get(key)
+                        # Nothing else has this data, so it needs no copy.
+                        return freeze(data, owned=True) if readonly else data
+                    else:
+                        return copy(self._read(key))
+                if data is not None:
+                    return copy(data)
         # Nothing was found.
         if isinstance(default, type) and issubclass(default, Exception):
             raise default
         else:
             return default
 
+    def get_many(self, keys, transaction=True, readonly=False):
+        """Get the data for a number of keys at once.
+
+        Any keys that aren't in the transaction, being written or in the
+        read cache are fetched from the store in one batch, which some
+        stores can do in a single read.  As with `get`, the data is copied
+        unless `readonly` is True.
+
+        :param iterable keys: The keys to get
+        :param bool transaction: Whether to check the transaction
+        :param bool readonly: Whether to return read-only views of the data
+        :returns OrderedDict: The data for each key that was found, in the
+                              order the keys were given
+
+        """
+        copy = freeze if readonly else deepcopy
+        found = OrderedDict()
+        missing = []
+        for key in keys:
+            if key in found:
+                continue
+            if transaction and key in self._transaction:
+                data = self._transaction[key]
+            else:
+                data = self._get_in_flight(key)
+                if data is NO_VALUE:
+                    if self._is_filtered(key):
+                        data = None
+                    elif self._cache is not None and key in self._cache:
+                        self._cache_hits += 1
+                        data = self._cache[key]
+                    else:
+                        missing.append(key)
+            if data is None or data is NO_VALUE:
+                found[key] = NO_VALUE
+            else:
+                found[key] = copy(data)
+        for key, data in self._get_many(missing) if missing else ():
+            if self._cache is None:
+                # Nothing else has this data, so it needs no copy.
+                found[key] = freeze(data, owned=True) if readonly else data
+            else:
+                self._cache_misses += 1
+                self._cache[key] = data
+                found[key] = copy(data)
+        return OrderedDict((key, data) for key, data in found.items()
+                           if data is not NO_VALUE)
+
+    def prefetch(self, keys):
+        """Read the data for a number of keys into the read cache at once.
+
+        This is only a hint that the keys will be needed soon, so stores
+        without a read cache ignore it.
+
+        :param iterable keys: The keys to read
+        :returns None:
+
+        """
+        if self._cache is not None:
+            self.get_many([key for key in keys if key not in self._cache],
+                          readonly=True)
+
     def put(self, key, data):
         """Put data into the store.
 
@@ -296,6 +1246,7 @@ class DataStore:
         except ReferenceError:
             # Suppress occasional ignored exception in OrderedDict internals.
             pass
+        self._index_transaction(key, data)
 
     def delete(self, key):
         """Delete date from the store.
@@ -318,32 +1269,188 @@ class DataStore:
             # Storing None for a key in the transaction will tell the store
             # to delete that key during the next commit.
             self._transaction[key] = None
+        self._index_transaction(key, None)
 
     @property
     def pending(self):
         """Return whether this store has a pending transaction."""
         return bool(self._transaction)
 
-    def commit(self):
-        """Commit the current data transaction."""
+    @property
+    def writing(self):
+        """Return whether this store has commits still being written."""
+        self._prune_in_flight()
+        return bool(self._in_flight)
+
+    def _write_commit(self, items, generation):
+        """Write the data from a commit to this store.
+
+        :param list items: Pairs of keys and data to write
+        :param int generation: The generation of this commit, or None if
+                               this store doesn't save snapshots
+        :returns None:
+
+        """
+        if generation is not None:
+            # The new generation needs to be saved before any data is
+            # written, so that if we stop partway through, any snapshot
+            # of the indexes will be seen as out of date.
+            self._put_meta("generation", generation)
+        self._write(items)
+
+    def _check_write(self, future):
+        """Log the failure of a background write, if it failed.
+
+        The data itself is put back into the transaction once the commit
+        is pruned, see `_prune_in_flight`.
+
+        """
+        exc = future.exception()
+        if exc is not None:
+            log.error("Failed to write commit to %s!", self,
+                      exc_info=(type(exc), exc, exc.__traceback__))
+
+    @staticmethod
+    def _get_digest(data):
+        """Return a digest of some data, or None if it can't be digested.
+
+        :param dict data: The data to digest
+        :returns bytes: The digest of the data
+
+        """
+        try:
+            return sha1(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)).digest()
+        except Exception:
+            return None
+
+    @property
+    def elided_count(self):
+        """Return how many unchanged writes this store has skipped."""
+        return self._elided_count
+
+    def _get_changed_items(self):
+        """Return the items in the transaction that need to be written.
+
+        Any data that is the same as what was last written for its key
+        is left out, as writing it again would change nothing.
+
+        :returns tuple: A list of pairs of keys and data, and a dict of
+                        the new digests of their data, keyed by key
+
+        """
+        items = []
+        digests = {}
+        for key, data in self._transaction.items():
+            digest = None if data is None else self._get_digest(data)
+            if digest is not None and self._digests.get(key) == digest:
+                self._elided_count += 1
+                continue
+            items.append((key, data))
+            digests[key] = digest
+        return items, digests
+
+    def _update_digests(self, digests):
+        for key, digest in digests.items():
+            if digest is None:
+                self._digests.pop(key, None)
+            else:
+                self._digests[key] = digest
+
+    def commit(self, background=False):
+        """Commit the current data transaction.
+
+        A background commit hands the transaction off to a writer thread
+        and returns immediately; until the data is written, it can still
+        be read back from the store as if it had been.  A normal commit
+        will wait for any background commits to finish first.
+
+        :param bool background: Whether to write the data in the background
+        :returns Future: If `background`, a future for the write, else None
+
+        """
+        if background:
+            self._prune_in_flight()
+        else:
+            self.flush()
         if not self._transaction:
-            return
+            return _get_finished_future() if background else None
+        items, digests = self._get_changed_items()
+        if not items:
+            self._clear_transaction()
+            return _get_finished_future() if background else None
         # We need to update indexes first, otherwise we won't be able to
         # prune an old value from an index.  We also want any exceptions
         # triggered by the indexing to happen before we save everything.
-        for key, data in self._transaction.items():
+        for key, data in items:
             self.update_indexes(key, data)
-        while self._transaction:
-            key, data = self._transaction.popitem(last=False)
-            if data is None:
-                if self._has(key):
-                    self._delete(key)
-            else:
-                self._put(key, data)
+        if self._filter is not None:
+            for key, data in items:
+                self._add_to_filter(key, data)
+        generation = None
+        if self._snapshots:
+            generation = self._generation = self.generation + 1
+        if background:
+            # The transaction's data and indexes are handed off rather than
+            # copied, so the writer has the only reference to them.
+            indexes = self._transaction_indexes
+            self._clear_transaction(keep_data=True)
+            self._uncache(digests)
+            future = _get_writer().submit(self._write_commit,
+                                          items, generation)
+            self._in_flight.append((future, OrderedDict(items), indexes))
+            self._update_digests(digests)
+            future.add_done_callback(self._check_write)
+            return future
+        self._uncache(digests)
+        self._write_commit(items, generation)
+        self._update_digests(digests)
+        self._clear_transaction()
+
+    def flush(self):
+        """Wait for any background commits to this store to be written.
+
+        :returns None:
+
+        """
+        if self._in_flight:
+            wait([future for future, data, indexes in self._in_flight])
+        self._prune_in_flight()
 
     def abort(self):
         """Abort the current data transaction."""
-        self._transaction.clear()
+        self._clear_transaction()
+
+    def compact(self):
+        """Perform any maintenance needed to keep this store's data compact.
+
+        Override this on subclasses that need it; by default it does nothing.
+
+        """
+
+
+def migrate_store(source, target, batch_size=1000):
+    """Copy all the data from one store to another.
+
+    This can be used to move data between kinds of stores, or between
+    stores with different codecs.  The target's indexes are updated as the
+    data is committed, and its transaction is committed every `batch_size`
+    blobs so that the whole store isn't held in memory at once.
+
+    :param DataStore source: The store to copy the data from
+    :param DataStore target: The store to copy the data to
+    :param int batch_size: How many blobs to commit to the target at once
+    :returns int: How many blobs were copied
+
+    """
+    count = 0
+    for key in list(source.keys()):
+        target.put(key, source.get(key))
+        count += 1
+        if not count % batch_size:
+            target.commit()
+    target.commit()
+    log.info("Migrated %s blobs from %s to %s.", count, source, target)
+    return count
 
 
 class DataStoreManager(Manager):
@@ -357,20 +1464,57 @@ class DataStoreManager(Manager):
         log.info("Initializing stores.")
         for store in self._items.values():
             store.initialize()
-            store.build_indexes()
+            if not store.load_indexes():
+                store.build_indexes()
+                store.save_indexes()
+            store.build_filter()
 
-    def commit(self):
-        """Commit the transactions of all registered data stores."""
+    def save_indexes(self):
+        """Save snapshots of the indexes of all registered data stores."""
+        for store in self._items.values():
+            store.save_indexes()
+
+    def commit(self, background=False):
+        """Commit the transactions of all registered data stores.
+
+        :param bool background: Whether to write the data in the background
+        :returns Future: If `background`, a future for the writes, else None
+
+        """
+        if not background:
+            self.flush()
+        # Background writes are done in order by one thread, so the last
+        # one still writing finishing means they all have.
+        future = _get_finished_future() if background else None
         item_count = 0
+        elided_count = 0
         transaction_count = 0
         for store in self._items.values():
             if store.pending:
                 item_count += len(store._transaction)
                 transaction_count += 1
-                store.commit()
+                elided_count -= store.elided_count
+                store_future = store.commit(background=background)
+                elided_count += store.elided_count
+                # A store with nothing to write returns a future that has
+                # already finished, which mustn't replace the future of an
+                # earlier store that is still writing.
+                if background and not store_future.done():
+                    future = store_future
         if item_count or transaction_count:
-            log.debug("Commit %s items from %s transactions.",
-                      item_count, transaction_count)
+            log.debug("Commit %s items (%s unchanged) from %s transactions.",
+                      item_count, elided_count, transaction_count)
+        return future
+
+    def flush(self):
+        """Wait for any background commits to be written."""
+        for store in self._items.values():
+            store.flush()
+
+    def compact(self):
+        """Compact the data of all registered data stores."""
+        for store in self._items.values():
+            store.compact()
 
     def abort(self):
         """Abort the transactions of all registered data stores."""
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Bloom filters."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+from math import ceil, log
+
+
+class BloomFilter:
+
+    """A probabilistic set of hashable items.
+
+    A Bloom filter can tell for certain that an item was never added to it,
+    but will sometimes (at about `error_rate`) claim to contain an item that
+    wasn't.  Items can't be removed from a filter once they are added.
+
+    Items are hashed with the builtin hash, which is salted differently
+    each time Python starts, so filters can't be saved and loaded.
+
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """Create a new Bloom filter.
+
+        :param int capacity: How many items the filter is sized to hold
+                             before it exceeds its error rate
+        :param float error_rate: The rate of false positives at capacity
+        :returns None:
+
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._size = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self._hash_count = max(1, round(self._size / capacity * log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, item):
+        bits = self._bits
+        for index in self._get_indexes(item):
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def _get_indexes(self, item):
+        # Double hashing gives us as many indexes as we need from two hashes.
+        first = hash(item)
+        second = hash((item, self._size)) | 1
+        size = self._size
+        return ((first + count * second) % size
+                for count in range(self._hash_count))
+
+    def add(self, item):
+        """Add an item to this filter.
+
+        :param hashable item: The item to add
+        :returns None:
+
+        """
+        bits = self._bits
+        for index in self._get_indexes(item):
+            bits[index >> 3] |= 1 << (index & 7)
+        self._count += 1
+
+    def update(self, items):
+        """Add a sequence of items to this filter.
+
+        :param iterable items: The items to add
+        :returns None:
+
+        """
+        for item in items:
+            self.add(item)
@@ -5,7 +5,8 @@
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
 from collections.abc import MutableMapping
-from weakref import ref, WeakMethod, WeakValueDictionary
+from types import MethodType
+from weakref import ref, WeakValueDictionary
 
 
 """
@@ -33,6 +34,8 @@ class _FlagSet:
 
     """
 
+    __slots__ = ("_flags", "_owner_ref")
+
     def __init__(self, owner=None):
         self._flags = set()
         self._owner_ref = ref(owner) if owner else None
@@ -136,18 +139,25 @@ class HasFlags(metaclass=HasFlagsMeta):
     """A mix-in to allow 'flagging' an object through a series of methods.
 
     Each individual class or instance of a class that subclasses this will
-    have a separate flag set, there is no inheritance.
+    have a separate flag set, there is no inheritance.  An instance's flag
+    set isn't created until it is first used.
+
+    Classes using __slots__ need a slot for "_flags".
 
     """
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
-        self._flag_set = _FlagSet(self)
+        self._flags = None
 
     @property
     def flags(self):
         """Return this instance's flag set."""
-        return self._flag_set
+        if self._flags is None:
+            self._flags = _FlagSet(self)
+        return self._flags
 
     def _flags_changed(self):
         """Perform any callbacks for when the flag set has changed.
@@ -166,6 +176,8 @@ class _Tags(MutableMapping):
 
     """
 
+    __slots__ = ("_tags", "_owner_ref")
+
     def __init__(self, owner=None):
         self._tags = {}
         self._owner_ref = ref(owner) if owner else None
@@ -211,15 +223,25 @@ class _Tags(MutableMapping):
 
 class HasTags:
 
-    """A mix-in to allow 'tagging' an object to store arbitrary data."""
+    """A mix-in to allow 'tagging' an object to store arbitrary data.
+
+    An instance's tag collection isn't created until it is first used.
+
+    Classes using __slots__ need a slot for "_tags".
+
+    """
+
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
-        self._tags = _Tags(self)
+        self._tags = None
 
     @property
     def tags(self):
         """Return this instance's tag collection."""
+        if self._tags is None:
+            self._tags = _Tags(self)
         return self._tags
 
     def _tags_changed(self):
@@ -252,37 +274,69 @@ class HasWeaksMeta(type):
             del cls._weak_refs[name]
 
 
+class _WeakMethod:
+
+    """A descriptor for the weak reference methods of HasWeaks.
+
+    Accessed through a class, this returns the method of the same name from
+    the class's metaclass; accessed through an instance, it returns the
+    instance's version of the method instead.
+
+    """
+
+    __slots__ = ("_name",)
+
+    def __init__(self, name):
+        self._name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return MethodType(getattr(type(owner), self._name), owner)
+        return getattr(instance, "_inst" + self._name)
+
+
 class HasWeaks(metaclass=HasWeaksMeta):
 
     """A mix-in to allow objects to store weak references to other objects.
 
     Each individual class or instance of a class that subclasses this will
-    have a separate weak reference dict, there is no inheritance.
+    have a separate set of weak references, there is no inheritance.  An
+    instance's references are kept in a plain dict of weak references that
+    isn't created until the first one is set.
+
+    Classes using __slots__ need a slot for "_inst_weak_refs".
 
     """
 
+    __slots__ = ()
+
+    _get_weak = _WeakMethod("_get_weak")
+    _set_weak = _WeakMethod("_set_weak")
+    _del_weak = _WeakMethod("_del_weak")
+
     def __init__(self):
         super().__init__()
-        self._get_weak_wr = WeakMethod(self._inst_get_weak)
-        self._get_weak = lambda k: self._get_weak_wr()(k)
-        self._set_weak_wr = WeakMethod(self._inst_set_weak)
-        self._set_weak = lambda k, o: self._set_weak_wr()(k, o)
-        self._del_weak_wr = WeakMethod(self._inst_del_weak)
-        self._del_weak = lambda k: self._del_weak_wr()(k)
-        self._weak_refs = WeakValueDictionary()
+        self._inst_weak_refs = None
 
     def _inst_get_weak(self, name):
-        return self._weak_refs.get(name)
+        refs = self._inst_weak_refs
+        if refs is not None:
+            obj_ref = refs.get(name)
+            if obj_ref is not None:
+                return obj_ref()
+        return None
 
     def _inst_set_weak(self, name, obj):
         if obj is None:
-            self._del_weak(name)
+            self._inst_del_weak(name)
         else:
-            self._weak_refs[name] = obj
+            if self._inst_weak_refs is None:
+                self._inst_weak_refs = {}
+            self._inst_weak_refs[name] = ref(obj)
 
     def _inst_del_weak(self, name):
-        if name in self._weak_refs:
-            del self._weak_refs[name]
+        if self._inst_weak_refs and name in self._inst_weak_refs:
+            del self._inst_weak_refs[name]
 
 
 class HasParentMeta(type):
@@ -4,7 +4,9 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
+from itertools import product
 import re
+from weakref import WeakValueDictionary
 
 from .attributes import Attribute, Unset
 from .entities import ENTITIES, Entity
@@ -21,6 +23,8 @@ class Room(Entity):
 
     """A MUD room.  Where the magic happens."""
 
+    __slots__ = ()
+
     _uid_code = "R"
 
     type = "room"
@@ -39,10 +43,25 @@ class Room(Entity):
         (-1, -1, 0): ("southwest", "the northeast"),
     }
 
+    # A spatial index of the rooms in memory, keyed by their coordinates.
+    # Rooms that aren't in memory are found through the store's
+    # coordinate index instead.
+    _coord_index = WeakValueDictionary()
+
+    # Boxes with more coordinates than this are searched by range through
+    # the store's sorted coordinate indexes, rather than one at a time.
+    _box_lookup_limit = 125
+
     def __repr__(self):
         name = self.name if self.name else "(unnamed)"
         return joins("Room<", name, ":", self.get_coord_str(), ">", sep="")
 
+    @property
+    def is_pinned(self):
+        """Return whether this room needs to stay resident in memory."""
+        # Rooms stay resident while there are characters in them.
+        return bool(self._base_blob._get_attr_val("chars"))
+
     @property
     def coords(self):
         """Return a tuple of this room's x,y,z coordinates."""
@@ -58,6 +77,19 @@ class Room(Entity):
             return Unset
         return "{},{},{}".format(self.x, self.y, self.z)
 
+    def _coords_changed(self, old_coords):
+        """Update the spatial index after this room's coordinates change.
+
+        :param tuple<int,int,int> old_coords: The previous coordinates
+        :returns None:
+
+        """
+        if self._coord_index.get(old_coords) is self:
+            del self._coord_index[old_coords]
+        coords = self.coords
+        if Unset not in coords and None not in coords:
+            self._coord_index[coords] = self
+
     def set_coord_from_str(self, coord_str):
         """Set this room's coordinates given a string.
 
@@ -85,21 +117,107 @@ class Room(Entity):
         room.save()
         return room
 
+    @classmethod
+    def get_at(cls, x, y, z, default=None):
+        """Get the room at a set of coordinates.
+
+        :param int x: The X coordinate
+        :param int y: The Y coordinate
+        :param int z: The Z coordinate
+        :param default: A default value to return if no room is found; if
+                        default is an exception, it will be raised instead
+        :returns Room: The room at those coordinates, or default
+
+        """
+        coords = (x, y, z)
+        room = cls._coord_index.get(coords)
+        if room is not None:
+            return room
+        for uid in cls._store.find(x=x, y=y, z=z):
+            room = cls.get(uid)
+            # The room may have moved since it was last saved.
+            if room and room.coords == coords:
+                return room
+        if isinstance(default, type) and issubclass(default, Exception):
+            raise default
+        else:
+            return default
+
+    @classmethod
+    def find_in_box(cls, min_coords, max_coords):
+        """Find all the rooms within a box of coordinates.
+
+        :param tuple<int,int,int> min_coords: One corner of the box
+        :param tuple<int,int,int> max_coords: The opposite corner of the box
+        :returns dict: The found rooms, keyed by their coordinates
+
+        """
+        ranges = [range(min(low, high), max(low, high) + 1)
+                  for low, high in zip(min_coords, max_coords)]
+        found = {}
+        if len(ranges[0]) * len(ranges[1]) * len(ranges[2]) <= (
+                cls._box_lookup_limit):
+            for coords in product(*ranges):
+                room = cls.get_at(*coords)
+                if room:
+                    found[coords] = room
+            return found
+
+        def _in_box(coords):
+            return all(value in _range
+                       for value, _range in zip(coords, ranges))
+
+        for coords, room in list(cls._coord_index.items()):
+            if _in_box(coords):
+                found[coords] = room
+        for uid in cls._store.find(
+                x__between=(ranges[0][0], ranges[0][-1]),
+                y__between=(ranges[1][0], ranges[1][-1]),
+                z__between=(ranges[2][0], ranges[2][-1])):
+            room = cls.get(uid)
+            # The room may have moved since it was last saved.
+            if room and room.coords not in found and _in_box(room.coords):
+                found[room.coords] = room
+        return found
+
+    @classmethod
+    def find_near(cls, x, y, z, radius=1):
+        """Find all the rooms around a set of coordinates.
+
+        :param int x: The X coordinate
+        :param int y: The Y coordinate
+        :param int z: The Z coordinate
+        :param int radius: How far from the coordinates to search
+        :returns dict: The found rooms, keyed by their coordinates; the
+                       room at the coordinates themselves is not included
+
+        """
+        found = cls.find_in_box((x - radius, y - radius, z - radius),
+                                (x + radius, y + radius, z + radius))
+        found.pop((x, y, z), None)
+        return found
+
     def get_exits(self):
         """Return the rooms this room connects to.
 
         :returns dict: The connecting rooms, keyed by direction name
 
         """
-        # This is an inefficient placeholder until an Exit type is in.
+        # This is a placeholder until an Exit type is in.
         found = {}
         for change, (dir_name, rev_name) in self._movement_strings.items():
             x, y, z = map(sum, zip(self.coords, change))
-            room = Room.get(x=x, y=y, z=z)
+            room = Room.get_at(x, y, z)
             if room:
                 found[dir_name] = room
         return found
 
+    def delete(self):
+        """Delete this room from the caches and its store."""
+        if self._coord_index.get(self.coords) is self:
+            del self._coord_index[self.coords]
+        super().delete()
+
     @classmethod
     def get_movement_strings(cls, change):
         """Return a pair of strings to describe character movement.
@@ -177,11 +295,15 @@ class RoomX(CoordAttribute):
     def validate(cls, entity, new_value):
         super().validate(entity, new_value)
         if entity and entity.y is not Unset and entity.z is not Unset:
-            if Room.get(x=new_value, y=entity.y, z=entity.z):
+            if Room.get_at(new_value, entity.y, entity.z):
                 raise ValueError("Room already exists at {},{},{}."
                                  .format(new_value, entity.y, entity.z))
         return new_value
 
+    @classmethod
+    def changed(cls, entity, blob, old_value, new_value):
+        entity._coords_changed((old_value, entity.y, entity.z))
+
 
 @Room.register_attr("y")
 class RoomY(CoordAttribute):
@@ -191,11 +313,15 @@ class RoomY(CoordAttribute):
     def validate(cls, entity, new_value):
         super().validate(entity, new_value)
         if entity and entity.x is not Unset and entity.z is not Unset:
-            if Room.get(x=entity.x, y=new_value, z=entity.z):
+            if Room.get_at(entity.x, new_value, entity.z):
                 raise ValueError("Room already exists at {},{},{}."
                                  .format(entity.x, new_value, entity.z))
         return new_value
 
+    @classmethod
+    def changed(cls, entity, blob, old_value, new_value):
+        entity._coords_changed((entity.x, old_value, entity.z))
+
 
 @Room.register_attr("z")
 class RoomZ(CoordAttribute):
@@ -205,15 +331,27 @@ class RoomZ(CoordAttribute):
     def validate(cls, entity, new_value):
         super().validate(entity, new_value)
         if entity and entity.x is not Unset and entity.y is not Unset:
-            if Room.get(x=entity.x, y=entity.y, z=new_value):
+            if Room.get_at(entity.x, entity.y, new_value):
                 raise ValueError("Room already exists at {},{},{}."
                                  .format(entity.x, entity.y, new_value))
         return new_value
 
+    @classmethod
+    def changed(cls, entity, blob, old_value, new_value):
+        entity._coords_changed((entity.x, entity.y, old_value))
+
+
+# Rooms can be looked up by all three coordinates at once, or by a range
+# of each coordinate.
+Room._store.add_index(("x", "y", "z"))
+Room._store.add_index("x", sorted=True)
+Room._store.add_index("y", sorted=True)
+Room._store.add_index("z", sorted=True)
+
 
 @EVENTS.hook("server_boot", "setup_world")
 def _hook_server_boot():
-    room = Room.get(x=0, y=0, z=0)
+    room = Room.get_at(0, 0, 0)
     if not room:
         Room.generate("0,0,0", "Starting Room", "There's not much to look at.")
         log.warning("Had to generate initial room at 0,0,0.")
@@ -31,6 +31,26 @@ LOG_UTC_TIMES = False
 
 # Storage
 DATA_DIR = join(getcwd(), "data")
+SAVE_PULSE_COUNT = 50  # entities saved per pulse, at most
+SAVE_PULSE_TIME = 0.01  # seconds spent saving per pulse, at most
+# Saving an entity only puts its data in its store's transaction, which is
+# written when the stores are committed every three minutes; these limit how
+# long a changed entity waits to be put there, spreading that work out.
+SAVE_MIN_AGE = 60  # seconds an entity is left unsaved after a change
+SAVE_MAX_AGE = 150  # seconds an entity can go unsaved after a change
+# Live entities kept in memory per type, keyed by type name, and the default
+# for types that aren't listed; scripts/roommemory.py can help size these.
+ENTITY_BUDGET = 2000
+ENTITY_BUDGETS = {
+    "Room": 10000,
+    "Item": 10000,
+}
+EVICT_BATCH_COUNT = 200  # entities evicted per second, at most
+STORE_CACHE_SIZE = 1000  # decoded blobs kept in memory per store, 0 for none
+STORE_FILTER_SIZE = 100000  # keys and index values per store, 0 for none
+# The codec for stored entities, such as "json", "pickle", "binary" or
+# "binary+zlib"; run scripts/migratestore.py before changing it.
+STORE_CODEC = "json"
 
 # Optional modules
 CONTRIB_MODULES = [
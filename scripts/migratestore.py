@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Migrate the data in a file store from one codec to another."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+from argparse import ArgumentParser
+
+from cwmud.core.codecs import get_codec
+from cwmud.core.json import JSONStore
+from cwmud.core.storage import migrate_store
+
+
+def _parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("source", help="the subpath of the store to read")
+    parser.add_argument("target", help="the subpath of the store to write")
+    parser.add_argument("--from", dest="from_codec", default="json",
+                        help="the codec of the source store (default: json)")
+    parser.add_argument("--to", dest="to_codec", default="binary+zlib",
+                        help="the codec of the target store"
+                             " (default: binary+zlib)")
+    parser.add_argument("--sharded", action="store_true",
+                        help="whether the stores are sharded")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # The target needs its own path, as two sharded stores can't share one
+    # manifest; once this is done, move the target into the source's place
+    # and change STORE_CODEC to match.
+    args = _parse_args()
+    source = JSONStore(args.source, sharded=args.sharded,
+                       codec=get_codec(args.from_codec))
+    target = JSONStore(args.target, sharded=args.sharded,
+                       codec=get_codec(args.to_codec))
+    count = migrate_store(source, target)
+    print("Migrated {} blobs from {} ({}) to {} ({}).".format(
+        count, args.source, args.from_codec, args.target, args.to_codec))
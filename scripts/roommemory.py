@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Measure the memory used by each live room."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+from argparse import ArgumentParser
+import gc
+import tracemalloc
+from weakref import WeakMethod, WeakValueDictionary
+
+from cwmud.core.world import Room
+
+
+class _EagerRoom(Room):
+
+    """A room laid out the way rooms were before they had slots.
+
+    Without __slots__ of its own, each instance gets a __dict__, and its
+    flags, tags and weak references are all set up when it is created,
+    as they used to be.  The data blobs are not changed, so this only
+    stands in for the entity side of the old layout.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Create the containers that are now created on first use.
+        self.flags
+        self.tags
+        # Each instance used to carry its own weak reference helpers.
+        attrs = self.__dict__
+        for name in ("get", "set", "del"):
+            method = WeakMethod(getattr(self, "_inst_{}_weak".format(name)))
+            attrs["_{}_weak_wr".format(name)] = method
+            attrs["_{}_weak".format(name)] = (
+                lambda *args, _method=method: _method()(*args))
+        attrs["_weak_refs"] = WeakValueDictionary()
+
+
+def _parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=500,
+                        help="the number of rooms to create (default: 500)")
+    parser.add_argument("--compare", action="store_true",
+                        help="also measure rooms laid out without slots or"
+                             " lazy containers, for comparison")
+    return parser.parse_args()
+
+
+def measure_rooms(count, room_class=Room):
+    """Create a number of unsaved rooms and measure the memory they use.
+
+    :param int count: The number of rooms to create
+    :param type room_class: The class of room to create
+    :returns float: The average number of bytes allocated per room
+
+    """
+    # Create one first, so that anything done on first use isn't counted.
+    rooms = [room_class(savable=False)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rooms.extend(room_class(savable=False) for _ in range(count))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    if args.compare:
+        print("{:.0f} bytes per room without slots or lazy containers."
+              .format(measure_rooms(args.count, _EagerRoom)))
+    print("{:.0f} bytes per room over {} rooms.".format(
+        measure_rooms(args.count), args.count))
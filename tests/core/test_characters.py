@@ -5,10 +5,14 @@
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
 from collections import deque
+from unittest.mock import patch
+
 import pytest
 
 from cwmud.core.attributes import Unset
 from cwmud.core.characters import Character
+from cwmud.core.entities import resolve_references
+from cwmud.core.items import Item
 from cwmud.core.utils import joins
 from cwmud.core.world import Room
 
@@ -94,6 +98,20 @@ class TestCharacters:
         assert character.room is room
         assert character in room.chars
 
+    def test_character_room_transient(self, character, room, other_room):
+        """Test that moving characters doesn't make their rooms dirty."""
+        room._dirty = other_room._dirty = False
+        character.room = other_room
+        character.room = room
+        assert not room.is_dirty and not other_room.is_dirty
+        assert character in room.chars
+        # Room occupancy isn't saved, and is ignored in old room data.
+        data = room.serialize()
+        assert "chars" not in data
+        data["chars"] = ["some_uid"]
+        room.deserialize(data)
+        assert set(room.chars) == {character}
+
     def test_character_act(self, character, other_character):
         """Test that we can generate 'act' messages for a character."""
         character.active = True
@@ -230,3 +248,35 @@ class TestCharacters:
         data["room"] = other_room.uid
         character.deserialize(data)
         assert character.room is other_room
+
+    def test_character_inventory_lazy(self):
+        """Test that a character's inventory is loaded when first used."""
+        items = [Item(savable=False) for _ in range(3)]
+        data = {"inventory": [item.uid for item in items] + ["missing"]}
+        with patch.object(Item, "get_many", wraps=Item.get_many) as get_many:
+            new_character = Character(data, savable=False)
+            inventory = new_character.inventory
+            assert not inventory.is_resolved
+            # Saving it again doesn't need the items.
+            serialized = new_character.serialize()
+            assert serialized["inventory"] == data["inventory"]
+            assert not get_many.called
+            assert list(inventory) == items
+            get_many.assert_called_once_with(set(data["inventory"]))
+        assert inventory.is_resolved
+        # Items that couldn't be loaded are dropped.
+        assert inventory.get_uids() == [item.uid for item in items]
+
+    def test_character_inventory_resolve_together(self):
+        """Test that we can load the inventories of characters together."""
+        item, other_item = Item(savable=False), Item(savable=False)
+        characters = [
+            Character({"inventory": [item.uid, other_item.uid]},
+                      savable=False),
+            Character({"inventory": [other_item.uid]}, savable=False),
+        ]
+        with patch.object(Item, "get_many", wraps=Item.get_many) as get_many:
+            resolve_references(char.inventory for char in characters)
+            get_many.assert_called_once_with({item.uid, other_item.uid})
+        assert list(characters[0].inventory) == [item, other_item]
+        assert list(characters[1].inventory) == [other_item]
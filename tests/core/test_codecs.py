@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Tests for codecs for encoding stored data."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+import json
+import pickle
+import zlib
+
+import pytest
+
+from cwmud.core.codecs import (BinaryCodec, get_codec, JSONCodec,
+                               PickleCodec, ZlibCodec)
+from cwmud.core.json import JSONStore
+from cwmud.core.pickle import PickleStore
+from cwmud.core.storage import migrate_store
+
+
+DATA = {
+    "type": "Room",
+    "uid": "R-6jQZ4zvH",
+    "name": "A Room",
+    "x": 5, "y": -300, "z": 2 ** 70,
+    "weight": 1.5,
+    "flags": ["dark", "dark", "indoors"],
+    "items": ["I-6jQZ4zvH", "I-6jQZ4zvI", "I-6jQZ4zvH"],
+    "tags": {"note": None, "visited": True, "locked": False, "": "é"},
+}
+
+
+@pytest.mark.parametrize("spec", ["json", "pickle", "binary",
+                                  "binary+zlib", "json+zlib"])
+def test_codec_round_trip(spec):
+    """Test that each codec can decode what it encodes."""
+    codec = get_codec(spec)
+    raw = codec.encode(DATA)
+    assert isinstance(raw, bytes)
+    assert codec.decode(raw) == DATA
+
+
+def test_codec_get():
+    """Test that we can look up codecs by name."""
+    assert isinstance(get_codec("json"), JSONCodec)
+    codec = get_codec("binary+zlib")
+    assert isinstance(codec, ZlibCodec)
+    assert codec.name == "binary+zlib" and codec.extension == ".bin.z"
+    with pytest.raises(KeyError):
+        get_codec("nope")
+    with pytest.raises(KeyError):
+        get_codec("json+nope")
+
+
+def test_codec_pickle_protocol():
+    """Test that pickles use the highest protocol by default."""
+    raw = PickleCodec().encode(DATA)
+    assert raw[1] == pickle.HIGHEST_PROTOCOL
+
+
+def test_codec_binary():
+    """Test the specifics of the binary codec."""
+    codec = BinaryCodec()
+    raw = codec.encode(DATA)
+    # Repeated strings shouldn't be stored twice.
+    assert raw.count(b"I-6jQZ4zvH") == 1
+    assert len(raw) < len(json.dumps(DATA, separators=(",", ":")))
+    # Tuples are decoded as lists, like JSON.
+    assert codec.decode(codec.encode({"a": (1, 2)})) == {"a": [1, 2]}
+    with pytest.raises(TypeError):
+        codec.encode({1: 2})
+    with pytest.raises(TypeError):
+        codec.encode({"a": {1, 2}})
+    with pytest.raises(ValueError):
+        codec.decode(b"\x09")
+
+
+def test_codec_migrate_store():
+    """Test that we can migrate a store to another codec."""
+    source = JSONStore("test_codec_source")
+    target = PickleStore("test_codec_target",
+                         codec=get_codec("binary+zlib"))
+    for key in list(source.keys()) + list(target.keys()):
+        for store in (source, target):
+            if store.has(key):
+                store.delete(key)
+    source.put("a", DATA)
+    source.put("b", {"x": 1})
+    source.commit()
+    assert migrate_store(source, target, batch_size=1) == 2
+    assert sorted(target._keys()) == ["a", "b"]
+    assert target._get("a") == DATA
+    with open(target._get_key_path("b"), "rb") as data_file:
+        assert BinaryCodec().decode(
+            zlib.decompress(data_file.read())) == {"x": 1}
+    for store in (source, target):
+        for key in ("a", "b"):
+            store.delete(key)
+        store.commit()
@@ -4,13 +4,15 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import pytest
 
+from cwmud import settings
 from cwmud.core.attributes import Attribute, DataBlob
 from cwmud.core.entities import ENTITIES, Entity, EntityManager
 from cwmud.core.pickle import PickleStore
+from cwmud.core.timing import TIMERS
 from cwmud.core.utils.exceptions import AlreadyExists
 
 
@@ -82,22 +84,74 @@ class TestEntityManagers:
 
     def test_entity_manager_save(self, manager):
         """Test that we can save all of a manager's dirty entities."""
-        mock1 = Mock(is_savable=True, is_dirty=False)
-        SomeEntity._instances["mock1"] = mock1
-        mock2 = Mock(is_savable=True, is_dirty=False)
-        SomeEntity._instances["mock2"] = mock2
+        entities = [SomeEntity() for _ in range(2)]
+        Entity._dirty_queue.clear()
+        for entity in entities:
+            entity._dirty = False
         # First test with no dirty entities.
-        manager.save()
-        assert not mock1.save.called
-        assert not mock1.save.called
+        with patch.object(SomeEntity, "save") as save:
+            manager.save()
+            assert not save.called
         # Then test with a dirty entity.
-        mock1.is_dirty = True
+        entities[0].dirty()
+        manager.save()
+        assert not entities[0].is_dirty
+        assert not Entity._dirty_queue
+        # Entities of types not registered with the manager are left alone.
+        another = Entity()
+        another._dirty = False
+        another.dirty()
         manager.save()
-        assert mock1.save.called
-        assert not mock2.save.called
-        # Clean up the mock entities.
-        del SomeEntity._instances["mock1"]
-        del SomeEntity._instances["mock2"]
+        assert another.is_dirty
+        assert len(Entity._dirty_queue) == 1
+        Entity._dirty_queue.clear()
+        # Clean up the entities.
+        for entity in entities:
+            entity.delete()
+
+    def test_entity_manager_save_pending(self, manager):
+        """Test that we can save dirty entities a few at a time."""
+        entities = [SomeEntity() for _ in range(3)]
+        Entity._dirty_queue.clear()
+        for entity in entities:
+            entity._dirty = False
+            entity.dirty()
+        # Dirtying an entity again doesn't move it back in the queue.
+        entities[0].dirty()
+        assert len(Entity._dirty_queue) == 3
+        assert manager.save_pending(max_count=2) == 2
+        assert not entities[0].is_dirty and not entities[1].is_dirty
+        assert entities[2].is_dirty
+        assert manager.save_pending(max_count=0) == 0
+        assert manager.save_pending(max_time=0) == 0
+        # Entities that have been dirty too long are saved regardless.
+        assert manager.save_pending(max_count=0, max_age=0) == 1
+        assert not entities[2].is_dirty
+        assert not Entity._dirty_queue
+        # Entities that haven't been dirty long enough aren't saved, even
+        # when they are dirtied again every time.
+        for _ in range(5):
+            entities[0].dirty()
+            assert manager.save_pending(min_age=10) == 0
+        with patch.object(TIMERS, "_time", TIMERS.time + 10):
+            assert manager.save_pending(min_age=10) == 1
+        assert not entities[0].is_dirty
+        for entity in entities:
+            entity.delete()
+
+    def test_entity_manager_evict(self, manager):
+        """Test that we can evict the entities of types over budget."""
+        entities = [SomeEntity() for _ in range(3)]
+        cache = SomeEntity._caches["uid"]
+        coldest = list(cache)[:2]
+        with patch.object(settings, "ENTITY_BUDGETS",
+                          {"SomeEntity": len(cache) - 2}):
+            assert manager.evict(max_count=1) == 1
+            assert manager.evict() == 1
+            assert manager.evict() == 0
+        assert not any(uid in cache for uid in coldest)
+        for entity in entities:
+            entity.delete()
 
 
 class TestEntities:
@@ -124,20 +178,102 @@ class TestEntities:
         with pytest.raises(TypeError):
             SomeEntity.register_attr("another_attr")(None)
 
+    def test_entity_blob_layout(self):
+        """Test that an entity's blob layout is compiled once and reused."""
+        class LayoutEntity(SomeEntity):
+            """A test subclass of a subclass of entity."""
+        layout = LayoutEntity._get_blob_layout()
+        assert LayoutEntity._get_blob_layout() is layout
+        assert {"version", "buddy", "test_attr"} <= set(layout._attrs)
+        assert "test_blob" in layout._blobs
+        assert type(LayoutEntity()._base_blob) is layout
+        # Registering on an ancestor changes the layout of its subclasses.
+
+        @SomeEntity.register_attr("layout_attr")
+        class LayoutAttribute(Attribute):
+            """A test attribute with a default."""
+            _default = 5
+
+        assert LayoutEntity._get_blob_layout() is not layout
+        assert LayoutEntity().layout_attr == 5
+
+    def test_entity_compact(self):
+        """Test that entities don't create what they don't use."""
+        new_entity = Entity()
+        assert not hasattr(new_entity, "__dict__")
+        assert not hasattr(new_entity._base_blob, "__dict__")
+        data = new_entity.serialize()
+        assert data["flags"] == () and data["tags"] == {}
+        new_entity.deserialize(data)
+        assert new_entity._flags is None and new_entity._tags is None
+
     def test_entity_cache(self):
         """Test entity caching and ejection."""
         SomeEntity.register_cache("test", size=2)
         with pytest.raises(AlreadyExists):
             SomeEntity.register_cache("test")
         # Test that insertions over the size limit will eject one.
-        mocks = [Mock(), Mock(), Mock()]
+        mocks = [{Mock()}, {Mock()}, {Mock()}]
         SomeEntity._caches["test"][0] = mocks[0]
         SomeEntity._caches["test"][1] = mocks[1]
         assert 0 in SomeEntity._caches["test"]
-        assert not mocks[0].save.called
         SomeEntity._caches["test"][2] = mocks[2]
         assert 0 not in SomeEntity._caches["test"]
-        assert mocks[0].save.called
+        # Ejected entities aren't saved, that's left to eviction.
+        assert not next(iter(mocks[0])).save.called
+
+    def test_entity_cache_many_values(self):
+        """Test that a value cache can eject values with live entities."""
+
+        class SomeCachedEntity(SomeEntity):
+            """A test entity with a small value cache."""
+
+        SomeCachedEntity.register_cache("buddy", size=2)
+        entities = [SomeCachedEntity() for _ in range(3)]
+        for entity in entities:
+            entity.buddy = SomeEntity()
+        cache = SomeCachedEntity._caches["buddy"]
+        assert len(cache) == 2
+        assert entities[0].buddy not in cache
+        # The ejected entity is still resident until it is evicted.
+        assert entities[0].uid in SomeCachedEntity._caches["uid"]
+
+    def test_entity_evict(self):
+        """Test that we can evict the coldest instances of an entity."""
+
+        class SomeResidentEntity(SomeEntity):
+            """A test entity that can be pinned in memory."""
+
+            pinned = False
+
+            @property
+            def is_pinned(self):
+                return self.pinned
+
+        # The UID cache has no size limit of its own.
+        entities = [SomeResidentEntity() for _ in range(600)]
+        cache = SomeResidentEntity._caches["uid"]
+        assert len(cache) == 600
+        del entities[6:]
+        entities[0].pinned = True
+        # Dirtying an entity makes it the most recently used.
+        entities[1].dirty()
+        assert list(cache)[-1] == entities[1].uid
+        with patch.object(SomeResidentEntity, "save") as save:
+            assert SomeResidentEntity.evict(3, max_count=3) == 3
+            assert not save.called
+            assert SomeResidentEntity.evict(1) == 596
+            # Only the dirty one is saved.
+            assert save.call_count == 1
+        # Pinned entities are never evicted.
+        assert list(cache) == [entities[0].uid]
+        assert SomeResidentEntity.evict(0) == 0
+        # Evicted entities that are still live become resident again
+        # when they are used.
+        assert SomeResidentEntity.get(entities[2].uid) is entities[2]
+        assert entities[2].uid in cache
+        entities[3].dirty()
+        assert list(cache)[-1] == entities[3].uid
 
     def test_entity_create(self):
         """Test that we can create an entity."""
@@ -230,8 +366,11 @@ class TestEntities:
             Entity.reconstruct(data)
         ENTITIES.register(SomeEntity)
         data["type"] = "SomeEntity"
+        copied_data = dict(data)
         new_entity = Entity.reconstruct(data)
         assert new_entity.serialize() == entity.serialize()
+        # Reconstructing shouldn't change the data it was given.
+        assert data == copied_data
         # Make sure our fixture entity is the one that's cached.
         entity._set_uid(entity.uid)
         assert SomeEntity._instances[entity.uid] is entity
@@ -255,6 +394,70 @@ class TestEntities:
         assert Entity.find(store=False, uid=entity.uid, subclasses=True)
         assert not Entity.find(store=False, uid=entity.uid, subclasses=False)
 
+    def test_entity_find_in_attr_index(self, entity):
+        """Test that we can find cached entities through attribute indexes."""
+        buddy = SomeEntity()
+        entity.buddy = buddy
+        SomeEntity.register_cache("buddy")
+        assert "buddy" in SomeEntity._attr_indexes
+        # Existing instances are indexed when the cache is registered.
+        assert entity in SomeEntity._attr_indexes["buddy"][buddy].values()
+        assert SomeEntity.find(store=False, buddy=buddy) == [entity]
+        # Changing the value moves the entity within the index.
+        entity.buddy = entity
+        assert buddy not in SomeEntity._attr_indexes["buddy"]
+        assert not SomeEntity.find(store=False, buddy=buddy)
+        assert SomeEntity.find(store=False, buddy=entity) == [entity]
+        # Entities that have fallen out of _instances aren't found.
+        del SomeEntity._instances[entity.uid]
+        assert not SomeEntity.find(store=False, buddy=entity)
+        entity._set_uid(entity.uid)
+        assert SomeEntity.find(store=False, buddy=entity) == [entity]
+        # Subclasses get their own copy of the index.
+
+        class SomeIndexedEntity(SomeEntity):
+            """A test subclass of a subclass of entity."""
+        assert SomeIndexedEntity._attr_indexes["buddy"] == {}
+
+    def test_entity_find_in_store(self, entity):
+        """Test that finding entities in a store reuses live instances."""
+        entity.save()
+        with patch.object(SomeEntity._store, "keys",
+                          side_effect=AssertionError):
+            found = SomeEntity.find(cache=False, uid=entity.uid)
+            assert found == [entity] and found[0] is entity
+            assert SomeEntity.get(entity.uid, cache=False) is entity
+        # The store is shared with a subclass, but only searched once.
+        stores = SomeEntity._get_stores()
+        assert list(stores) == [SomeEntity._store]
+        assert "SomeEntity" in stores[SomeEntity._store]
+        assert SomeEntity._store.has_index("type")
+        # Entities of other types aren't found in a shared store.
+        other = Entity()
+        with patch.object(Entity, "_store", SomeEntity._store):
+            other.save()
+        assert not SomeEntity.get(other.uid, cache=False)
+        assert not SomeEntity.find(cache=False, uid=other.uid)
+
+    def test_entity_get_many(self, entity):
+        """Test that we can get many entities with one store read."""
+        stored = SomeEntity()
+        stored.save()
+        # It has to be in the store itself to be read from it.
+        SomeEntity._store.commit()
+        uid = stored.uid
+        del SomeEntity._instances[uid]
+        del stored
+        with patch.object(SomeEntity._store, "_get_many",
+                          wraps=SomeEntity._store._get_many) as get_many:
+            found = SomeEntity.get_many([entity.uid, uid, "nonexistent"])
+            assert get_many.call_count == 1
+        assert len(found) == 2
+        assert found[0] is entity and found[1].uid == uid
+        # Entities that are already loaded aren't read again.
+        SomeEntity.prefetch([entity.uid, uid])
+        assert SomeEntity.get_many([uid]) == [found[1]]
+
     def test_entity_find_relations(self, entity):
         """Test that we can find an entity by UID or reference."""
         buddy = SomeEntity()
@@ -4,8 +4,11 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
+from os import listdir
 from os.path import exists, join
 from shutil import rmtree
+from threading import Event
+from unittest.mock import patch
 
 import pytest
 
@@ -100,3 +103,94 @@ class TestJSONStores:
         self.store._delete("test")
         assert not exists(self.json_path)
         assert not self.store._has("test")
+
+    def test_jsonstore_meta(self):
+        """Test that we can save metadata alongside a JSON store's data."""
+        assert self.store._get_meta("test") is None
+        self.store._put_meta("test", {"generation": 5, "keys": {"a"}})
+        assert self.store._get_meta("test") == {"generation": 5,
+                                                "keys": {"a"}}
+        # Metadata files shouldn't be mistaken for keys.
+        assert "test" not in tuple(self.store._keys())
+
+
+class TestShardedJSONStores:
+
+    """A collection of tests for sharded JSON stores."""
+
+    store_path = join(settings.DATA_DIR, "json", "test_sharded")
+
+    @classmethod
+    def setup_class(cls):
+        """Clean up any previous test data directory."""
+        if exists(cls.store_path):
+            rmtree(cls.store_path)
+
+    @classmethod
+    def teardown_class(cls):
+        """Clean up our test data directory."""
+        if exists(cls.store_path):
+            rmtree(cls.store_path)
+
+    def test_jsonstore_sharded_migrate(self):
+        """Test that a flat JSON store is moved into shards."""
+        flat_store = JSONStore("test_sharded")
+        flat_store._put("flat", {"test": 1})
+        store = JSONStore("test_sharded", sharded=True)
+        path = store._get_key_path("flat")
+        assert path.endswith(join(store._get_shard("flat"), "flat.json"))
+        assert exists(path)
+        assert "flat.json" not in listdir(self.store_path)
+        assert tuple(store._keys()) == ("flat",)
+        assert store._get("flat") == {"test": 1}
+
+    def test_jsonstore_sharded_manifest(self):
+        """Test that a sharded JSON store keeps a manifest of its keys."""
+        store = JSONStore("test_sharded", sharded=True)
+        store.put("test", {"test": 2})
+        store.delete("flat")
+        store.commit()
+        assert store._has("test") and not store._has("flat")
+        with pytest.raises(TypeError):
+            store._has(5)
+        assert store._manifest_lines == 5
+        store.compact()
+        assert store._manifest_lines == 2
+        # A new instance should load the keys from the manifest alone.
+        store = JSONStore("test_sharded", sharded=True)
+        assert tuple(store._keys()) == ("test",)
+
+    def test_jsonstore_sharded_rebuild(self):
+        """Test that an incomplete manifest is rebuilt."""
+        store = JSONStore("test_sharded", sharded=True)
+        store.put("another", {"test": 3})
+        # Pretend that we stopped before the commit was finished.
+        store._write_commit = lambda items, generation: (
+            store._put_meta("generation", generation))
+        store.commit()
+        store = JSONStore("test_sharded", sharded=True)
+        assert tuple(store._keys()) == ("test",)
+        assert store._manifest_generation == store.generation
+
+    def test_jsonstore_sharded_write_unlocked(self):
+        """Test that the manifest isn't locked while files are written."""
+        store = JSONStore("test_sharded", sharded=True)
+        writing = Event()
+        release = Event()
+        put_file = store._put_file
+
+        def _put_file(key, data):
+            writing.set()
+            release.wait(5)
+            put_file(key, data)
+
+        store.put("slow", {"test": 4})
+        with patch.object(store, "_put_file", _put_file):
+            future = store.commit(background=True)
+            assert writing.wait(5)
+            assert store._lock.acquire(timeout=1)
+            store._lock.release()
+            assert not store._has("slow") and store.has("slow")
+            release.set()
+            future.result(5)
+        assert store._has("slow")
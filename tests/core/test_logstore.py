@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Tests for log-structured data storage."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+from os import listdir, remove
+from os.path import exists, join
+from shutil import rmtree
+from threading import Event
+from unittest.mock import patch
+
+import pytest
+
+from cwmud import settings
+from cwmud.core.logstore import LogStore
+
+
+class TestLogStores:
+
+    """A collection of tests for log stores."""
+
+    store = None
+    store_path = join(settings.DATA_DIR, "log", "test")
+    data = {"test": 123, "yeah": "okay"}
+
+    @classmethod
+    def setup_class(cls):
+        """Clean up any previous test data directory."""
+        # In case tests were previously interrupted.
+        if exists(cls.store_path):
+            rmtree(cls.store_path)
+
+    @classmethod
+    def teardown_class(cls):
+        """Clean up our test data directory."""
+        if exists(cls.store_path):
+            rmtree(cls.store_path)
+
+    def _segments(self):
+        return sorted(name for name in listdir(self.store_path)
+                      if name.endswith(".seg"))
+
+    def test_logstore_create(self):
+        """Test that we can create a new log store."""
+        assert not exists(self.store_path)
+        type(self).store = LogStore("test", max_segment_size=64)
+        assert exists(self.store_path)
+        assert self.store
+
+    def test_logstore_no_keys(self):
+        """Test that we can check if a log store has no keys."""
+        assert not tuple(self.store.keys())
+
+    def test_logstore_key_not_string(self):
+        """Test that trying to use a non-string as a log store key fails."""
+        with pytest.raises(TypeError):
+            self.store._put(5, {})
+        with pytest.raises(TypeError):
+            self.store._has(False)
+
+    def test_logstore_put(self):
+        """Test that we can put data into a log store."""
+        self.store._put("test", self.data)
+        assert self.store._has("test")
+        assert not self.store._has("nonexistent_key")
+        assert self._segments() == ["00000001.seg"]
+
+    def test_logstore_get(self):
+        """Test that we can get data from a log store."""
+        assert self.store._get("test") == self.data
+
+    def test_logstore_commit_batch(self):
+        """Test that a commit is appended to a segment as one batch."""
+        for n in range(5):
+            self.store.put("key{}".format(n), {"n": n})
+        self.store.commit()
+        # The batch went past the segment size, so it was written to a new
+        # segment as a whole instead of being split.
+        assert self._segments() == ["00000001.seg", "00000002.seg"]
+        assert sorted(self.store._keys()) == [
+            "key0", "key1", "key2", "key3", "key4", "test"]
+        assert self.store._get("key3") == {"n": 3}
+
+    def test_logstore_get_many(self):
+        """Test that we can get many blobs across segments at once."""
+        assert dict(self.store._get_many(
+            ["key4", "nonexistent_key", "test", "key0"])) == {
+                "key0": {"n": 0}, "key4": {"n": 4}, "test": self.data}
+
+    def test_logstore_delete(self):
+        """Test that we can delete data from a log store."""
+        self.store.put("test", {"test": 456})
+        self.store.commit()
+        assert self.store._get("test") == {"test": 456}
+        self.store._delete("key1")
+        assert not self.store._has("key1")
+
+    def test_logstore_reload(self):
+        """Test that a new store instance picks up the existing segments."""
+        store = LogStore("test", max_segment_size=64)
+        assert sorted(store._keys()) == sorted(self.store._keys())
+        assert store._get("test") == {"test": 456}
+        assert not store._has("key1")
+
+    def test_logstore_reload_partial_record(self):
+        """Test that a partially written record is dropped on load."""
+        path = join(self.store_path, self._segments()[-1])
+        with open(path, "ab") as segment_file:
+            segment_file.write(b'["broken",{"n"')
+        store = LogStore("test", max_segment_size=64)
+        assert not store._has("broken")
+        assert store._get("key4") == {"n": 4}
+        with open(path, "rb") as segment_file:
+            assert segment_file.read().endswith(b"\n")
+
+    def test_logstore_reload_partial_first_record(self):
+        """Test that a torn first record isn't read as a segment header."""
+        path = join(self.store_path, "{:08d}.seg".format(
+            self.store._segment + 1))
+        with open(path, "wb") as segment_file:
+            segment_file.write(b'["c",{"v')
+        store = LogStore("test", max_segment_size=64)
+        assert not store._has("c")
+        assert store._get("key4") == {"n": 4}
+        with open(path, "rb") as segment_file:
+            assert not segment_file.read()
+        remove(path)
+
+    def test_logstore_compact(self):
+        """Test that we can compact the sealed segments of a log store."""
+        # Not enough dead space yet.
+        self.store.compact().result()
+        assert len(self._segments()) == 3
+        self.store.compact(force=True).result()
+        assert len(self._segments()) == 2
+        assert self.store._get("key0") == {"n": 0}
+        assert self.store._get("test") == {"test": 456}
+        assert not self.store._has("key1")
+        store = LogStore("test", max_segment_size=64)
+        assert sorted(store._keys()) == sorted(self.store._keys())
+        assert store._get("key2") == {"n": 2}
+
+    def test_logstore_compact_unlocked(self):
+        """Test that records are copied without locking the key map."""
+        for n in range(5):
+            self.store.put("key{}".format(n), {"n": n * 10})
+        self.store.commit()
+        # Seal the segment those were written to.
+        self.store.put("test", {"test": 789})
+        self.store.commit()
+        assert self.store._offsets["key0"][0] < self.store._segment
+        copying = Event()
+        release = Event()
+        real_open = open
+
+        def slow_open(path, mode="r", *args, **kwargs):
+            if path.endswith(".tmp"):
+                copying.set()
+                release.wait(5)
+            return real_open(path, mode, *args, **kwargs)
+
+        with patch("cwmud.core.logstore.open", slow_open, create=True):
+            future = self.store.compact(force=True)
+            assert copying.wait(5)
+            # The lock is free, so we can still read and write while the
+            # records are copied.
+            assert self.store._lock.acquire(timeout=1)
+            self.store._lock.release()
+            self.store.put("key0", {"n": "new"})
+            self.store.commit()
+            release.set()
+            future.result()
+        assert self.store._get("key0") == {"n": "new"}
+        assert self.store._get("key3") == {"n": 30}
+        assert self.store._live[self.store._segment - 1] == sum(
+            length for segment, _, length in self.store._offsets.values()
+            if segment == self.store._segment - 1)
+        store = LogStore("test", max_segment_size=64)
+        assert store._get("key0") == {"n": "new"}
+        assert store._get("key3") == {"n": 30}
@@ -105,9 +105,12 @@ class TestPlayers:
         player.room = room
         assert player.active
         assert player in room.chars
+        assert player.is_pinned and room.is_pinned
         player.suspend()
         assert not player.active
         assert player not in room.chars
+        # Players are only pinned in memory while they are online.
+        assert not player.is_pinned and not room.is_pinned
 
     def test_player_resume(self, player, room):
         """Test that we can resume a player."""
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""Tests for Redis data storage."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+from fnmatch import fnmatchcase
+import pickle
+from unittest.mock import patch
+
+import pytest
+import redis
+
+from cwmud.core.redis import RedisStore
+
+
+def _has_redis_server():
+    try:
+        return redis.StrictRedis().ping()
+    except redis.ConnectionError:
+        return False
+
+
+class _FakeRedis:
+
+    """An in-process stand-in for the Redis commands that stores use.
+
+    Like a client that doesn't decode its responses, names, fields and
+    values all come back as bytes.
+
+    """
+
+    def __init__(self):
+        self._data = {}
+
+    @staticmethod
+    def _encode(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _get(self, name, default):
+        return self._data.get(self._encode(name), default)
+
+    def _setdefault(self, name, default):
+        return self._data.setdefault(self._encode(name), default)
+
+    def _prune(self, name):
+        if not self._get(name, True):
+            del self._data[self._encode(name)]
+
+    def hget(self, name, field):
+        return self._get(name, {}).get(self._encode(field))
+
+    def hmget(self, name, fields):
+        return [self.hget(name, field) for field in fields]
+
+    def hset(self, name, field, value):
+        self._setdefault(name, {})[self._encode(field)] = self._encode(value)
+
+    def hdel(self, name, field):
+        self._get(name, {}).pop(self._encode(field), None)
+        self._prune(name)
+
+    def hkeys(self, name):
+        return list(self._get(name, {}))
+
+    def hexists(self, name, field):
+        return self._encode(field) in self._get(name, {})
+
+    def hgetall(self, name):
+        return dict(self._get(name, {}))
+
+    def sadd(self, name, member):
+        self._setdefault(name, set()).add(self._encode(member))
+
+    def srem(self, name, member):
+        self._get(name, set()).discard(self._encode(member))
+        self._prune(name)
+
+    def smembers(self, name):
+        return set(self._get(name, set()))
+
+    def sinter(self, names):
+        return set.intersection(*[self.smembers(name) for name in names])
+
+    def scan_iter(self, match):
+        return [name for name in list(self._data)
+                if fnmatchcase(name.decode(), match)]
+
+    def delete(self, *names):
+        for name in names:
+            self._data.pop(self._encode(name), None)
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+
+    """A pipeline for a fake Redis client.
+
+    Commands run at once while keys are being watched, and are queued
+    until `execute` otherwise, as with a real pipeline.
+
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._watching = False
+        self._queued = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queued.clear()
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+        if self._watching:
+            return command
+        return lambda *args: self._queued.append((command, args))
+
+    def watch(self, *names):
+        self._watching = True
+
+    def multi(self):
+        self._watching = False
+
+    def execute(self):
+        for command, args in self._queued:
+            command(*args)
+        self._queued.clear()
+
+
+class TestRedisStores:
+
+    """A collection of tests for Redis stores, using a fake client."""
+
+    store = None
+    data = {"test": 123, "yeah": "okay"}
+
+    @classmethod
+    def _connect(cls):
+        return _FakeRedis()
+
+    @classmethod
+    def setup_class(cls):
+        """Clean up any previous test data."""
+        cls.connection = cls._connect()
+        # In case tests were previously interrupted.
+        RedisStore("test", connection=cls.connection).clear()
+
+    @classmethod
+    def teardown_class(cls):
+        """Clean up our test data."""
+        if cls.store:
+            cls.store.clear()
+
+    def test_redisstore_create(self):
+        """Test that we can create a new Redis data store."""
+        type(self).store = RedisStore("test", connection=self.connection)
+        assert self.store
+
+    def test_redisstore_key_not_string(self):
+        """Test that trying to use a non-string as a Redis key fails."""
+        with pytest.raises(TypeError):
+            self.store._get(5)
+        with pytest.raises(TypeError):
+            self.store._put(False, {})
+
+    def test_redisstore_no_keys(self):
+        """Test that we can check if a Redis store has no keys."""
+        assert not tuple(self.store.keys())
+
+    def test_redisstore_put(self):
+        """Test that we can put data into a Redis store."""
+        assert not self.store._has("test")
+        self.store._put("test", self.data)
+        assert self.store._has("test")
+        assert self.store._get("test") == self.data
+        with pytest.raises(KeyError):
+            self.store._get("nonexistent_key")
+
+    def test_redisstore_get_many(self):
+        """Test that we can get many blobs from a Redis store at once."""
+        assert dict(self.store._get_many(["test", "nonexistent_key"])) == {
+            "test": self.data}
+
+    def test_redisstore_indexes(self):
+        """Test that indexes are kept as Redis sets."""
+        self.store.add_index("test")
+        self.store.add_index("yeah", unique=True)
+        self.store.add_index(("test", "yeah"))
+        # Data written before the indexes were added needs to be indexed.
+        self.store.build_indexes()
+        assert sorted(self.store._get_meta("indexes"), key=str) == [
+            ["test", "yeah"], "test", "yeah"]
+        self.store.put("another", {"test": 123, "yeah": "nope"})
+        self.store.put("third", {"test": 456, "yeah": "yep"})
+        self.store.commit()
+        with patch.object(self.store, "_find_in_store") as find_in_store:
+            assert sorted(self.store.find(test=123)) == ["another", "test"]
+            assert self.store.find(test=123, yeah="nope") == ["another"]
+            assert not find_in_store.called
+        # Keys not covered by an index are checked against the blobs.
+        assert self.store.find(test=456, nope=None) == []
+        assert self.store.find(test__gt=123) == ["third"]
+        self.store.put("third", {"test": 123, "yeah": "yep"})
+        self.store.commit()
+        assert not self.store.find(test=456)
+        assert sorted(self.store.find(test=123)) == [
+            "another", "test", "third"]
+
+    def test_redisstore_meta_json(self):
+        """Test that metadata is kept as JSON and never unpickled."""
+        # The built indexes are read back as they were, composites and all.
+        with patch.object(self.store, "_keys") as keys:
+            self.store.build_indexes()
+            assert not keys.called
+        self.store._redis.hset(self.store._meta_key, "indexes",
+                               pickle.dumps({"test"}))
+        with patch("pickle.loads") as loads:
+            assert self.store._get_meta("indexes") is None
+            assert not loads.called
+        # Unreadable metadata is treated as missing, so the indexes are
+        # built again.
+        self.store.build_indexes()
+        assert len(self.store._get_meta("indexes")) == 3
+        assert self.store.find(test=123, yeah="nope") == ["another"]
+
+    def test_redisstore_unique_index(self):
+        """Test that unique indexes are enforced when writing."""
+        self.store.put("duplicate", {"yeah": "okay"})
+        with pytest.raises(KeyError):
+            self.store.commit()
+        self.store.abort()
+        assert not self.store._has("duplicate")
+        # A key can keep its own unique value.
+        self.store.put("test", {"test": 789, "yeah": "okay"})
+        self.store.commit()
+        assert self.store.get(yeah="okay") == {"test": 789, "yeah": "okay"}
+
+    def test_redisstore_commit_pipelined(self):
+        """Test that a commit is written in one transaction."""
+        for number in range(10):
+            self.store.put("many" + str(number), {"test": number})
+        with patch.object(self.store._redis, "pipeline",
+                          wraps=self.store._redis.pipeline) as pipeline:
+            self.store.commit()
+            assert pipeline.call_count == 1
+        assert self.store.find(test=5) == ["many5"]
+
+    def test_redisstore_delete(self):
+        """Test that we can delete data from a Redis store."""
+        assert self.store.find(test=789) == ["test"]
+        self.store.delete("test")
+        self.store.commit()
+        assert not self.store._has("test")
+        assert not self.store.find(test=789)
+        assert not self.store.find(yeah="okay")
+
+
+@pytest.mark.skipif(not _has_redis_server(),
+                    reason="needs a Redis server on localhost")
+class TestRedisServerStores(TestRedisStores):
+
+    """The same tests for Redis stores, against a real Redis server."""
+
+    store = None
+
+    @classmethod
+    def _connect(cls):
+        return redis.StrictRedis()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Tests for SQLite data storage."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+from os import remove
+from os.path import exists, join
+from unittest.mock import patch
+
+import pytest
+
+from cwmud import settings
+from cwmud.core.sqlite import SQLiteStore
+
+
+class TestSQLiteStores:
+
+    """A collection of tests for SQLite stores."""
+
+    store = None
+    db_path = join(settings.DATA_DIR, "sqlite", "test.db")
+    data = {"test": 123, "yeah": "okay"}
+
+    @classmethod
+    def setup_class(cls):
+        """Clean up any previous test database."""
+        # In case tests were previously interrupted.
+        if exists(cls.db_path):
+            remove(cls.db_path)
+
+    @classmethod
+    def teardown_class(cls):
+        """Clean up our test database."""
+        if cls.store:
+            cls.store._connection.close()
+        if exists(cls.db_path):
+            remove(cls.db_path)
+
+    def test_sqlitestore_create(self):
+        """Test that we can create a new SQLite data store."""
+        assert not exists(self.db_path)
+        type(self).store = SQLiteStore("test")
+        # The database file for this store should have been created.
+        assert exists(self.db_path)
+        assert self.store
+
+    def test_sqlitestore_key_not_string(self):
+        """Test that trying to use a non-string as a SQLite key fails."""
+        with pytest.raises(TypeError):
+            self.store._get(5)
+        with pytest.raises(TypeError):
+            self.store._put(False, {})
+
+    def test_sqlitestore_no_keys(self):
+        """Test that we can check if a SQLite store has no keys."""
+        assert not tuple(self.store.keys())
+
+    def test_sqlitestore_put(self):
+        """Test that we can put data into a SQLite store."""
+        assert not self.store._has("test")
+        self.store._put("test", self.data)
+        assert self.store._has("test")
+
+    def test_sqlitestore_has(self):
+        """Test that we can tell if a SQLite store has a key."""
+        assert self.store._has("test")
+        assert not self.store._has("nonexistent_key")
+
+    def test_sqlitestore_keys(self):
+        """Test that we can iterate through a SQLite store's keys."""
+        self.store._put("yeah", {})
+        assert tuple(sorted(self.store._keys())) == ("test", "yeah")
+
+    def test_sqlitestore_get(self):
+        """Test that we can get data from a SQLite store."""
+        assert self.store._get("test") == self.data
+        with pytest.raises(KeyError):
+            self.store._get("nonexistent_key")
+
+    def test_sqlitestore_get_many(self):
+        """Test that we can get many blobs from a SQLite store at once."""
+        with patch.object(self.store, "_max_keys_per_select", 1):
+            assert dict(self.store._get_many(
+                ["test", "nonexistent_key", "yeah"])) == {
+                    "test": self.data, "yeah": {}}
+
+    def test_sqlitestore_find(self):
+        """Test that we can find data through SQL queries."""
+        self.store.add_index("test")
+        self.store.add_index("yeah", unique=True)
+        with pytest.raises(ValueError):
+            self.store.add_index("bad key")
+        self.store.put("another", {"test": 123, "yeah": "nope",
+                                   "list": [1, 2]})
+        self.store.commit()
+        assert sorted(self.store.find(test=123)) == ["another", "test"]
+        assert self.store.find(test=123, yeah="okay") == ["test"]
+        assert self.store.find(list=[1, 2]) == ["another"]
+        assert not self.store.find(test=456)
+        assert not self.store.find(test=123, ignore_keys=["test", "another"])
+        assert self.store.get(yeah="nope") == self.store._get("another")
+
+    def test_sqlitestore_composite_index(self):
+        """Test that we can add an index on more than one key."""
+        self.store.add_index(("test", "yeah"))
+        with pytest.raises(ValueError):
+            self.store.add_index(("test", "bad key"))
+        cursor = self.store._connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'index_test_yeah'")
+        assert cursor.fetchone()
+        assert self.store.find(test=123, yeah="nope") == ["another"]
+
+    def test_sqlitestore_range_lookups(self):
+        """Test that range and prefix lookups are done through SQL."""
+        self.store.put("range", {"test": 200, "yeah": "yep"})
+        self.store.commit()
+        assert self.store.find(test__gt=123) == ["range"]
+        assert sorted(self.store.find(test__lte=200)) == [
+            "another", "range", "test"]
+        assert self.store.find(test__between=(124, 300)) == ["range"]
+        assert self.store.find(yeah__startswith="ye") == ["range"]
+        assert not self.store.find(test__startswith="1")
+        assert self.store.find(list__gt=[1, 1]) == ["another"]
+        self.store.delete("range")
+        self.store.commit()
+
+    def test_sqlitestore_find_in_transaction(self):
+        """Test that pending data is still found before a commit."""
+        self.store.put("pending", {"test": 456})
+        assert self.store.find(test=456) == ["pending"]
+        self.store.abort()
+        assert not self.store.find(test=456)
+
+    def test_sqlitestore_unique_index(self):
+        """Test that unique indexes are enforced by the database."""
+        self.store.put("duplicate", {"yeah": "okay"})
+        with pytest.raises(KeyError):
+            self.store.commit()
+        self.store.abort()
+        assert not self.store._has("duplicate")
+
+    def test_sqlitestore_commit_background(self):
+        """Test that a SQLite store can be written by the writer thread."""
+        self.store.put("background", {"test": 789})
+        future = self.store.commit(background=True)
+        assert self.store.get("background") == {"test": 789}
+        self.store.flush()
+        assert future.done() and not future.exception()
+        assert self.store._get("background") == {"test": 789}
+
+    def test_sqlitestore_filter(self):
+        """Test that a SQLite store's filter includes its index values."""
+        self.store._filter_size = 100
+        self.store.build_filter()
+        assert (None, "background") in self.store._filter
+        assert ("test", 789) in self.store._filter
+        assert (("test", "yeah"), (123, "nope")) in self.store._filter
+        assert not self.store.find(test=999)
+        self.store._filter_size = 0
+        self.store._filter = None
+
+    def test_sqlitestore_delete(self):
+        """Test that we can delete data from a SQLite store."""
+        assert self.store._has("test")
+        self.store._delete("test")
+        assert not self.store._has("test")
@@ -4,9 +4,13 @@
 # :copyright: (c) 2008 - 2017 Will Hutcheson
 # :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
 
+from threading import Event
+from unittest.mock import patch
+
 import pytest
 
-from cwmud.core.storage import DataStore, DataStoreManager
+from cwmud.core.storage import (DataStore, DataStoreManager,
+                                FrozenDict, FrozenList)
 from cwmud.core.utils.exceptions import AlreadyExists
 
 
@@ -24,8 +28,8 @@ class TestDataStores:
 
         _opens = False
 
-        def __init__(self):
-            super().__init__()
+        def __init__(self, cache_size=0, filter_size=0):
+            super().__init__(cache_size=cache_size, filter_size=filter_size)
             self._stored = {}
             self._opened = False
 
@@ -290,3 +294,600 @@ class TestDataStores:
         assert not self.store.pending
         self.stores.abort()
         assert not self.store._stored
+
+
+class TestIndexSnapshots:
+
+    """A collection of tests for saving and loading index snapshots."""
+
+    class _SnapshotStore(TestDataStores._TestStore):
+
+        """A test store that can save index snapshots."""
+
+        _snapshots = True
+
+        def __init__(self, meta=None):
+            super().__init__()
+            self._meta = meta if meta is not None else {}
+
+        def _get_meta(self, name):
+            return self._meta.get(name)
+
+        def _put_meta(self, name, value):
+            self._meta[name] = value
+
+    def test_store_no_snapshots(self):
+        """Test that stores without snapshot support ignore them."""
+        store = TestDataStores._TestStore()
+        store.add_index("test")
+        store.save_indexes()
+        assert not store.load_indexes()
+
+    def test_store_generation(self):
+        """Test that committing a store advances its generation."""
+        store = self._SnapshotStore()
+        assert store.generation == 0
+        store.commit()
+        assert store.generation == 0
+        store.put("test", {"test": 1})
+        store.commit()
+        assert store.generation == 1
+        assert store._meta["generation"] == 1
+        # A new store instance picks up the saved generation.
+        assert self._SnapshotStore(store._meta).generation == 1
+
+    def test_store_save_load_indexes(self):
+        """Test that we can save and reload a store's indexes."""
+        store = self._SnapshotStore()
+        store.add_index("test")
+        store.put("test", {"test": 1})
+        store.commit()
+        store.save_indexes()
+        new_store = self._SnapshotStore(store._meta)
+        new_store._stored = store._stored
+        new_store.add_index("test")
+        assert new_store.load_indexes()
+        assert new_store._indexes == {"test": {1: {"test"}}}
+        # The snapshot is out of date once there has been another commit.
+        store.put("another", {"test": 1})
+        store.commit()
+        new_store = self._SnapshotStore(store._meta)
+        new_store.add_index("test")
+        assert not new_store.load_indexes()
+        # It's also no good if the registered indexes have changed.
+        store.save_indexes()
+        new_store = self._SnapshotStore(store._meta)
+        new_store.add_index("test", unique=True)
+        assert not new_store.load_indexes()
+
+    def test_store_manager_initialize(self):
+        """Test that initializing stores uses snapshots if they're current."""
+        stores = DataStoreManager()
+        store = stores.register("test", self._SnapshotStore())
+        store.add_index("test")
+        store._stored["test"] = {"test": 1}
+        stores.initialize()
+        assert store._indexes == {"test": {1: {"test"}}}
+        assert store._meta["indexes"]["indexes"] == store._indexes
+        # Data that changes behind the store's back won't be picked up.
+        store._stored["another"] = {"test": 1}
+        stores.initialize()
+        assert store._indexes == {"test": {1: {"test"}}}
+
+
+class TestCompositeIndexes:
+
+    """A collection of tests for indexes on more than one key."""
+
+    def test_store_composite_index(self):
+        """Test that we can find data through a composite index."""
+        store = TestDataStores._TestStore()
+        store.add_index(("x", "y"))
+        store.put("a", {"x": 1, "y": 2})
+        store.put("b", {"x": 1, "y": 3})
+        store.put("c", {"x": 1})
+        store.commit()
+        assert store._indexes[("x", "y")] == {(1, 2): {"a"}, (1, 3): {"b"}}
+        assert store.find(x=1, y=2) == ["a"]
+        assert store.find(y=3, x=1) == ["b"]
+        assert not store.find(x=2, y=2)
+        # Keys not covered by an index fall back to searching the store.
+        assert sorted(store.find(x=1)) == ["a", "b", "c"]
+        store.delete("a")
+        store.commit()
+        assert not store.find(x=1, y=2)
+        assert store.find(x=1, y=3) == ["b"]
+
+    def test_store_composite_index_unique(self):
+        """Test that a unique composite index can't have duplicates."""
+        store = TestDataStores._TestStore()
+        store.add_index(("x", "y"), unique=True)
+        store.put("a", {"x": 1, "y": 2})
+        store.commit()
+        store.put("b", {"x": 1, "y": 2})
+        with pytest.raises(KeyError):
+            store.commit()
+
+    def test_store_partial_index(self):
+        """Test that indexes narrow down finds that they don't fully cover."""
+        store = TestDataStores._TestStore()
+        store.add_index("x")
+        assert store.has_index("x") and not store.has_index("y")
+        store.put("a", {"x": 1, "y": 2})
+        store.put("b", {"x": 1, "y": 3})
+        store.put("c", {"x": 2, "y": 2})
+        store.commit()
+        # Only the data for keys found in the index should be checked.
+        store._keys = None
+        assert store.find(x=1, y=2) == ["a"]
+        assert not store.find(x=2, y=3)
+        assert not store.find(x=1, y=2, ignore_keys=["a"])
+
+    def test_store_index_selectivity(self):
+        """Test that finds start from the index with the fewest matches."""
+        store = TestDataStores._TestStore()
+        store.add_index("type")
+        store.add_index("name")
+        for n in range(20):
+            store.put(str(n), {"type": "room", "name": "room" + str(n)})
+        store.put("char", {"type": "char", "name": "room5"})
+        store.commit()
+        with patch.object(store, "_get_index_keys",
+                          wraps=store._get_index_keys) as get_index_keys:
+            assert store.find(type="room", name="room5") == ["5"]
+            assert store.find(name="room5", type="char") == ["char"]
+            assert not store.find(type="room", name="nope")
+            # The keys of every room were never gathered.
+            assert ("type", None, "room") not in [
+                call[0] for call in get_index_keys.call_args_list]
+            assert get_index_keys.call_count == 3
+
+
+class TestRangeLookups:
+
+    """A collection of tests for range and prefix lookups."""
+
+    def test_store_range_lookups(self):
+        """Test that we can find data by ranges of values."""
+        store = TestDataStores._TestStore()
+        store.put("a", {"level": 1, "name": "Bob"})
+        store.put("b", {"level": 5, "name": "Bobby"})
+        store.put("c", {"level": 10, "name": "Alice"})
+        store.put("d", {"level": None, "name": 5})
+        # These are found in the transaction.
+        assert sorted(store.find(level__gte=5)) == ["b", "c"]
+        store.commit()
+        # And these by scanning the store.
+        assert sorted(store.find(level__gt=1)) == ["b", "c"]
+        assert sorted(store.find(level__lte=5)) == ["a", "b"]
+        assert store.find(level__lt=5) == ["a"]
+        assert sorted(store.find(level__between=(2, 10))) == ["b", "c"]
+        assert sorted(store.find(name__startswith="Bob")) == ["a", "b"]
+        assert store.find(name__startswith="Bob", level__gt=1) == ["b"]
+
+    def test_store_sorted_index(self):
+        """Test that sorted indexes are searched by range."""
+        store = TestDataStores._TestStore()
+        with pytest.raises(ValueError):
+            store.add_index(("level", "name"), sorted=True)
+        store.add_index("level", sorted=True)
+        store.add_index("name", sorted=True)
+        store.put("a", {"level": 1, "name": "Bob"})
+        store.put("b", {"level": 5, "name": "Bobby"})
+        store.put("c", {"level": 10, "name": "Alice"})
+        store.put("d", {"level": None, "name": 5})
+        store.commit()
+        assert store._sorted_keys["level"] == ([1, 5, 10], {None})
+        with patch.object(store, "_find_in_store") as find_in_store:
+            assert sorted(store.find(level__gte=5)) == ["b", "c"]
+            assert sorted(store.find(level__between=(2, 10))) == ["b", "c"]
+            assert sorted(store.find(name__startswith="Bob")) == ["a", "b"]
+            assert store.find(level__lt=5, name__startswith="B") == ["a"]
+            assert not store.find(level__gt="nope")
+            assert not find_in_store.called
+        # Values are removed from the sorted index once nothing has them.
+        store.put("b", {"level": 6, "name": "Bobby"})
+        store.commit()
+        assert store._sorted_keys["level"] == ([1, 6, 10], {None})
+        assert store.find(level__between=(2, 6)) == ["b"]
+
+    def test_store_sorted_index_build(self):
+        """Test that sorted indexes are sorted once when they are built."""
+        store = TestDataStores._TestStore()
+        store.add_index("level", sorted=True)
+        for n, level in enumerate((5, None, 1, 10, 1)):
+            store._stored[str(n)] = {"level": level}
+        with patch("cwmud.core.storage.insort") as insort:
+            store.build_indexes()
+            assert not insort.called
+        assert store._sorted_keys["level"] == ([1, 5, 10], {None})
+        assert sorted(store.find(level__lt=6)) == ["0", "2", "4"]
+
+    def test_store_range_selectivity(self):
+        """Test that finds start from the narrowest range lookup."""
+        store = TestDataStores._TestStore()
+        store.add_index("x", sorted=True)
+        store.add_index("z", sorted=True)
+        for n in range(30):
+            store.put(str(n), {"x": n, "z": n % 2})
+        store.commit()
+        with patch.object(store, "_get_index_keys",
+                          wraps=store._get_index_keys) as get_index_keys:
+            assert sorted(store.find(z__between=(0, 1),
+                                     x__between=(4, 5))) == ["4", "5"]
+            get_index_keys.assert_called_once_with("x", "between", (4, 5))
+
+
+class TestTransactionIndexes:
+
+    """A collection of tests for indexes over pending data."""
+
+    def test_store_transaction_indexes(self):
+        """Test that pending data is found through the indexes."""
+        store = TestDataStores._TestStore()
+        store.add_index("name")
+        store.put("a", {"name": "one"})
+        store.add_index("level", sorted=True)
+        store.put("b", {"name": "two", "level": 2})
+        assert store._transaction_indexes["name"] == {"one": {"a"},
+                                                      "two": {"b"}}
+        assert store._transaction_indexes["level"] == {2: {"b"}}
+        checked = []
+        find_in_items = store._find_in_items
+
+        def _find_in_items(items, ignore_keys, key_value_pairs):
+            items = list(items)
+            checked.append(items)
+            return find_in_items(items, ignore_keys, key_value_pairs)
+
+        store._find_in_items = _find_in_items
+        assert store.find(name="two") == ["b"]
+        assert store.find(level__gte=1) == ["b"]
+        # Only the data the indexes matched should have been checked.
+        assert checked == [[("b", {"name": "two", "level": 2})]] * 2
+        store.put("b", {"name": "three"})
+        assert store._transaction_indexes["name"] == {"one": {"a"},
+                                                      "three": {"b"}}
+        assert not store.find(name="two")
+        store.delete("a")
+        assert not store.find(name="one")
+        store.abort()
+        assert not store._transaction_indexes
+        assert not store.find(name="three")
+
+    def test_store_prune_without_reading(self):
+        """Test that old index values are pruned without reading them."""
+        store = TestDataStores._TestStore()
+        store.add_index("name")
+        store.put("a", {"name": "one"})
+        store.commit()
+        with patch.object(store, "_get", side_effect=AssertionError):
+            store.put("a", {"name": "two"})
+            store.commit()
+        assert store._indexes["name"] == {"two": {"a"}}
+        assert store._index_values == {"a": {"name": "two"}}
+        store.delete("a")
+        store.commit()
+        assert not store._indexes["name"] and not store._index_values
+
+
+class TestBackgroundCommits:
+
+    """A collection of tests for committing data in the background."""
+
+    class _SlowStore(TestDataStores._TestStore):
+
+        """A test store that waits for permission to write."""
+
+        def __init__(self):
+            super().__init__()
+            self.ready = Event()
+
+        def _write(self, items):
+            self.ready.wait(5)
+            super()._write(items)
+
+    def test_store_commit_background(self):
+        """Test that data can be read back while it is being written."""
+        store = self._SlowStore()
+        store.add_index("test")
+        store.put("test", {"test": 1})
+        store.put("another", {"test": 2})
+        store.ready.set()
+        store.commit()
+        store.ready.clear()
+        store.put("test", {"test": 3})
+        store.delete("another")
+        future = store.commit(background=True)
+        assert not store.pending and store.writing
+        assert not future.done()
+        assert store._stored["test"] == {"test": 1}
+        assert store.get("test") == {"test": 3}
+        assert store.has("test") and not store.has("another")
+        assert list(store.keys()) == ["test"]
+        assert store.find(test=3) == ["test"]
+        assert not store.find(test=1) and not store.find(test=2)
+        store.ready.set()
+        store.flush()
+        assert future.done() and not store.writing
+        assert store._stored == {"test": {"test": 3}}
+        assert store.find(test=3) == ["test"]
+
+    def test_store_find_in_flight_indexes(self):
+        """Test that data being written is found through its indexes."""
+        store = self._SlowStore()
+        store.add_index("test")
+        for n in range(10):
+            store.put(str(n), {"test": n})
+        store.commit(background=True)
+        store.put("0", {"test": 10})
+        store.commit(background=True)
+        checked = []
+        find_in_items = store._find_in_items
+
+        def _find_in_items(items, ignore_keys, key_value_pairs):
+            items = list(items)
+            checked.extend(key for key, data in items)
+            return find_in_items(items, ignore_keys, key_value_pairs)
+
+        store._find_in_items = _find_in_items
+        with patch.object(store, "_get_all_in_flight") as get_all_in_flight:
+            assert store.find(test=5) == ["5"]
+            assert store.find(test=10) == ["0"]
+            # The newer data for a key hides what is still being written.
+            assert not store.find(test=0)
+        assert not get_all_in_flight.called
+        # Only the data the indexes matched should have been checked.
+        assert sorted(checked) == ["0", "0", "5"]
+        # A new index isn't in the in-flight indexes, so it's checked
+        # against all of their data instead.
+        store.add_index("other")
+        assert not store.find(other=1)
+        store.ready.set()
+        store.flush()
+        assert store.find(test=10) == ["0"]
+        assert not store.find(test=0)
+
+    def test_store_commit_waits_for_background(self):
+        """Test that a normal commit waits for background writes."""
+        store = self._SlowStore()
+        store.put("test", {"test": 1})
+        future = store.commit(background=True)
+        store.put("test", {"test": 2})
+        store.ready.set()
+        store.commit()
+        assert future.done()
+        assert store._stored["test"] == {"test": 2}
+
+    def test_store_commit_background_failed(self):
+        """Test that data from a failed background write is kept."""
+        store = self._SlowStore()
+        store.ready.set()
+        store.put("test", {"test": 1})
+        store.put("another", {"test": 2})
+        with patch.object(store, "_write", side_effect=OSError):
+            store.commit(background=True)
+            # Newer data for a key replaces what failed to be written.
+            store.put("another", {"test": 3})
+            store.flush()
+        assert store.pending
+        assert store.has("test") and store.get("test") == {"test": 1}
+        assert store.get("another") == {"test": 3}
+        store.commit()
+        assert store._stored == {"test": {"test": 1}, "another": {"test": 3}}
+
+    def test_store_manager_commit_background(self):
+        """Test that we can commit all stores in the background."""
+        stores = DataStoreManager()
+        store = stores.register("test", self._SlowStore())
+        assert stores.commit(background=True).done()
+        store.put("test", {"test": 1})
+        future = stores.commit(background=True)
+        assert not future.done()
+        store.ready.set()
+        stores.flush()
+        assert future.done()
+        assert store._stored["test"] == {"test": 1}
+
+    def test_store_manager_commit_background_unchanged(self):
+        """Test that an unchanged store doesn't hide a store's write."""
+        stores = DataStoreManager()
+        store = stores.register("test", self._SlowStore())
+        unchanged = stores.register("unchanged", self._SlowStore())
+        unchanged.ready.set()
+        unchanged.put("test", {"test": 1})
+        unchanged.commit()
+        unchanged.put("test", {"test": 1})
+        store.put("test", {"test": 1})
+        future = stores.commit(background=True)
+        assert not unchanged.pending
+        assert not future.done()
+        store.ready.set()
+        future.result(5)
+        assert store._stored["test"] == {"test": 1}
+
+
+class TestWriteElision:
+
+    """A collection of tests for skipping unchanged writes."""
+
+    def test_store_commit_unchanged(self):
+        """Test that committing unchanged data doesn't write it again."""
+        store = TestDataStores._TestStore()
+        writes = []
+        store._put = lambda key, data: writes.append(key)
+        store.put("test", {"test": 1})
+        store.commit()
+        assert writes == ["test"]
+        store.put("test", {"test": 1})
+        store.commit()
+        assert writes == ["test"] and store.elided_count == 1
+        assert not store.pending
+        store.put("test", {"test": 2})
+        store.commit()
+        assert writes == ["test", "test"]
+        # Once deleted, the same data needs to be written again.
+        store._stored["test"] = {"test": 2}
+        store.delete("test")
+        store.commit()
+        store.put("test", {"test": 2})
+        store.commit()
+        assert writes == ["test", "test", "test"]
+        assert store.elided_count == 1
+
+    def test_store_manager_commit_unchanged(self):
+        """Test that the store manager counts unchanged writes."""
+        stores = DataStoreManager()
+        store = stores.register("test", TestDataStores._TestStore())
+        store.put("test", {"test": 1})
+        stores.commit()
+        store.put("test", {"test": 1})
+        stores.commit()
+        assert store.elided_count == 1
+
+
+class TestReadCache:
+
+    """A collection of tests for caching decoded blobs."""
+
+    def test_store_read_cache(self):
+        """Test that reads of the same key are served from the cache."""
+        store = TestDataStores._TestStore(cache_size=2)
+        store._stored["a"] = {"test": 1}
+        store._stored["b"] = {"test": 2}
+        store._stored["c"] = {"test": 3}
+        assert store.get("a") == {"test": 1}
+        assert store.cache_misses == 1 and store.cache_hits == 0
+        # The data handed out should be a copy of what is cached.
+        store.get("a")["test"] = 5
+        assert store.get("a") == {"test": 1}
+        assert store.cache_misses == 1 and store.cache_hits == 2
+        store.get("b")
+        store.get("c")
+        # The least recently used key should have been evicted.
+        store.get("a")
+        assert store.cache_misses == 4
+
+    def test_store_read_cache_commit(self):
+        """Test that committing data invalidates its cached copy."""
+        store = TestDataStores._TestStore(cache_size=10)
+        store._stored["a"] = {"test": 1}
+        assert store.get("a") == {"test": 1}
+        store.put("a", {"test": 2})
+        store.commit()
+        assert store.get("a") == {"test": 2}
+        store.delete("a")
+        store.commit()
+        assert not store.has("a")
+
+    def test_store_get_many(self):
+        """Test that we can get many keys with one batch from the store."""
+        store = TestDataStores._TestStore(cache_size=10)
+        store._stored.update(a={"test": 1}, b={"test": 2}, c={"test": 3})
+        store.get("c")
+        store.put("d", {"test": 4})
+        store.delete("b")
+        batches = []
+        get_many = store._get_many
+        store._get_many = lambda keys: batches.append(keys) or get_many(keys)
+        found = store.get_many(["d", "a", "b", "c", "nope", "a"])
+        assert list(found.items()) == [("d", {"test": 4}), ("a", {"test": 1}),
+                                       ("c", {"test": 3})]
+        # Only the keys that weren't in the transaction or cache are read.
+        assert batches == [["a", "nope"]]
+        assert store.cache_misses == 2 and store.cache_hits == 1
+        found["a"]["test"] = 5
+        assert store.get_many(["a"], readonly=True) == {"a": {"test": 1}}
+        assert batches == [["a", "nope"]]
+
+    def test_store_prefetch(self):
+        """Test that prefetching keys reads them into the cache at once."""
+        store = TestDataStores._TestStore(cache_size=10)
+        store._stored.update(a={"test": 1}, b={"test": 2})
+        store.prefetch(["a", "b"])
+        assert store.cache_misses == 2
+        assert store.get("a") == {"test": 1} and store.get("b")
+        assert store.cache_misses == 2 and store.cache_hits == 2
+        # Stores without a cache ignore it.
+        store = TestDataStores._TestStore()
+        store._stored["a"] = {"test": 1}
+        with patch.object(store, "_get_many") as get_many:
+            store.prefetch(["a"])
+        assert not get_many.called
+
+
+class TestReadOnlyViews:
+
+    """A collection of tests for read-only views of stored data."""
+
+    def test_store_get_readonly(self):
+        """Test that read-only gets share the data in the transaction."""
+        store = TestDataStores._TestStore()
+        data = {"test": 1, "list": [1, {"a": 2}]}
+        store.put("test", data)
+        view = store.get("test", readonly=True)
+        assert isinstance(view, FrozenDict) and view == data
+        assert isinstance(view["list"], FrozenList)
+        assert view["list"][1]["a"] == 2
+        with pytest.raises(TypeError):
+            view["test"] = 2
+        with pytest.raises(TypeError):
+            view["list"][1]["a"] = 3
+        # Changes to the transaction show through the view.
+        data["test"] = 2
+        assert view["test"] == 2
+        # Thawing gives a copy that can be changed.
+        thawed = view.thaw()
+        thawed["list"].append(3)
+        assert thawed == {"test": 2, "list": [1, {"a": 2}, 3]}
+        assert data["list"] == [1, {"a": 2}]
+
+    def test_store_get_readonly_owned(self):
+        """Test that freshly read data is handed over when thawed."""
+        store = TestDataStores._TestStore()
+        store._stored["test"] = {"test": 1}
+        view = store.get("test", readonly=True)
+        assert view.thaw() is store._stored["test"]
+        # Only the first thaw can take the data.
+        assert view.thaw() is not store._stored["test"]
+
+
+class TestMissingFilter:
+
+    """A collection of tests for filtering out missing data."""
+
+    def test_store_filter(self):
+        """Test that a store's filter skips looking for missing data."""
+        store = TestDataStores._TestStore(filter_size=100)
+        store.add_index("name")
+        store._stored["a"] = {"name": "test"}
+        # The filter isn't used until it is built.
+        assert store._filter is None and not store._is_filtered("b")
+        store.build_filter()
+        reads = []
+        store._has = lambda key: reads.append(key) or key in store._stored
+        assert store.has("a") and reads == ["a"]
+        assert not store.has("b") and reads == ["a"]
+        assert store.get("b", default=1) == 1
+        store.build_indexes()
+        with patch.object(store, "_find_in_index") as find_in_index:
+            assert not store.find(name="nope")
+            assert not find_in_index.called
+        # Committed data should be added to the filter.
+        store.put("b", {"name": "new"})
+        store.commit()
+        assert store.has("b") and store.find(name="new") == ["b"]
+
+    def test_store_filter_add_index(self):
+        """Test that adding an index drops a filter without its values."""
+        store = TestDataStores._TestStore(filter_size=100)
+        store.put("a", {"foo": 1})
+        store.commit()
+        store.build_filter()
+        store.add_index("foo")
+        store.build_indexes()
+        assert store._filter is None
+        assert store.find(foo=1) == ["a"]
+        store.build_filter()
+        assert store.find(foo=1) == ["a"] and not store.find(foo=2)
+        assert store._is_filtered(key_value_pairs={"foo": 2})
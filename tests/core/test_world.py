@@ -48,6 +48,41 @@ class TestRooms:
         gc.collect()
         assert not self.room.get_exits()
 
+    def test_room_get_at(self):
+        """Test that we can get rooms by their coordinates."""
+        assert Room.get_at(5, 5, 5) is self.room
+        assert Room.get_at(5, 5, 6) is None
+        with pytest.raises(KeyError):
+            Room.get_at(5, 5, 6, default=KeyError)
+        # Moving a room moves it in the spatial index too.
+        self.room.z = 4
+        assert Room.get_at(5, 5, 5) is None
+        assert Room.get_at(5, 5, 4) is self.room
+        self.room.z = 5
+        assert Room.get_at(5, 5, 5) is self.room
+
+    def test_room_find_near(self):
+        """Test that we can find the rooms around a set of coordinates."""
+        assert (5, 5, 5) not in Room.find_near(5, 5, 5)
+        assert Room.find_near(5, 5, 6)[(5, 5, 5)] is self.room
+        another_room = Room()
+        another_room.x, another_room.y, another_room.z = (5, 5, 7)
+        found = Room.find_near(5, 5, 6)
+        assert found[(5, 5, 5)] is self.room
+        assert found[(5, 5, 7)] is another_room
+        found = Room.find_in_box((5, 5, 7), (5, 5, 5))
+        assert found == {(5, 5, 5): self.room, (5, 5, 7): another_room}
+        # Large boxes are searched through the store's indexes.
+        another_room.save()
+        Room._store.commit()
+        found = Room.find_in_box((0, 0, 7), (10, 10, 0))
+        assert found[(5, 5, 5)] is self.room
+        assert found[(5, 5, 7)] is another_room
+        assert all(0 <= coord <= 10 for coords in found for coord in coords)
+        another_room.delete()
+        Room._store.commit()
+        assert Room.get_at(5, 5, 7) is None
+
     def test_room_chars(self):
         """Test that a room's character list functions properly."""
         assert not self.room.chars
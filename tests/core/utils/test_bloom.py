@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Tests for Bloom filters."""
+# Part of Clockwork MUD Server (https://github.com/whutch/cwmud)
+# :copyright: (c) 2008 - 2017 Will Hutcheson
+# :license: MIT (https://github.com/whutch/cwmud/blob/master/LICENSE.txt)
+
+import pytest
+
+from cwmud.core.utils.bloom import BloomFilter
+
+
+def test_bloom_filter_create():
+    """Test that we can create a Bloom filter."""
+    with pytest.raises(ValueError):
+        BloomFilter(0)
+    with pytest.raises(ValueError):
+        BloomFilter(10, error_rate=1)
+    bloom = BloomFilter(100)
+    assert len(bloom) == 0
+    assert "test" not in bloom
+
+
+def test_bloom_filter_contains():
+    """Test that a Bloom filter contains what was added to it."""
+    bloom = BloomFilter(1000)
+    bloom.update(range(1000))
+    bloom.add(("x", (1, 2, 3)))
+    assert len(bloom) == 1001
+    assert all(number in bloom for number in range(1000))
+    assert ("x", (1, 2, 3)) in bloom
+    # There should only be a few false positives.
+    false_positives = sum(number in bloom for number in range(1000, 11000))
+    assert false_positives < 300
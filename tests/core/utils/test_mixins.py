@@ -7,7 +7,8 @@
 import gc
 from weakref import finalize
 
-from cwmud.core.utils.mixins import HasFlags, HasParent, HasTags, HasWeaks
+from cwmud.core.utils.mixins import (HasFlags, HasFlagsMeta, HasParent,
+                                     HasTags, HasWeaks, HasWeaksMeta)
 
 
 class TestHasFlags:
@@ -313,6 +314,33 @@ class TestHasWeaks:
         assert self._TestClass.count == 0
 
 
+class TestSlottedMixins:
+
+    """A collection of tests for using the mix-ins with __slots__."""
+
+    class _TestMeta(HasFlagsMeta, HasWeaksMeta):
+        pass
+
+    class _TestClass(HasFlags, HasTags, HasWeaks, metaclass=_TestMeta):
+
+        __slots__ = ("_flags", "_inst_weak_refs", "_tags", "__weakref__")
+
+    def test_slotted_mixins(self):
+        """Test that the mix-ins work on a class without a __dict__."""
+        instance = self._TestClass()
+        assert not hasattr(instance, "__dict__")
+        # The flag set, tags and weak references are only created when used.
+        assert instance._flags is None and instance._tags is None
+        assert not instance._get_weak("test")
+        assert instance._inst_weak_refs is None
+        instance.flags.add("test")
+        instance.tags["test"] = 1
+        instance._set_weak("test", instance)
+        assert "test" in instance.flags and instance.tags["test"] == 1
+        assert instance._get_weak("test") is instance
+        assert not self._TestClass._get_weak("test")
+
+
 class TestHasParent:
 
     """A collection of tests for parents mix-in class."""